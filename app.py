@@ -2,51 +2,100 @@
 import streamlit as st
 st.set_page_config(page_title="TRUCCO", page_icon="🡕", layout="wide")
 
-from dashboard import mostrar_dashboard
+from dashboard import mostrar_dashboard, preprocess_ventas_data, anexar_ventas_canonicas
+from cache_datos import digest_fichero, combinar_digests, leer_libro, guardar_libro
+from ingesta import (
+    HOJA_COMPRA, HOJA_TRASPASOS, HOJA_VENTAS, HOJAS_LIBRO, HOJAS_INCREMENTALES,
+    DIMENSION_PRODUCTO, DIMENSION_TIENDA, VERSION_ESQUEMA, parsear_libro, informe_esquema, completar_dimensiones,
+    hojas_del_libro, anexar_libro, codificar_claves
+)
+from datos_entrenamiento import RUTA_ENTRENAMIENTO, cargar_datos_entrenamiento
+import precalculo
+import filtros_recientes
 import pandas as pd
 import base64
 import os
 
 # Performance optimization: Set pandas options
 pd.options.mode.chained_assignment = None  # default='warn'
+# Copy-on-write: filtered frames share memory with the canonical sales table until
+# written to, so sections can derive columns without copying it first
+pd.options.mode.copy_on_write = True
 
 # Function to get absolute path for assets
 def get_asset_path(filename):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(current_dir, "assets", filename)
 
+# Tables stored per dataset in the disk cache: the three sheets plus the product and
+# store dimensions
+TABLAS_CACHE = HOJAS_LIBRO + (DIMENSION_PRODUCTO, DIMENSION_TIENDA)
+
+def _guardar_en_cache(clave, tablas):
+    try:
+        guardar_libro(clave, tablas)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el libro en la caché: {e}")
+
 # Cached function for loading Excel data
 @st.cache_data
-def load_excel_data(file):
+def load_excel_data(_file, digest):
     """Cache the Excel file loading to avoid reprocessing on every interaction"""
-    xls = pd.ExcelFile(file, engine="openpyxl")
-    df_productos = xls.parse("Compra")
-    df_traspasos = xls.parse("Traspasos de almacén a tienda")
-    df_ventas = xls.parse("ventas 23 24 25")
-    
-    # Don't convert to categories to avoid issues with new values being added later
-    # Just ensure proper data types for numeric columns
-    for df in [df_productos, df_traspasos, df_ventas]:
-        # Convert numeric columns to appropriate types
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                # Try to convert to numeric if possible
-                try:
-                    pd.to_numeric(df[col], errors='raise')
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                except (ValueError, TypeError):
-                    # Keep as object if conversion fails
-                    pass
-    
-    return df_productos, df_traspasos, df_ventas
+    # Keyed on the content digest only: Streamlit does not hash the uploaded file.
+    # Persistent Parquet cache shared across sessions and restarts
+    clave = f"{digest}-e{VERSION_ESQUEMA}"
+    tablas = leer_libro(clave, TABLAS_CACHE)
+    if tablas is not None:
+        return tablas
 
-# Cached function for filtering data by season
-@st.cache_data
-def filter_by_season(df_ventas, temporada_seleccionada):
-    """Cache the season filtering to avoid reprocessing"""
-    if temporada_seleccionada != "Todas las temporadas":
-        return df_ventas[df_ventas["Temporada"] == temporada_seleccionada]
-    return df_ventas
+    # Parse the three sheets in parallel (the declared schema is applied inside each worker),
+    # then encode the join keys with dictionaries shared by the three sheets
+    tablas = completar_dimensiones(codificar_claves(parsear_libro(_file.getvalue(), HOJAS_LIBRO)))
+    _guardar_en_cache(clave, tablas)
+    return tablas
+
+def append_excel_data(tablas_base, base_digest, file, delta_digest):
+    """Append a workbook holding only the new period (sales and transfers) to the loaded dataset"""
+    # The resulting dataset is identified by the base digest plus every appended delta
+    digest = combinar_digests(base_digest, delta_digest)
+    clave = f"{digest}-e{VERSION_ESQUEMA}"
+    tablas = leer_libro(clave, TABLAS_CACHE)
+    if tablas is not None:
+        return digest, tablas
+
+    data = file.getvalue()
+    hojas = [hoja for hoja in HOJAS_INCREMENTALES if hoja in hojas_del_libro(data)]
+    if not hojas:
+        raise ValueError(f"El archivo no contiene ninguna de las hojas {', '.join(HOJAS_INCREMENTALES)}")
+    # Only the delta is parsed and encoded: it is deduplicated against the history, its keys
+    # extend the history dictionaries and aggregates and dimensions are updated from it
+    tablas, anadidas = anexar_libro(tablas_base, parsear_libro(data, hojas))
+    print(f"ℹ️ Filas añadidas: {anadidas}")
+    _guardar_en_cache(clave, tablas)
+    return digest, tablas
+
+TODAS_LAS_TEMPORADAS = "Todas las temporadas"
+
+def prewarm_sections():
+    """Start computing every dashboard section with the default filters in the background"""
+    precalculo.precalentar(
+        (st.session_state.dataset_digest, TODAS_LAS_TEMPORADAS),
+        st.session_state.ventas,
+        st.session_state.tablas[HOJA_COMPRA],
+        st.session_state.tablas[HOJA_TRASPASOS],
+    )
+
+def _season_slice(df_ventas, temporada_seleccionada):
+    return df_ventas[df_ventas["Temporada"] == temporada_seleccionada]
+
+# Season filtering memoised per session on (digest, season): no frame hashing or
+# pickling of the result, recent seasons are kept under the session memory budget
+def filter_by_season(df_ventas, digest, temporada_seleccionada):
+    """Season slice of the canonical sales frame, memoised on the dataset digest"""
+    if temporada_seleccionada == TODAS_LAS_TEMPORADAS:
+        return df_ventas
+    return filtros_recientes.recordar((digest, temporada_seleccionada), _season_slice,
+                                      df_ventas, temporada_seleccionada)
 
 # Estilos CSS
 st.markdown("""
@@ -163,17 +212,52 @@ else:
 
         if file:
             try:
-                # Use session state to avoid reloading data if file hasn't changed
-                file_hash = hash(file.getvalue())
-                if 'file_hash' not in st.session_state or st.session_state.file_hash != file_hash:
+                # Use session state to avoid reloading data if file hasn't changed.
+                # The content digest is the dataset identity shared by every cache.
+                upload_digest = digest_fichero(file)
+                if st.session_state.get('upload_digest') != upload_digest:
                     with st.spinner("Cargando y procesando datos..."):
-                        st.session_state.file_hash = file_hash
-                        st.session_state.df_productos, st.session_state.df_traspasos, st.session_state.df_ventas = load_excel_data(file)
+                        st.session_state.tablas = load_excel_data(file, upload_digest)
+                        st.session_state.upload_digest = upload_digest
+                        st.session_state.dataset_digest = upload_digest
+                        st.session_state.deltas_aplicados = []
+                        # Canonical sales table, built once per dataset (dates, derived Mes/año/mes...)
+                        st.session_state.ventas = preprocess_ventas_data(st.session_state.tablas[HOJA_VENTAS],
+                                                                         version=upload_digest)
+                        prewarm_sections()
                     st.sidebar.success("Archivo cargado correctamente")
-                
-                df_productos = st.session_state.df_productos
-                df_traspasos = st.session_state.df_traspasos
-                df_ventas = st.session_state.df_ventas
+
+                    # Report unknown / missing columns once per upload
+                    for hoja in HOJAS_LIBRO:
+                        informe = informe_esquema(list(st.session_state.tablas[hoja].columns), hoja)
+                        if informe['faltantes']:
+                            st.sidebar.error(f"Hoja '{hoja}': faltan columnas {', '.join(informe['faltantes'])}")
+                        if informe['desconocidas']:
+                            print(f"ℹ️ Hoja '{hoja}': columnas no declaradas en el esquema: {informe['desconocidas']}")
+
+                # Optional append mode: a workbook with only the new weeks of sales and transfers
+                delta_file = st.sidebar.file_uploader("Añadir periodo nuevo (ventas y traspasos)", type=["xlsx"], key="delta_file")
+                if delta_file:
+                    delta_digest = digest_fichero(delta_file)
+                    if delta_digest not in st.session_state.deltas_aplicados:
+                        with st.spinner("Añadiendo periodo nuevo..."):
+                            filas_previas = len(st.session_state.tablas[HOJA_VENTAS])
+                            st.session_state.dataset_digest, st.session_state.tablas = append_excel_data(
+                                st.session_state.tablas, st.session_state.dataset_digest, delta_file, delta_digest
+                            )
+                            st.session_state.deltas_aplicados.append(delta_digest)
+                            # Only the appended sales rows are preprocessed, cached under a per-delta token,
+                            # and joined to the canonical table instead of preprocessing the whole history again
+                            ventas_delta = preprocess_ventas_data(st.session_state.tablas[HOJA_VENTAS].iloc[filas_previas:],
+                                                                  version=(st.session_state.dataset_digest, 'delta'))
+                            st.session_state.ventas = anexar_ventas_canonicas(st.session_state.ventas, ventas_delta)
+                            prewarm_sections()
+                        st.sidebar.success("Periodo nuevo añadido")
+
+                dataset_digest = st.session_state.dataset_digest
+                df_productos = st.session_state.tablas[HOJA_COMPRA]
+                df_traspasos = st.session_state.tablas[HOJA_TRASPASOS]
+                df_ventas = st.session_state.ventas
 
                 seccion = st.sidebar.selectbox("Área de Análisis", [
                     "Resumen General",
@@ -184,13 +268,16 @@ else:
                 # --- Filtro de temporada ---
                 temporadas = df_ventas["Temporada"].dropna().unique().tolist()
                 temporadas.sort()
-                temporadas_opciones = ["Todas las temporadas"] + temporadas
+                temporadas_opciones = [TODAS_LAS_TEMPORADAS] + temporadas
                 temporada_seleccionada = st.sidebar.selectbox("Temporada", temporadas_opciones)
-                if temporada_seleccionada != "Todas las temporadas":
-                    df_ventas = filter_by_season(df_ventas, temporada_seleccionada)
+                if temporada_seleccionada != TODAS_LAS_TEMPORADAS:
+                    df_ventas = filter_by_season(df_ventas, dataset_digest, temporada_seleccionada)
                 # --- Fin filtro de temporada ---
                 with st.spinner("Generando dashboard..."):
-                    mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion)
+                    mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion,
+                                      version=(dataset_digest, temporada_seleccionada),
+                                      df_dim_producto=st.session_state.tablas[DIMENSION_PRODUCTO],
+                                      df_dim_tienda=st.session_state.tablas[DIMENSION_TIENDA])
 
             except Exception as e:
                 st.error(f"Error al procesar el archivo: {e}")
@@ -206,12 +293,10 @@ else:
         st.markdown("Utiliza los modelos entrenados para predecir ventas futuras")
         
         # Check if training data exists
-        training_data_path = 'data/datos_modelo_catboost.xlsx'
-        if os.path.exists(training_data_path):
+        if os.path.exists(RUTA_ENTRENAMIENTO):
             try:
-                # Load training data for predictions
-                df_training = pd.read_excel(training_data_path)
-                df_training['Fecha Documento'] = pd.to_datetime(df_training['Fecha Documento'], format='%d/%m/%Y', errors='coerce', dayfirst=True)
+                # Load training data for predictions (typed copy shared with the dashboard, no Excel parse per rerun)
+                df_training = cargar_datos_entrenamiento()
                 
                 # Show prediction interface
                 show_prediction_interface(df_training)
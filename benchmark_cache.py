@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark del coste por rerun de la caché de las funciones del dashboard.
+
+Compara un acierto de caché de cada función cacheada hasheando su DataFrame
+(st.cache_data, el esquema anterior) con un acierto por el token de versión del
+dataset (precalculo.por_version).
+
+Las predicciones se miden aparte: antes recibían timestamp=datetime.now(), así que
+cada rerun las recalculaba entero (preparación del dataset y predicción). Se miden
+con modelos de prueba que devuelven ceros, de modo que el tiempo "antes" es una
+cota inferior (sin el coste de predecir con CatBoost). La hoja de ventas del libro
+hace de dataset de entrenamiento.
+
+Uso: python benchmark_cache.py libro.xlsx [--repetir N]
+    --repetir N  concatena la hoja de ventas N veces para simular un libro mayor
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+warnings.filterwarnings('ignore')
+
+# Añadir el directorio actual al path de Python
+sys.path.append(os.getcwd())
+
+
+def medir(funcion, repeticiones=5):
+    """Mejor tiempo en ms de funcion() en varias ejecuciones"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos) * 1000
+
+
+class ModeloPrueba:
+    """Modelo de prueba con la interfaz de CatBoost: predice ceros"""
+
+    def predict(self, pool):
+        import numpy as np
+        return np.zeros(pool.num_row())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("libro", help="libro Excel con las hojas de Compra, Traspasos y ventas")
+    parser.add_argument("--repetir", type=int, default=1, help="veces que se repite la hoja de ventas")
+    args = parser.parse_args()
+
+    import logging
+    import pandas as pd
+    import streamlit as st
+    # Fuera de `streamlit run` no hay runtime; se silencian sus avisos
+    logging.disable(logging.WARNING)
+    pd.options.mode.copy_on_write = True
+
+    from cache_datos import digest_fichero
+    from ingesta import HOJA_VENTAS, parsear_libro, codificar_claves
+    from dashboard import (
+        ORIGINAL_MODEL_FILES, preprocess_ventas_data, calculate_store_rankings, calculate_family_rankings,
+        get_temporada_colors, prepare_all_predictions_data, make_all_predictions
+    )
+
+    print(f"📊 Cargando {args.libro}...")
+    with open(args.libro, "rb") as f:
+        tablas = codificar_claves(parsear_libro(f.read()))
+    ventas = tablas[HOJA_VENTAS]
+    if args.repetir > 1:
+        ventas = pd.concat([ventas] * args.repetir, ignore_index=True)
+    digest = f"{digest_fichero(args.libro)}x{args.repetir}"
+    canonica = preprocess_ventas_data(ventas)
+    print(f"   {len(canonica):,} filas de ventas, {canonica.memory_usage(deep=True).sum() / 1e6:,.0f} MB")
+
+    casos = [
+        ("preprocess_ventas_data", preprocess_ventas_data, ventas),
+        ("calculate_store_rankings", calculate_store_rankings, canonica),
+        ("calculate_family_rankings", calculate_family_rankings, canonica),
+        ("get_temporada_colors", get_temporada_colors, canonica),
+    ]
+
+    print(f"\n{'función':<30}{'antes (ms)':>12}{'token (ms)':>12}")
+    print("-" * 54)
+    for nombre, funcion, df in casos:
+        # Esquema anterior: st.cache_data hashea el DataFrame (y deserializa el resultado) en cada acierto
+        por_hash = st.cache_data(funcion.__wrapped__)
+        por_hash(df)
+        antes = medir(lambda: por_hash(df))
+
+        funcion(df, version=digest)
+        despues = medir(lambda: funcion(df, version=digest))
+        print(f"{nombre:<30}{antes:>12.2f}{despues:>12.3f}")
+
+    # Predicciones: el dataset de entrenamiento llega del Excel sin categóricas
+    entrenamiento = ventas.astype({
+        col: object for col, tipo in ventas.dtypes.items() if isinstance(tipo, pd.CategoricalDtype)
+    })
+    configuracion = {'model_en': ModeloPrueba(), 'model_fuera': ModeloPrueba(), 'is_improved': False}
+    for clave in ('config_en', 'config_fuera'):
+        with open(ORIGINAL_MODEL_FILES[clave], 'r') as f:
+            configuracion[clave] = json.load(f)
+    version = (digest, 'entrenamiento')
+
+    # Esquema anterior: timestamp=now() en la clave, cada rerun recalcula
+    antes = medir(lambda: prepare_all_predictions_data.__wrapped__(entrenamiento), repeticiones=2)
+    monthly, _, _ = prepare_all_predictions_data(entrenamiento, version=version)
+    despues = medir(lambda: prepare_all_predictions_data(entrenamiento, version=version))
+    print(f"{'prepare_all_predictions_data':<30}{antes:>12.2f}{despues:>12.3f}")
+
+    antes = medir(lambda: make_all_predictions.__wrapped__(monthly, configuracion), repeticiones=2)
+    make_all_predictions(monthly, configuracion, version=version)
+    despues = medir(lambda: make_all_predictions(monthly, configuracion, version=version))
+    print(f"{'make_all_predictions':<30}{antes:>12.2f}{despues:>12.3f}")
+    print("\n(predicciones medidas con modelos de prueba: el tiempo 'antes' no incluye CatBoost)")
+
+
+if __name__ == "__main__":
+    main()
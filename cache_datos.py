@@ -0,0 +1,192 @@
+"""
+Caché persistente en disco para los libros Excel subidos.
+
+Cada libro se guarda como un directorio de ficheros Parquet (una tabla por hoja)
+identificado por el digest del contenido subido. Cualquier sesión o reinicio del
+servidor que reciba el mismo libro lo recarga sin volver a pasar por openpyxl.
+El tamaño total está limitado y se desalojan primero las entradas usadas hace más tiempo.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get(
+    "TRUCCO_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "excel")
+)
+CACHE_MAX_BYTES = int(os.environ.get("TRUCCO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+_MANIFIESTO = "hojas.json"
+_PREFIJO_TEMPORAL = ".tmp-"
+# Un temporal más antiguo es de un guardado interrumpido (no de uno en curso en otra sesión)
+_EDAD_TEMPORAL = 3600
+_TIPOS_MIXTOS = {"mixed", "mixed-integer", "mixed-integer-float"}
+
+
+_BLOQUE_DIGEST = 1024 * 1024
+
+
+def digest_bytes(data):
+    """Digest estable (blake2b) del contenido de un fichero"""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def digest_fichero(fichero, bloque=_BLOQUE_DIGEST):
+    """
+    Digest blake2b calculado por bloques, sin copiar el contenido a un bytes.
+    Acepta una ruta, un buffer en memoria (BytesIO / UploadedFile de Streamlit) o
+    cualquier objeto con read(). Coincide con digest_bytes del mismo contenido y es
+    igual en todos los procesos, a diferencia de hash().
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(fichero, (str, os.PathLike)):
+        with open(fichero, "rb") as f:
+            for trozo in iter(lambda: f.read(bloque), b""):
+                h.update(trozo)
+    elif hasattr(fichero, "getbuffer"):
+        with fichero.getbuffer() as vista:
+            for inicio in range(0, len(vista), bloque):
+                h.update(vista[inicio:inicio + bloque])
+    else:
+        posicion = fichero.tell()
+        fichero.seek(0)
+        for trozo in iter(lambda: fichero.read(bloque), b""):
+            h.update(trozo)
+        fichero.seek(posicion)
+    return h.hexdigest()
+
+
+def preparar_para_parquet(df):
+    """
+    Convierte a texto las columnas object que mezclan tipos (p. ej. tallas 36 y 'M'),
+    que Parquet no puede almacenar. Se aplica también en la primera carga para que
+    la sesión que parsea el Excel y las que leen de caché vean exactamente lo mismo.
+    """
+    for col in df.columns:
+        if df[col].dtype == "object" and pd.api.types.infer_dtype(df[col], skipna=True) in _TIPOS_MIXTOS:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def combinar_digests(*digests):
+    """Identidad de un conjunto de datos construido a partir de varios ficheros"""
+    return digest_bytes("+".join(digests).encode("utf-8"))
+
+
+def _ruta_entrada(digest):
+    return os.path.join(CACHE_DIR, digest)
+
+
+def _tamano_entrada(ruta):
+    total = 0
+    for raiz, _, ficheros in os.walk(ruta):
+        for nombre in ficheros:
+            try:
+                total += os.path.getsize(os.path.join(raiz, nombre))
+            except OSError:
+                pass
+    return total
+
+
+def leer_libro(digest, hojas):
+    """Devuelve {hoja: DataFrame} desde la caché, o None si el libro no está guardado"""
+    ruta = _ruta_entrada(digest)
+    manifiesto = os.path.join(ruta, _MANIFIESTO)
+    if not os.path.exists(manifiesto):
+        return None
+    try:
+        with open(manifiesto, "r", encoding="utf-8") as f:
+            ficheros = json.load(f)
+        if not all(hoja in ficheros for hoja in hojas):
+            return None
+        tablas = {
+            hoja: pd.read_parquet(os.path.join(ruta, ficheros[hoja]))
+            for hoja in hojas
+        }
+    except Exception as e:
+        print(f"⚠️ Caché de {digest[:12]} ilegible, se volverá a parsear: {e}")
+        shutil.rmtree(ruta, ignore_errors=True)
+        return None
+
+    # Marcar como usada recientemente (LRU)
+    try:
+        os.utime(ruta)
+    except OSError:
+        pass
+    return tablas
+
+
+def guardar_libro(digest, tablas):
+    """Guarda {hoja: DataFrame} en la caché y aplica el límite de tamaño"""
+    destino = _ruta_entrada(digest)
+    if os.path.exists(os.path.join(destino, _MANIFIESTO)):
+        return
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temporal = os.path.join(CACHE_DIR, f"{_PREFIJO_TEMPORAL}{uuid.uuid4().hex}")
+    os.makedirs(temporal)
+    try:
+        ficheros = {}
+        for i, (hoja, df) in enumerate(tablas.items()):
+            nombre = f"hoja_{i}.parquet"
+            # Las dimensiones conservan su índice de códigos; el RangeIndex no ocupa
+            df.to_parquet(os.path.join(temporal, nombre))
+            ficheros[hoja] = nombre
+        with open(os.path.join(temporal, _MANIFIESTO), "w", encoding="utf-8") as f:
+            json.dump(ficheros, f, ensure_ascii=False)
+        # Publicación atómica: otra sesión puede haber guardado el mismo libro a la vez
+        try:
+            os.replace(temporal, destino)
+        except OSError:
+            shutil.rmtree(temporal, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+
+    desalojar(proteger=digest)
+
+
+def desalojar(limite=None, proteger=None):
+    """
+    Elimina las entradas menos usadas recientemente hasta quedar por debajo del límite
+    y los directorios temporales que dejó un guardado interrumpido (más de _EDAD_TEMPORAL
+    segundos sin modificar).
+    """
+    limite = CACHE_MAX_BYTES if limite is None else limite
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    entradas = []
+    ahora = time.time()
+    for nombre in os.listdir(CACHE_DIR):
+        ruta = os.path.join(CACHE_DIR, nombre)
+        if not os.path.isdir(ruta):
+            continue
+        if nombre.startswith(_PREFIJO_TEMPORAL):
+            try:
+                if ahora - os.path.getmtime(ruta) > _EDAD_TEMPORAL:
+                    shutil.rmtree(ruta, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        if nombre.startswith("."):
+            continue
+        try:
+            entradas.append((os.path.getmtime(ruta), nombre, _tamano_entrada(ruta)))
+        except OSError:
+            continue
+
+    total = sum(tamano for _, _, tamano in entradas)
+    for _, nombre, tamano in sorted(entradas):
+        if total <= limite:
+            break
+        if nombre == proteger:
+            continue
+        shutil.rmtree(os.path.join(CACHE_DIR, nombre), ignore_errors=True)
+        total -= tamano
@@ -0,0 +1,718 @@
+"""
+Cálculos del dashboard sin dependencias de Streamlit.
+
+Cada sección de mostrar_dashboard obtiene sus agregados pesados de una función de
+este módulo, de modo que se pueden calcular (y cachear) fuera del script de
+Streamlit, por ejemplo en el precalentamiento en segundo plano tras la carga.
+
+Los agregados se responden desde un cubo de ventas (día × tienda × familia × talla
+× temporada) construido una vez por dataset; solo las tablas a nivel de ticket
+(rotación, margen por línea) recorren las ventas en bruto.
+"""
+
+import numpy as np
+import pandas as pd
+
+SECCION_RESUMEN = "Resumen General"
+SECCION_GEOGRAFICO = "Geográfico y Tiendas"
+SECCION_PRODUCTO = "Producto, Campaña, Devoluciones y Rentabilidad"
+SECCIONES = (SECCION_RESUMEN, SECCION_GEOGRAFICO, SECCION_PRODUCTO)
+
+
+# ===== Filtros =====
+
+def clave_filtros(fecha_inicio, fecha_fin, tiendas):
+    """Clave hashable de un estado de filtros (rango de fechas y tiendas)"""
+    return (
+        pd.Timestamp(fecha_inicio).date(),
+        pd.Timestamp(fecha_fin).date(),
+        tuple(sorted(str(t) for t in tiendas)),
+    )
+
+
+def filtros_por_defecto(df_ventas):
+    """Estado de filtros inicial del sidebar: todo el rango de fechas y todas las tiendas"""
+    fecha_min, fecha_max = df_ventas['Fecha Documento'].min(), df_ventas['Fecha Documento'].max()
+    return fecha_min, fecha_max, sorted(df_ventas['NombreTPV'].dropna().unique())
+
+
+def construir_indice(df, columna_tienda, columna_fecha=None):
+    """
+    Índice de filtrado de una tabla: posiciones de fila (ordenadas) de cada tienda y,
+    si se indica columna_fecha, las fechas para cortar rangos por búsqueda binaria.
+    Con columna_fecha la tabla debe venir ordenada por esa columna; si no lo está
+    devuelve None y los filtros recorren la tabla completa.
+    """
+    if columna_tienda not in df.columns:
+        return None
+    fechas = None
+    if columna_fecha is not None:
+        if not df[columna_fecha].is_monotonic_increasing:
+            return None
+        fechas = df[columna_fecha].to_numpy()
+
+    codigos, tiendas = pd.factorize(df[columna_tienda], sort=True)
+    orden = np.argsort(codigos, kind='stable')
+    limites = np.searchsorted(codigos[orden], np.arange(len(tiendas) + 1))
+    return {
+        'fechas': fechas,
+        'tiendas': {tienda: orden[limites[i]:limites[i + 1]] for i, tienda in enumerate(tiendas)},
+        'sin_tienda': int(limites[0]),
+    }
+
+
+def rango_indice(indice, fecha_inicio, fecha_fin):
+    """Posiciones [inicio, fin) de las filas con fecha dentro del rango (ambos extremos incluidos)"""
+    fechas = indice['fechas']
+    return (
+        int(np.searchsorted(fechas, pd.to_datetime(fecha_inicio).to_datetime64(), side='left')),
+        int(np.searchsorted(fechas, pd.to_datetime(fecha_fin).to_datetime64(), side='right')),
+    )
+
+
+def tiendas_en_rango(indice, inicio, fin):
+    """Tiendas con alguna fila entre las posiciones inicio y fin, ordenadas"""
+    return sorted(
+        tienda for tienda, posiciones in indice['tiendas'].items()
+        if np.searchsorted(posiciones, inicio) < np.searchsorted(posiciones, fin)
+    )
+
+
+def _filas_tiendas(indice, tiendas, inicio=0, fin=None):
+    """Posiciones ordenadas de las filas de las tiendas indicadas entre inicio y fin"""
+    trozos = []
+    for tienda in set(tiendas):
+        posiciones = indice['tiendas'].get(tienda)
+        if posiciones is None:
+            continue
+        if fin is not None:
+            posiciones = posiciones[np.searchsorted(posiciones, inicio):np.searchsorted(posiciones, fin)]
+        trozos.append(posiciones)
+    if not trozos:
+        return np.empty(0, dtype=np.intp)
+    return np.sort(np.concatenate(trozos))
+
+
+def filtrar_ventas(df_ventas, fecha_inicio, fecha_fin, tiendas, indice=None):
+    """
+    Ventas dentro del rango de fechas (ambos extremos incluidos) y de las tiendas
+    indicadas. Con el índice de construir_indice el coste es el de las filas elegidas.
+    """
+    if indice is None:
+        en_rango = df_ventas[(df_ventas['Fecha Documento'] >= pd.to_datetime(fecha_inicio)) &
+                             (df_ventas['Fecha Documento'] <= pd.to_datetime(fecha_fin))]
+        return en_rango[en_rango['NombreTPV'].isin(tiendas)]
+
+    inicio, fin = rango_indice(indice, fecha_inicio, fecha_fin)
+    # Todas las tiendas del rango y ninguna fila sin tienda: basta con el corte por fechas
+    if indice['sin_tienda'] == 0 and set(tiendas) >= set(tiendas_en_rango(indice, inicio, fin)):
+        return df_ventas.iloc[inicio:fin]
+    return df_ventas.take(_filas_tiendas(indice, tiendas, inicio, fin))
+
+
+def filtrar_traspasos(df_traspasos, tiendas, indice=None):
+    """Traspasos enviados a las tiendas indicadas"""
+    if 'Tienda' not in df_traspasos.columns:
+        return df_traspasos
+    if indice is None:
+        return df_traspasos[df_traspasos['Tienda'].isin(tiendas)]
+    return df_traspasos.take(_filas_tiendas(indice, tiendas))
+
+
+def filtrar_cubo(cubo, fecha_inicio, fecha_fin, tiendas):
+    """Celdas del cubo dentro del rango de fechas (ambos extremos incluidos) y de las tiendas indicadas"""
+    en_rango = cubo[(cubo['Fecha'] >= pd.to_datetime(fecha_inicio)) &
+                    (cubo['Fecha'] <= pd.to_datetime(fecha_fin))]
+    return en_rango[en_rango['NombreTPV'].isin(tiendas)]
+
+
+# ===== Cubo de ventas =====
+
+# Grano del cubo. Zona y canal dependen de la tienda: viajan como claves sin multiplicar filas
+CLAVES_CUBO = ['Fecha', 'NombreTPV', 'Familia', 'Talla', 'Temporada', 'Zona geográfica', 'Es_Online']
+
+
+def construir_cubo(df_ventas):
+    """
+    Cubo de ventas a grano día × tienda × familia × talla × temporada a partir de la
+    tabla canónica, con las sumas de cantidad, importe, devoluciones, rebajas y coste.
+    """
+    cantidad = df_ventas['Cantidad']
+    dinero = df_ventas['Ventas Dinero']
+    subtotal = df_ventas['Subtotal']
+    devuelto = cantidad < 0
+    vendido = subtotal > 0
+
+    # Importe vendido por debajo del P.V.P. de la línea (todo lo vendido si no hay precio_pvp)
+    rebajado = vendido
+    if 'precio_pvp' in df_ventas.columns:
+        rebajado = vendido & (subtotal / cantidad < df_ventas['precio_pvp'])
+
+    # Talla y zona no son obligatorias en la hoja de ventas
+    claves = ['Fecha'] + [clave for clave in CLAVES_CUBO[1:] if clave in df_ventas.columns]
+    celdas = pd.DataFrame({
+        'Fecha': df_ventas['Fecha Documento'].dt.normalize(),
+        **{clave: df_ventas[clave] for clave in claves[1:]},
+        'Cantidad': cantidad,
+        'Ventas Dinero': dinero,
+        'Cantidad Vendida': cantidad.where(cantidad > 0, 0),
+        'Cantidad Devuelta': cantidad.where(devuelto, 0),
+        'Dinero Devuelto': dinero.where(devuelto, 0),
+        'Subtotal Positivo': subtotal.where(vendido, 0),
+        'Subtotal Rebajado': subtotal.where(rebajado, 0),
+    })
+    if 'Precio Coste' in df_ventas.columns:
+        celdas['Coste'] = df_ventas['Precio Coste'] * cantidad
+
+    cubo = celdas.groupby(claves, observed=True, dropna=False).sum().reset_index()
+    # Con dropna=False pandas pierde el orden de las categóricas ordenadas (Talla)
+    for clave in claves[1:]:
+        if cubo[clave].dtype != celdas[clave].dtype:
+            cubo[clave] = cubo[clave].astype(celdas[clave].dtype)
+    fechas = cubo['Fecha'].dt
+    cubo['Mes'] = fechas.to_period('M').astype(str)
+    cubo['mes'] = fechas.month.astype('int8')
+    return cubo
+
+
+def _devoluciones(cubo):
+    """Celdas con devoluciones; 'Cantidad' pasa a ser la cantidad devuelta (negativa)"""
+    return cubo[cubo['Cantidad Devuelta'] < 0].drop(columns='Cantidad').rename(columns={'Cantidad Devuelta': 'Cantidad'})
+
+
+def _vendidas(cubo):
+    """Celdas con ventas; 'Cantidad' pasa a ser la cantidad vendida (positiva)"""
+    return cubo[cubo['Cantidad Vendida'] > 0].drop(columns='Cantidad').rename(columns={'Cantidad Vendida': 'Cantidad'})
+
+
+# ===== Rankings =====
+
+def extremos(df, medida, k=1, por=None):
+    """
+    (top, bottom): las k filas de df con mayor y con menor medida, en total o dentro
+    de cada grupo de las columnas por, en una sola pasada agrupada. Los empates se
+    resuelven por orden de aparición, como nlargest/nsmallest (y idxmax/idxmin con
+    k=1). top va de mayor a menor y bottom de menor a mayor, por grupo en el orden
+    de groupby; las filas sin medida no entran en el ranking.
+    """
+    if por is None:
+        valores = df[medida]
+        rango_top = valores.rank(method='first', ascending=False)
+        rango_bottom = valores.rank(method='first', ascending=True)
+        grupo = pd.Series(0, index=df.index)
+    else:
+        grupos = df.groupby(por, observed=True)
+        rango_top = grupos[medida].rank(method='first', ascending=False)
+        rango_bottom = grupos[medida].rank(method='first', ascending=True)
+        grupo = grupos.ngroup()
+
+    def _seleccion(rango):
+        orden = pd.DataFrame({'grupo': grupo, 'rango': rango})[rango <= k]
+        return df.loc[orden.sort_values(['grupo', 'rango']).index]
+
+    return _seleccion(rango_top), _seleccion(rango_bottom)
+
+
+# ===== Resumen General =====
+
+# Campañas para las que se mide la rotación de stock
+TEMPORADAS_ROTACION = ['V2025', 'I2025']
+
+
+def _clave_codigos(df, columnas, sin_espacios=False):
+    """
+    Clave entera que combina los códigos de varias categóricas; -1 si alguna es nula.
+    Con sin_espacios, las categorías que solo difieren en espacios de los extremos
+    comparten código.
+    """
+    clave = np.zeros(len(df), dtype='int64')
+    nula = np.zeros(len(df), dtype=bool)
+    for col in columnas:
+        categorias = df[col].cat.categories
+        codigos = df[col].cat.codes.to_numpy()
+        if sin_espacios:
+            mapa = pd.factorize(pd.Series(categorias, dtype=object).str.strip())[0]
+            codigos = np.append(mapa, -1)[codigos]
+        clave = clave * (len(categorias) + 1) + codigos
+        nula |= codigos < 0
+    return np.where(nula, -1, clave)
+
+
+def fecha_asof(df, claves, columna_fecha, tabla, claves_tabla, columna_fecha_tabla,
+               direccion='backward', sin_espacios=False):
+    """
+    Para cada fila de df, la fecha de `tabla` con la misma clave más cercana a la suya:
+    la última no posterior ('backward') o la primera no anterior ('forward'); NaT si
+    no hay. Join as-of ordenado por fecha sobre claves categóricas con el mismo
+    diccionario en ambos lados: una fila por fila de df, sin multiplicar filas como
+    un merge por claves.
+    """
+    izquierda = pd.DataFrame({
+        'clave': _clave_codigos(df, claves, sin_espacios),
+        'fecha': df[columna_fecha].to_numpy(dtype='datetime64[ns]'),
+        'fila': np.arange(len(df)),
+    })
+    derecha = pd.DataFrame({
+        'clave': _clave_codigos(tabla, claves_tabla, sin_espacios),
+        'fecha': tabla[columna_fecha_tabla].to_numpy(dtype='datetime64[ns]'),
+    })
+    izquierda = izquierda[(izquierda['clave'] >= 0) & izquierda['fecha'].notna()].sort_values('fecha', kind='stable')
+    derecha = derecha[(derecha['clave'] >= 0) & derecha['fecha'].notna()].sort_values('fecha', kind='stable')
+    derecha['encontrada'] = derecha['fecha']
+
+    unidas = pd.merge_asof(izquierda, derecha, on='fecha', by='clave', direction=direccion)
+    resultado = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    resultado[unidas['fila'].to_numpy()] = unidas['encontrada'].to_numpy()
+    return resultado
+
+
+def rotacion_por_venta(df_ventas, df_productos, df_traspasos):
+    """
+    Días de rotación de cada venta de TEMPORADAS_ROTACION: desde la última entrada en
+    almacén de su ACT_14 y talla anterior a la venta, si la tienda ya había recibido
+    un envío de ese producto y talla. Una fila por venta con rotación, con el índice
+    de df_ventas; None si no hay datos de almacén.
+    """
+    if df_productos.empty or 'Fecha REAL entrada en almacén' not in df_productos.columns:
+        return None
+
+    ventas = df_ventas[df_ventas['Temporada'].isin(TEMPORADAS_ROTACION)]
+
+    # ACT_14, Talla y tienda comparten diccionario en las tres hojas: las claves se cruzan por códigos
+    entrada = fecha_asof(
+        ventas, ['ACT_14', 'Talla'], 'Fecha Documento',
+        df_productos, ['ACT_14', 'Talla'], 'Fecha REAL entrada en almacén'
+    )
+    envio = fecha_asof(
+        ventas, ['ACT_14', 'Talla', 'NombreTPV'], 'Fecha Documento',
+        df_traspasos, ['ACT_14', 'Talla', 'Tienda'], 'Fecha Enviado'
+    )
+    con_rotacion = ~np.isnat(entrada) & ~np.isnat(envio)
+
+    por_venta = ventas.loc[con_rotacion, ['NombreTPV', 'ACT_14', 'Descripción Familia']]
+    fechas = ventas['Fecha Documento'].to_numpy(dtype='datetime64[ns]')[con_rotacion]
+    por_venta['Dias_Rotacion'] = (fechas - entrada[con_rotacion]) // np.timedelta64(1, 'D')
+    return por_venta
+
+
+def calcular_rotacion(df_ventas, df_productos, df_traspasos, por_venta=None):
+    """
+    Días entre la entrada en almacén y la venta para las ventas de V2025 e I2025
+    que tienen entrada y envío a la tienda. Devuelve (rotación por tienda,
+    rotación por producto, nº de ventas con rotación) o None si no hay datos de almacén.
+    `por_venta` es la rotación de cada venta ya calculada (rotacion_por_venta) para
+    las filas de df_ventas; sin ella se calcula aquí.
+    """
+    if df_productos.empty or 'Fecha REAL entrada en almacén' not in df_productos.columns:
+        return None
+
+    if por_venta is None:
+        por_venta = rotacion_por_venta(df_ventas, df_productos, df_traspasos)
+    if por_venta.empty:
+        return pd.DataFrame(), pd.DataFrame(), 0
+
+    rotacion_por_tienda = por_venta.groupby('NombreTPV', observed=True).agg({
+        'Dias_Rotacion': ['mean', 'count']
+    }).reset_index()
+    rotacion_por_tienda.columns = ['Tienda', 'Dias_Promedio', 'Productos_Con_Rotacion']
+
+    rotacion_por_producto = por_venta.groupby(['ACT_14', 'Descripción Familia'], observed=True).agg({
+        'Dias_Rotacion': ['mean', 'count']
+    }).reset_index()
+    rotacion_por_producto.columns = ['ACT', 'Producto', 'Dias_Promedio', 'Ventas_Con_Rotacion']
+
+    return rotacion_por_tienda, rotacion_por_producto, len(por_venta)
+
+
+def agregados_resumen(cubo, df_ventas, df_productos, df_traspasos, rotacion=None):
+    """
+    KPIs, rotación de stock, ventas mensuales por tipo de tienda y ventas/devoluciones
+    por tienda. `rotacion` es la rotación por venta de las filas de df_ventas, si ya
+    se tiene (precalculo.rotacion).
+    """
+    ventas_fisicas = cubo[~cubo['Es_Online']]
+    ventas_online = cubo[cubo['Es_Online']]
+
+    kpis = {
+        'total_ventas_dinero': cubo['Ventas Dinero'].sum(),
+        'total_familias': cubo['Familia'].nunique(),
+        'total_devoluciones_dinero': abs(cubo['Dinero Devuelto'].sum()),
+        'ventas_fisicas_dinero': ventas_fisicas['Ventas Dinero'].sum(),
+        'ventas_online_dinero': ventas_online['Ventas Dinero'].sum(),
+        'tiendas_fisicas': ventas_fisicas['NombreTPV'].nunique(),
+        'tiendas_online': ventas_online['NombreTPV'].nunique(),
+    }
+
+    ventas_mes_tipo = cubo.groupby(['Mes', 'Es_Online'], observed=True).agg({
+        'Cantidad': 'sum',
+        'Ventas Dinero': 'sum'
+    }).reset_index()
+    ventas_mes_tipo['Tipo'] = ventas_mes_tipo['Es_Online'].map({True: 'Online', False: 'Física'})
+
+    ventas_por_tienda = cubo.groupby('NombreTPV', observed=True)['Cantidad'].sum()
+    ventas_tienda_temporada = (
+        cubo.groupby(['NombreTPV', 'Temporada'], observed=True)['Cantidad'].sum()
+        .reset_index().rename(columns={'NombreTPV': 'Tienda'})
+    )
+    devoluciones_por_tienda = (
+        _devoluciones(cubo).groupby('NombreTPV', observed=True)['Cantidad'].sum().abs().rename_axis('Tienda')
+    )
+
+    return {
+        'kpis': kpis,
+        # La rotación cruza líneas de venta con entradas y envíos: se calcula sobre las ventas en bruto
+        'rotacion': calcular_rotacion(df_ventas, df_productos, df_traspasos, rotacion),
+        'ventas_mes_tipo': ventas_mes_tipo,
+        'ventas_tienda_temporada': ventas_tienda_temporada,
+        'top_tiendas_ventas': ventas_por_tienda.nlargest(20).index.tolist(),
+        'devoluciones_por_tienda': devoluciones_por_tienda,
+    }
+
+
+def primera_venta(df, claves, columna_desde, df_ventas):
+    """
+    Fecha de la primera venta positiva de cada fila de df en su ACT, talla y tienda
+    (claves de df en ese orden, comparadas sin espacios en los extremos) no anterior
+    a su fecha `columna_desde`; NaT si no la hay.
+    """
+    ventas = df_ventas[df_ventas['Cantidad'] > 0]
+    return fecha_asof(
+        df, claves, columna_desde, ventas, ['ACT', 'Talla', 'NombreTPV'], 'Fecha Documento',
+        direccion='forward', sin_espacios=True
+    )
+
+
+def linea_temporal_almacen(df_almacen, df_traspasos, df_ventas):
+    """
+    Tabla entrada en almacén → envío → primera venta: una fila por entrada y envío
+    posterior del mismo ACT_14 y talla, con la primera venta en la tienda de destino
+    desde la entrada (-1 días si no la hay). Ordenada por fecha de entrada descendente.
+    """
+    # ACT_14 comparte diccionario con los traspasos: el merge cruza códigos
+    pares = pd.merge(
+        df_almacen,
+        df_traspasos,
+        left_on=['ACT_14', 'Talla'],
+        right_on=['ACT_14', 'Talla'],
+        suffixes=('_almacen', '_traspaso')
+    )
+    pares = pares[pares['Fecha Enviado'] >= pares['Fecha REAL entrada en almacén']]
+    if pares.empty:
+        return pd.DataFrame()
+
+    entrada = pares['Fecha REAL entrada en almacén']
+    envio = pares['Fecha Enviado']
+    venta = pd.Series(
+        primera_venta(pares, ['ACT_almacen', 'Talla', 'Tienda'], 'Fecha REAL entrada en almacén', df_ventas),
+        index=pares.index
+    )
+    dias_venta = (venta - entrada).dt.days
+
+    linea = pd.DataFrame({
+        'ACT': pares['ACT_almacen'].astype(object).str.strip(),
+        'Tema': pares['Tema'].astype(object),
+        'Talla': pares['Talla'].astype(object).str.strip(),
+        'Tienda Envío': pares['Tienda'].astype(object),
+        'Fecha Entrada Almacén': entrada.dt.strftime('%d/%m/%Y'),
+        'Fecha Enviado': envio.dt.strftime('%d/%m/%Y'),
+        'Fecha Primera Venta': venta.dt.strftime('%d/%m/%Y').fillna("Sin ventas"),
+        'Días Entrada-Envío': (envio - entrada).dt.days,
+        'Días Entrada-Primera Venta': dias_venta.fillna(-1).astype('int64'),
+    }).reset_index(drop=True)
+    # Orden por día de entrada (la tabla muestra la fecha sin hora); estable, para que
+    # las filas del mismo día salgan siempre en el orden del cruce
+    orden = entrada.dt.normalize().reset_index(drop=True).sort_values(ascending=False, kind='stable').index
+    return linea.loc[orden]
+
+
+# Temporada de ventas con la que se compara lo enviado de cada tema
+TEMPORADA_TEMA = {'T_OI25': 'I2025', 'T_PV25': 'V2025'}
+
+
+def comparacion_temas(df_almacen, df_ventas, cantidad_col):
+    """
+    Enviado vs ventas por talla y entradas en almacén (Mes Entrada × Talla) de cada
+    tema de df_almacen, en una pasada agrupada por tema. Devuelve {tema: {'temporada',
+    'comparacion', 'pivot'}}; 'comparacion' es None si el tema no tiene temporada de
+    comparación o ventas en ella, y 'pivot' es None si no hay entradas.
+    """
+    # Las entradas sin tema cuentan como el tema 'nan', como cuando Tema_6 se sacaba del texto
+    temas = df_almacen['Tema_6']
+    if temas.hasnans:
+        if isinstance(temas.dtype, pd.CategoricalDtype) and 'nan' not in temas.cat.categories:
+            temas = temas.cat.add_categories('nan')
+        df_almacen = df_almacen.assign(Tema_6=temas.fillna('nan'))
+
+    entradas = (
+        df_almacen.groupby(['Tema_6', 'Mes Entrada', 'Talla'], observed=True)[cantidad_col]
+        .sum()
+        .reset_index()
+        .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
+        .sort_values(['Mes Entrada', 'Talla'])
+    )
+    enviado = df_almacen.groupby(['Tema_6', 'Talla'], observed=True)[cantidad_col].sum().reset_index()
+    acts = df_almacen.groupby('Tema_6', observed=True)['ACT_14'].unique()
+
+    # Ventas de las temporadas de comparación agregadas una vez por ACT y talla
+    ventas = (
+        df_ventas[df_ventas['Temporada'].isin(list(TEMPORADA_TEMA.values()))]
+        .groupby(['Temporada', 'ACT', 'Talla'], observed=True, dropna=False)['Cantidad'].sum()
+        .reset_index()
+    )
+
+    resultado = {}
+    entradas_tema = dict(tuple(entradas.groupby('Tema_6', observed=True)))
+    enviado_tema = dict(tuple(enviado.groupby('Tema_6', observed=True)))
+    for tema in sorted(df_almacen['Tema_6'].unique()):
+        temporada = TEMPORADA_TEMA.get(tema)
+        comparacion = None
+        if temporada is not None:
+            ventas_tema = ventas[(ventas['Temporada'] == temporada) & ventas['ACT'].isin(acts.get(tema, []))]
+            if not ventas_tema.empty:
+                ventas_por_talla = ventas_tema.groupby('Talla', observed=True)['Cantidad'].sum().reset_index()
+                comparacion = pd.merge(
+                    enviado_tema[tema].drop(columns='Tema_6'),
+                    ventas_por_talla,
+                    on='Talla',
+                    how='outer'
+                )
+                # Solo las cantidades: fillna(0) sobre la talla categórica falla aunque no tenga vacíos
+                cantidades = comparacion.columns.drop('Talla')
+                comparacion[cantidades] = comparacion[cantidades].fillna(0)
+                comparacion = comparacion.sort_values('Talla')
+
+        pivot = None
+        datos_tema = entradas_tema.get(tema)
+        if datos_tema is not None and not datos_tema.empty:
+            pivot = datos_tema.pivot_table(
+                index='Mes Entrada',
+                columns='Talla',
+                values='Cantidad Entrada Almacén',
+                fill_value=0,
+                observed=True
+            ).round(0)
+        resultado[tema] = {'temporada': temporada, 'comparacion': comparacion, 'pivot': pivot}
+    return resultado
+
+
+def ventas_por_descripcion(df_ventas, claves):
+    """Ventas Dinero y Cantidad por familia y clave de descripción (claves: una por fila de df_ventas)"""
+    return (
+        df_ventas[['Familia', 'Ventas Dinero', 'Cantidad']]
+        .assign(**{'Clave Descripción': claves})
+        .groupby(['Familia', 'Clave Descripción'], observed=True)[['Ventas Dinero', 'Cantidad']]
+        .sum()
+        .reset_index()
+    )
+
+
+def descripciones_familia(ventas_descripcion, descripciones, familia, n_largas=30):
+    """
+    Ventas por descripción analizada de una familia, limitadas a las n_largas
+    descripciones más largas. ventas_descripcion sale de ventas_por_descripcion y
+    descripciones es un tipo del índice de ingesta.indice_descripciones.
+    """
+    ventas_familia = ventas_descripcion[ventas_descripcion['Familia'] == familia]
+    con_desc = ventas_familia.merge(descripciones, left_on='Clave Descripción', right_on='ACT', how='inner')
+    desc_group = con_desc.groupby('Descripción Analizada', observed=True).agg({
+        'Ventas Dinero': 'sum',
+        'Cantidad': 'sum',
+        'longitud_desc': 'first'
+    }).reset_index()
+    desc_group = desc_group[desc_group['Descripción Analizada'] != 'N/A']
+    desc_group = desc_group[desc_group['Descripción Analizada'].str.strip() != '']
+    return desc_group.sort_values('longitud_desc', ascending=False).head(n_largas)
+
+
+# ===== Geográfico y Tiendas =====
+
+def agregados_geografico(cubo):
+    """Ventas por zona y tienda, y su evolución mensual"""
+    ventas_tienda_zona = cubo.groupby(['Zona geográfica', 'NombreTPV'], observed=True).agg({
+        'Cantidad': 'sum',
+        'Ventas Dinero': 'sum'
+    }).reset_index()
+
+    return {
+        'ventas_por_zona': cubo.groupby('Zona geográfica', observed=True)['Cantidad'].sum().reset_index(),
+        'ventas_por_tienda': cubo.groupby('NombreTPV', observed=True)['Cantidad'].sum().reset_index(),
+        'tiendas_por_zona': cubo[['NombreTPV', 'Zona geográfica']].drop_duplicates().groupby('Zona geográfica', observed=True).count().reset_index(),
+        'ventas_tienda_zona': ventas_tienda_zona,
+        'zona_mes_evol': cubo.groupby(['Mes', 'Zona geográfica'], observed=True)['Cantidad'].sum().reset_index(),
+        # Totales por tienda (con o sin zona) para cruzar con la dimensión de tienda en los mapas
+        'ventas_tienda': cubo.groupby('NombreTPV', observed=True)[['Cantidad', 'Ventas Dinero']].sum().reset_index(),
+    }
+
+
+def ventas_por_ciudad(ventas_tienda, dimension_tienda, pais):
+    """
+    Ventas por ciudad de las tiendas de un país con coordenadas, cruzando los totales
+    por tienda con la dimensión de tienda por código. Devuelve (ventas por ciudad
+    con lat/lon, nº de tiendas mapeadas).
+    """
+    codigos = ventas_tienda['NombreTPV'].cat.codes.to_numpy()
+    tiendas = dimension_tienda[['País', 'Ciudad', 'lat', 'lon']].iloc[codigos].reset_index(drop=True)
+    for medida in ('Cantidad', 'Ventas Dinero'):
+        tiendas[medida] = ventas_tienda[medida].to_numpy()
+    tiendas = tiendas[tiendas['País'] == pais].dropna(subset=['lat', 'lon'])
+
+    ventas_ciudad = tiendas.groupby(['Ciudad', 'lat', 'lon'], observed=True).agg({
+        'Cantidad': 'sum',
+        'Ventas Dinero': 'sum'
+    }).reset_index()
+    return ventas_ciudad, len(tiendas)
+
+
+# ===== Producto, Campaña, Devoluciones y Rentabilidad =====
+
+def ventana_temporada(temporada):
+    """(inicio, fin) de la campaña de un código de temporada (I: sept-feb, V: mar-ago), o None si no es válido"""
+    if not isinstance(temporada, str) or len(temporada) < 5:
+        return None
+
+    tipo_temporada = temporada[0]   # 'I' o 'V'
+    ano_temporada_str = temporada[1:]
+
+    # Validar que ano_temporada_str es numérico y tipo_temporada es válido
+    if tipo_temporada not in ['I', 'V'] or not ano_temporada_str.isdigit():
+        return None
+
+    ano_temporada = int(ano_temporada_str)
+
+    if tipo_temporada == 'I':  # Invierno: sept (año-1) a feb (año)
+        inicio = pd.Timestamp(year=ano_temporada - 1, month=9, day=1)
+        fin = pd.Timestamp(year=ano_temporada, month=2, day=28)  # ignoramos bisiestos
+    else:  # Verano: marzo a agosto año
+        inicio = pd.Timestamp(year=ano_temporada, month=3, day=1)
+        fin = pd.Timestamp(year=ano_temporada, month=8, day=31)
+    return inicio, fin
+
+
+def vendido_fuera_temporada(temporadas, fechas):
+    """
+    1 si la venta cae fuera de la ventana de su campaña, 0 si cae dentro. La ventana
+    se calcula una vez por código de temporada distinto y cada venta se compara con
+    arrays. Las temporadas mal definidas (o sin fecha) cuentan como fuera de temporada.
+    """
+    codigos, temporadas_unicas = pd.factorize(pd.Series(temporadas))
+    # Una posición extra (NaT) para las ventas sin temporada (código -1)
+    inicios = np.full(len(temporadas_unicas) + 1, np.datetime64('NaT'), dtype='datetime64[ns]')
+    fines = inicios.copy()
+    for i, temporada in enumerate(temporadas_unicas):
+        ventana = ventana_temporada(temporada)
+        if ventana is not None:
+            inicios[i], fines[i] = ventana
+
+    fechas = pd.Series(fechas).to_numpy(dtype='datetime64[ns]')
+    dentro = (inicios[codigos] <= fechas) & (fechas <= fines[codigos])
+    return np.where(dentro, 0, 1)
+
+
+def _rebajas(cubo, meses):
+    """Importe vendido en rebajas en los meses indicados y su % sobre el total"""
+    ventas_rebajas = cubo.loc[cubo['mes'].isin(meses), 'Subtotal Rebajado'].sum()
+    total = cubo['Subtotal Positivo'].sum()
+    return ventas_rebajas, (ventas_rebajas / total * 100) if total > 0 else 0
+
+
+def agregados_producto(cubo, df_ventas):
+    """KPIs de devoluciones, rebajas y margen, y ventas en/fuera de temporada"""
+    devoluciones = _devoluciones(cubo)
+    ventas = _vendidas(cubo)
+    kpis = {}
+
+    # Tienda con más devoluciones y ratio
+    kpis['tienda_mas_devoluciones'] = "Sin datos"
+    kpis['ratio_devolucion_valor'] = 0
+    if not devoluciones.empty:
+        devoluciones_por_tienda = devoluciones.groupby('NombreTPV', observed=True).agg({'Cantidad': 'sum'}).reset_index()
+        devoluciones_por_tienda['Cantidad'] = abs(devoluciones_por_tienda['Cantidad'])
+        devoluciones_por_tienda = devoluciones_por_tienda.sort_values('Cantidad', ascending=False)
+
+        ventas_por_tienda = ventas.groupby('NombreTPV', observed=True)['Cantidad'].sum().reset_index()
+        ratio_devolucion = ventas_por_tienda.merge(devoluciones_por_tienda, on='NombreTPV', how='left')
+        ratio_devolucion['Cantidad_y'] = ratio_devolucion['Cantidad_y'].fillna(0)
+        ratio_devolucion['Ratio Devolución %'] = (ratio_devolucion['Cantidad_y'] / ratio_devolucion['Cantidad_x'] * 100).round(2)
+
+        top_tienda_devolucion = ratio_devolucion.loc[ratio_devolucion['Cantidad_y'].idxmax()]
+        kpis['tienda_mas_devoluciones'] = top_tienda_devolucion['NombreTPV']
+        kpis['ratio_devolucion_valor'] = top_tienda_devolucion['Ratio Devolución %']
+
+    # Talla más devuelta
+    kpis['talla_mas_devuelta'] = "Sin datos"
+    kpis['talla_devuelta_unidades'] = 0
+    if not devoluciones.empty and 'Talla' in devoluciones.columns:
+        talla_mas_devuelta_data = devoluciones.groupby('Talla', observed=True)['Cantidad'].sum().abs().sort_values(ascending=False).head(1)
+        if not talla_mas_devuelta_data.empty:
+            kpis['talla_mas_devuelta'] = talla_mas_devuelta_data.index[0]
+            kpis['talla_devuelta_unidades'] = talla_mas_devuelta_data.iloc[0]
+
+    # Familia más devuelta (excluyendo GR.ART.FICTICIO)
+    kpis['familia_mas_devuelta'] = "Sin datos"
+    kpis['familia_devuelta_unidades'] = 0
+    kpis['familia_ficticio_unidades'] = 0
+    if not devoluciones.empty:
+        devoluciones_sin_ficticio = devoluciones[devoluciones['Familia'] != 'GR.ART.FICTICIO']
+        familia_mas_devuelta_data = devoluciones_sin_ficticio.groupby('Familia', observed=True)['Cantidad'].sum().abs().sort_values(ascending=False).head(1)
+        if not familia_mas_devuelta_data.empty:
+            kpis['familia_mas_devuelta'] = familia_mas_devuelta_data.index[0]
+            kpis['familia_devuelta_unidades'] = familia_mas_devuelta_data.iloc[0]
+        ficticio_data = devoluciones[devoluciones['Familia'] == 'GR.ART.FICTICIO'].groupby('Familia', observed=True)['Cantidad'].sum().abs()
+        if not ficticio_data.empty:
+            kpis['familia_ficticio_unidades'] = ficticio_data.iloc[0]
+
+    # Rebajas 1ª (Enero y Junio) y 2ª (Febrero y Julio)
+    kpis['ventas_rebajas_1'], kpis['porcentaje_rebajas_1'] = _rebajas(cubo, [1, 6])
+    kpis['ventas_rebajas_2'], kpis['porcentaje_rebajas_2'] = _rebajas(cubo, [2, 7])
+
+    # Margen bruto (promedios por línea de venta: se calcula sobre las ventas en bruto) por unidad y porcentual (promedios)
+    for clave in ['margen_unitario_promedio', 'margen_unitario_promedio_positivo',
+                  'margen_porcentual_promedio', 'margen_porcentual_promedio_positivo']:
+        kpis[clave] = 0
+    productos_margen_negativo = pd.DataFrame()
+    if all(col in df_ventas.columns for col in ['P.V.P.', 'Precio Coste']):
+        margen_unitario = df_ventas['P.V.P.'] - df_ventas['Precio Coste']
+        kpis['margen_unitario_promedio'] = margen_unitario.mean()
+        kpis['margen_unitario_promedio_positivo'] = margen_unitario[margen_unitario > 0].mean()
+
+        # Ignorar productos con P.V.P. = 0 para el promedio real
+        validos = df_ventas['P.V.P.'] != 0
+        margen_pct = (margen_unitario / df_ventas['P.V.P.'])[validos]
+        kpis['margen_porcentual_promedio'] = margen_pct.mean() * 100
+        kpis['margen_porcentual_promedio_positivo'] = margen_pct[margen_pct > 0].mean() * 100
+
+        productos_margen_negativo = df_ventas[margen_unitario < 0].assign(margen_unitario=margen_unitario[margen_unitario < 0])
+
+    # Ventas vs devoluciones por familia
+    ventas_por_familia = ventas.groupby('Familia', observed=True)['Cantidad'].sum().reset_index()
+    devoluciones_por_familia = devoluciones.groupby('Familia', observed=True)['Cantidad'].sum().reset_index()
+    devoluciones_por_familia['Cantidad'] = abs(devoluciones_por_familia['Cantidad'])
+    devoluciones_familia_talla = devoluciones.groupby(['Familia', 'Talla'], observed=True)['Cantidad'].sum().abs().reset_index()
+
+    # Ventas en / fuera de temporada por campaña
+    analisis_temporada = None
+    if 'Temporada' in df_ventas.columns:
+        analisis_temporada = (
+            cubo.assign(vendido_fuera_temporada=vendido_fuera_temporada(cubo['Temporada'], cubo['Fecha']))
+            .groupby(['Temporada', 'vendido_fuera_temporada'], observed=True)['Cantidad'].sum().reset_index()
+        )
+
+    return {
+        'kpis': kpis,
+        'productos_margen_negativo': productos_margen_negativo,
+        'ventas_por_familia': ventas_por_familia,
+        'devoluciones_por_familia': devoluciones_por_familia,
+        'devoluciones_familia_talla': devoluciones_familia_talla,
+        'analisis_temporada': analisis_temporada,
+    }
+
+
+def agregados_seccion(seccion, cubo, df_ventas, df_productos, df_traspasos, rotacion=None):
+    """Agregados de una sección del dashboard a partir del cubo y las tablas ya filtrados"""
+    if seccion == SECCION_RESUMEN:
+        return agregados_resumen(cubo, df_ventas, df_productos, df_traspasos, rotacion)
+    if seccion == SECCION_GEOGRAFICO:
+        return agregados_geografico(cubo)
+    if seccion == SECCION_PRODUCTO:
+        return agregados_producto(cubo, df_ventas)
+    raise ValueError(f"Sección desconocida: {seccion}")
@@ -15,6 +15,17 @@ import io
 
 # Import model functions
 from modelo import prepare_final_dataset_improved
+from ingesta import (
+    DESCRIPCION_COMPLETA, HOJA_COMPRA, HOJA_VENTAS, PAIS_ESPANA, PAIS_ITALIA, TIPOS_DESCRIPCION, atributo_producto,
+    columna_rol, dimension_producto, dimension_tienda, leer_descripciones, marcar_online, rellenar_categoria
+)
+from datos_entrenamiento import cargar_datos_entrenamiento, version_entrenamiento
+from calculos import (
+    clave_filtros, comparacion_temas, descripciones_familia, filtrar_ventas, filtrar_traspasos, linea_temporal_almacen,
+    rango_indice, tiendas_en_rango, ventas_por_ciudad, ventas_por_descripcion
+)
+import precalculo
+import filtros_recientes
 
 # Configuración estilo gráfico general (sin líneas de fondo)
 plt.rcParams.update({
@@ -39,41 +50,9 @@ TEMPORADA_COLORS = ["#e6f3ff", "#99ccff", "#4d94ff", "#0066cc", "#004d99", "#003
 COLOR_GRADIENT_WARM = ["#fff5e6", "#ffebcc", "#ffd699", "#ffc266", "#ffad33", "#ff9900", "#cc7a00", "#995c00", "#663d00"]
 COLOR_GRADIENT_GREEN = ["#e6ffe6", "#ccffcc", "#99ff99", "#66ff66", "#33ff33", "#00ff00", "#00cc00", "#009900", "#006600"]
 
-TIENDAS_EXTRANJERAS = [
-    "I301COINBERGAMO(TRUCCO)", "I302COINVARESE(TRUCCO)", "I303COINBARICASAMASSIMA(TRUCCO)",
-    "I304COINMILANO5GIORNATE(TRUCCO)", "I305COINROMACINECITTA(TRUCCO)", "I306COINGENOVA(TRUCCO)",
-    "I309COINSASSARI(TRUCCO)", "I314COINCATANIA(TRUCCO)", "I315COINCAGLIARI(TRUCCO)",
-    "I316COINLECCE(TRUCCO)", "I317COINMILANOCANTORE(TRUCCO)", "I318COINMESTRE(TRUCCO)",
-    "I319COINPADOVA(TRUCCO)", "I320COINFIRENZE(TRUCCO)", "I321COINROMASANGIOVANNI(TRUCCO)",
-    "TRUCCOONLINEB2C"
-]
-
 COL_ONLINE = '#2ca02c'   # verde fuerte
 COL_OTRAS = '#ff7f0e'    # naranja
 
-def custom_sort_key(talla):
-    """
-    Clave de ordenación personalizada para tallas.
-    Prioriza: 1. Tallas numéricas, 2. Tallas de letra estándar, 3. Tallas únicas, 4. Resto.
-    """
-    talla_str = str(talla).upper()
-    
-    # Prioridad 1: Tallas numéricas (e.g., '36', '38')
-    if talla_str.isdigit():
-        return (0, int(talla_str))
-    
-    # Prioridad 2: Tallas de letra estándar
-    size_order = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
-    if talla_str in size_order:
-        return (1, size_order.index(talla_str))
-        
-    # Prioridad 3: Tallas únicas
-    if talla_str in ['U', 'ÚNICA', 'UNICA', 'TU']:
-        return (2, talla_str)
-        
-    # Prioridad 4: Resto, ordenado alfabéticamente
-    return (3, talla_str)
-
 def setup_streamlit_styles():
     """Configurar estilos de Streamlit"""
     st.markdown("""
@@ -190,10 +169,23 @@ def titulo(text):
 def subtitulo(text):
     st.markdown(f"<h5 style='text-align:left;color:#666666;margin:0;padding:0;font-size:22px;font-weight:bold;'>{text}</h5>", unsafe_allow_html=True)
 
-def aplicar_filtros(df_ventas, df_traspasos=None):
-    if not pd.api.types.is_datetime64_any_dtype(df_ventas['Fecha Documento']):
-        df_ventas['Fecha Documento'] = pd.to_datetime(df_ventas['Fecha Documento'], format='%d/%m/%Y', errors='coerce')
-    fecha_min, fecha_max = df_ventas['Fecha Documento'].min(), df_ventas['Fecha Documento'].max()
+def _filtrar_tablas(df_ventas, df_traspasos, fecha_inicio, fecha_fin, tiendas, indice_ventas, indice_traspasos):
+    return (
+        filtrar_ventas(df_ventas, fecha_inicio, fecha_fin, tiendas, indice_ventas),
+        filtrar_traspasos(df_traspasos, tiendas, indice_traspasos),
+    )
+
+
+def aplicar_filtros(df_ventas, df_traspasos=None, version=None):
+    # df_ventas es la tabla canónica: 'Fecha Documento' ya es datetime y viene ordenada.
+    # Con versión, los filtros usan los índices por fecha y tienda de precalculo
+    indice_ventas = indice_traspasos = None
+    if df_traspasos is not None:
+        indice_ventas, indice_traspasos = precalculo.indices(version, df_ventas, df_traspasos)
+    if indice_ventas is not None:
+        fecha_min, fecha_max = pd.Timestamp(indice_ventas['fechas'][0]), pd.Timestamp(indice_ventas['fechas'][-1])
+    else:
+        fecha_min, fecha_max = df_ventas['Fecha Documento'].min(), df_ventas['Fecha Documento'].max()
 
     fecha_inicio, fecha_fin = st.sidebar.date_input(
         "Rango de fechas",
@@ -205,12 +197,15 @@ def aplicar_filtros(df_ventas, df_traspasos=None):
     if fecha_inicio > fecha_fin:
         st.sidebar.error("La fecha de inicio debe ser anterior a la fecha de fin.")
         if df_traspasos is not None:
-            return df_ventas.iloc[0:0], df_traspasos.iloc[0:0], False, []
-        return df_ventas.iloc[0:0], False, []
+            return df_ventas.iloc[0:0], df_traspasos.iloc[0:0], False, [], None
+        return df_ventas.iloc[0:0], False, [], None
 
-    df_ventas_filtrado = df_ventas[(df_ventas['Fecha Documento'] >= pd.to_datetime(fecha_inicio)) &
-                     (df_ventas['Fecha Documento'] <= pd.to_datetime(fecha_fin))]
-    tiendas = sorted(df_ventas_filtrado['NombreTPV'].dropna().unique())
+    if indice_ventas is not None:
+        tiendas = tiendas_en_rango(indice_ventas, *rango_indice(indice_ventas, fecha_inicio, fecha_fin))
+    else:
+        df_ventas_filtrado = df_ventas[(df_ventas['Fecha Documento'] >= pd.to_datetime(fecha_inicio)) &
+                         (df_ventas['Fecha Documento'] <= pd.to_datetime(fecha_fin))]
+        tiendas = sorted(df_ventas_filtrado['NombreTPV'].dropna().unique())
     modo_tienda = st.sidebar.selectbox(
         "Modo selección tiendas",
         ["Todas las tiendas", "Seleccionar tiendas específicas"]
@@ -226,21 +221,30 @@ def aplicar_filtros(df_ventas, df_traspasos=None):
         if not tienda_seleccionada:
             st.sidebar.warning("Selecciona al menos una tienda para mostrar datos.")
             if df_traspasos is not None:
-                return df_ventas.iloc[0:0], df_traspasos.iloc[0:0], False, []
-            return df_ventas.iloc[0:0], False, []
+                return df_ventas.iloc[0:0], df_traspasos.iloc[0:0], False, [], None
+            return df_ventas.iloc[0:0], False, [], None
         tiendas_especificas = True
     
-    df_ventas_filtrado = df_ventas_filtrado[df_ventas_filtrado['NombreTPV'].isin(tienda_seleccionada)]
-    
-    # Aplicar filtro de tienda a traspasos si se proporciona
+    # Clave del estado de filtros para cachear los agregados de cada sección
+    filtros = clave_filtros(fecha_inicio, fecha_fin, tienda_seleccionada)
+
+    # Aplicar filtros a ventas y traspasos si se proporcionan; con versión el resultado
+    # queda memorizado en la sesión por (digest, temporada, filtros)
     if df_traspasos is not None:
-        df_traspasos_filtrado = df_traspasos.copy()
-        # Asegurar que la columna Tienda existe en traspasos
-        if 'Tienda' in df_traspasos_filtrado.columns:
-            df_traspasos_filtrado = df_traspasos_filtrado[df_traspasos_filtrado['Tienda'].isin(tienda_seleccionada)]
-        return df_ventas_filtrado, df_traspasos_filtrado, tiendas_especificas, tienda_seleccionada
+        if version is not None:
+            df_ventas_filtrado, df_traspasos_filtrado = filtros_recientes.recordar(
+                (version, filtros), _filtrar_tablas,
+                df_ventas, df_traspasos, fecha_inicio, fecha_fin, tienda_seleccionada, indice_ventas, indice_traspasos
+            )
+        else:
+            df_ventas_filtrado, df_traspasos_filtrado = _filtrar_tablas(
+                df_ventas, df_traspasos, fecha_inicio, fecha_fin, tienda_seleccionada, indice_ventas, indice_traspasos
+            )
+        return df_ventas_filtrado, df_traspasos_filtrado, tiendas_especificas, tienda_seleccionada, filtros
+    
+    df_ventas_filtrado = filtrar_ventas(df_ventas, fecha_inicio, fecha_fin, tienda_seleccionada)
     
-    return df_ventas_filtrado, tiendas_especificas, tienda_seleccionada
+    return df_ventas_filtrado, tiendas_especificas, tienda_seleccionada, filtros
 
 
 
@@ -312,48 +316,61 @@ def viz_container(title, render_function):
     render_function()
     st.markdown('</div>', unsafe_allow_html=True)
 
-def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
+def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion, version=None, df_dim_producto=None,
+                      df_dim_tienda=None):
+    """
+    Dibuja la sección seleccionada. `version` identifica df_ventas (digest del
+    dataset + temporada) y permite reutilizar los agregados ya calculados, incluidos
+    los que precalcula precalculo.precalentar tras la carga. `df_dim_producto` y
+    `df_dim_tienda` son las dimensiones de la ingesta; si no se entregan se construyen aquí.
+    """
     setup_streamlit_styles()
     
-    # Use cached preprocessing for better performance
-    df_ventas = preprocess_ventas_data(df_ventas)
-    df_productos = df_productos.copy()
-    
-    # Asegurar columna 'Talla' en traspasos si no existe
-    if "Talla" not in df_traspasos.columns:
-        for col in ["Talla", "Size"]:
-            if col in df_traspasos.columns:
-                df_traspasos["Talla"] = df_traspasos[col]
-                break
+    # app.py entrega la tabla de ventas canónica, construida una vez tras la carga
+    if not df_ventas.attrs.get('canonica'):
+        df_ventas = preprocess_ventas_data(df_ventas)
+
+    if df_dim_producto is None:
+        df_dim_producto = dimension_producto({HOJA_VENTAS: df_ventas, HOJA_COMPRA: df_productos})
+    if df_dim_tienda is None:
+        df_dim_tienda = dimension_tienda({HOJA_VENTAS: df_ventas})
+
+    # Columna de cantidad de entrada en almacén, resuelta por el esquema de ingesta
+    cantidad_col_compra = columna_rol(df_productos, HOJA_COMPRA, 'cantidad')
 
     # Calcular ranking completo de todas las tiendas ANTES de aplicar filtros
-    ventas_por_tienda_completo = calculate_store_rankings(df_ventas)
+    ventas_por_tienda_completo = calculate_store_rankings(df_ventas, version=version)
+    top_20_tiendas_completo, bottom_20_tiendas_completo = precalculo.ranking(
+        version, 'tiendas', ventas_por_tienda_completo, 'Ventas (€)', k=20
+    )
     
     # Aplicar filtros
-    df_ventas, df_traspasos_filtrado, tiendas_especificas, tienda_seleccionada = aplicar_filtros(df_ventas, df_traspasos)
+    df_ventas_temporada = df_ventas
+    df_ventas, df_traspasos_filtrado, tiendas_especificas, tienda_seleccionada, filtros = aplicar_filtros(df_ventas, df_traspasos, version)
     if df_ventas.empty:
         st.warning("No hay datos para mostrar con los filtros seleccionados.")
         return
 
+    # Agregados pesados de la sección, respondidos desde el cubo de ventas
+    # (cacheados por versión del dataset y filtros)
+    cubo = precalculo.cubo(version, filtros, df_ventas_temporada, df_ventas)
+    agregados = precalculo.agregados(
+        version, filtros, seccion, cubo, df_ventas, df_productos, df_traspasos, df_ventas_temporada
+    )
+    # Token de las ventas filtradas para los helpers cacheados por versión
+    version_filtrada = (version, filtros) if version is not None and filtros is not None else None
+
     if seccion == "Resumen General":
         try:
-            # Calcular KPIs
-            total_ventas_dinero = df_ventas['Ventas Dinero'].sum()
-            total_familias = df_ventas['Familia'].nunique()
-            
-            # Calcular Total Devoluciones (monetary amount of negative quantities)
-            devoluciones = df_ventas[df_ventas['Cantidad'] < 0].copy()
-            total_devoluciones_dinero = abs(devoluciones['Ventas Dinero'].sum())  # Use abs() to show positive value
-            
-            # Separar tiendas físicas y online
-            ventas_fisicas = df_ventas[~df_ventas['Es_Online']]
-            ventas_online = df_ventas[df_ventas['Es_Online']]
-            
-            # Calcular KPIs por tipo de tienda
-            ventas_fisicas_dinero = ventas_fisicas['Ventas Dinero'].sum()
-            ventas_online_dinero = ventas_online['Ventas Dinero'].sum()
-            tiendas_fisicas = ventas_fisicas['NombreTPV'].nunique()
-            tiendas_online = ventas_online['NombreTPV'].nunique()
+            # KPIs (calculados en calculos.agregados_resumen)
+            kpis = agregados['kpis']
+            total_ventas_dinero = kpis['total_ventas_dinero']
+            total_familias = kpis['total_familias']
+            total_devoluciones_dinero = kpis['total_devoluciones_dinero']
+            ventas_fisicas_dinero = kpis['ventas_fisicas_dinero']
+            ventas_online_dinero = kpis['ventas_online_dinero']
+            tiendas_fisicas = kpis['tiendas_fisicas']
+            tiendas_online = kpis['tiendas_online']
 
             # KPIs Generales en una sola fila
             st.markdown("""
@@ -412,65 +429,12 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             # ===== KPIs de Rotación de Stock =====
             st.markdown("### 📊 **KPIs de Rotación de Stock (V2025 e I2025)**")
             
-            # Filtrar ventas solo para V2025 e I2025
-            ventas_rotacion = df_ventas[df_ventas['Temporada'].isin(['V2025', 'I2025'])].copy()
-            
-            # Preparar datos de entrada en almacén y traspasos para el cálculo de rotación
-            if not df_productos.empty and 'Fecha REAL entrada en almacén' in df_productos.columns:
-                # Crear ACT_14 en df_productos para matching
-                df_productos_rotacion = df_productos.copy()
-                df_productos_rotacion['ACT_14'] = df_productos_rotacion['ACT'].astype(str).str[:14]
-                df_productos_rotacion['Fecha REAL entrada en almacén'] = pd.to_datetime(
-                    df_productos_rotacion['Fecha REAL entrada en almacén'], errors='coerce')
-                
-                # Preparar traspasos
-                df_traspasos_rotacion = df_traspasos.copy()
-                df_traspasos_rotacion['ACT_14'] = df_traspasos_rotacion['ACT'].astype(str).str[:14]
-                df_traspasos_rotacion['Fecha Enviado'] = pd.to_datetime(
-                    df_traspasos_rotacion['Fecha Enviado'], errors='coerce')
+            # Rotación calculada en calculos.calcular_rotacion (join as-of de cada venta con entrada y envío)
+            rotacion = agregados['rotacion']
+            if rotacion is not None:
+                rotacion_por_tienda, rotacion_por_producto, n_rotacion = rotacion
                 
-                # Preparar ventas
-                ventas_rotacion['ACT_14'] = ventas_rotacion['ACT'].astype(str).str[:14]
-                ventas_rotacion['Fecha Documento'] = pd.to_datetime(
-                    ventas_rotacion['Fecha Documento'], errors='coerce')
-                
-                # OPTIMIZACIÓN: Usar merge en lugar de loops anidados
-                # 1. Merge ventas con entrada en almacén
-                ventas_con_entrada = ventas_rotacion.merge(
-                    df_productos_rotacion[['ACT_14', 'Talla', 'Fecha REAL entrada en almacén']],
-                    on=['ACT_14', 'Talla'],
-                    how='inner'
-                )
-                
-                # 2. Merge con traspasos
-                rotacion_completa = ventas_con_entrada.merge(
-                    df_traspasos_rotacion[['ACT_14', 'Talla', 'Tienda', 'Fecha Enviado']],
-                    left_on=['ACT_14', 'Talla', 'NombreTPV'],
-                    right_on=['ACT_14', 'Talla', 'Tienda'],
-                    how='inner'
-                )
-                
-                # 3. Calcular días de rotación
-                rotacion_completa['Dias_Rotacion'] = (
-                    rotacion_completa['Fecha Documento'] - rotacion_completa['Fecha REAL entrada en almacén']
-                ).dt.days
-                
-                # Filtrar solo días positivos
-                rotacion_completa = rotacion_completa[rotacion_completa['Dias_Rotacion'] >= 0]
-                
-                if not rotacion_completa.empty:
-                    # Calcular rotación por tienda
-                    rotacion_por_tienda = rotacion_completa.groupby('NombreTPV').agg({
-                        'Dias_Rotacion': ['mean', 'count']
-                    }).reset_index()
-                    rotacion_por_tienda.columns = ['Tienda', 'Dias_Promedio', 'Productos_Con_Rotacion']
-                    
-                    # Calcular rotación por producto
-                    rotacion_por_producto = rotacion_completa.groupby(['ACT_14', 'Descripción Familia']).agg({
-                        'Dias_Rotacion': ['mean', 'count']
-                    }).reset_index()
-                    rotacion_por_producto.columns = ['ACT', 'Producto', 'Dias_Promedio', 'Ventas_Con_Rotacion']
-                    
+                if n_rotacion > 0:
                     # Calcular KPIs
                     tienda_mayor_rotacion = "Sin datos"
                     tienda_mayor_rotacion_dias = 0
@@ -540,7 +504,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                     ), unsafe_allow_html=True)
                     
                     # Mostrar estadísticas adicionales
-                    st.info(f"📊 Análisis basado en {len(rotacion_completa)} productos con rotación calculada")
+                    st.info(f"📊 Análisis basado en {n_rotacion} productos con rotación calculada")
             else:
                 st.info("No hay datos de entrada en almacén disponibles para calcular rotación de stock.")
 
@@ -549,12 +513,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             
             with col1b:
                 viz_title("Ventas Mensuales por Tipo de Tienda")
-                ventas_mes_tipo = df_ventas.groupby(['Mes', 'Es_Online']).agg({
-                    'Cantidad': 'sum',
-                    'Ventas Dinero': 'sum'
-                }).reset_index()
-                
-                ventas_mes_tipo['Tipo'] = ventas_mes_tipo['Es_Online'].map({True: 'Online', False: 'Física'})
+                ventas_mes_tipo = agregados['ventas_mes_tipo']
                 
                 # Calculate dynamic width based on number of months
                 num_months = len(ventas_mes_tipo['Mes'].unique())
@@ -606,20 +565,13 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 # Filtrar solo las tiendas seleccionadas del ranking completo
                 tiendas_ranking = ventas_por_tienda_completo[ventas_por_tienda_completo['Tienda'].isin(tienda_seleccionada)].copy()
                 
-                # Calcular la familia más vendida para cada tienda (cached)
-                familias_por_tienda = calculate_family_rankings(df_ventas)
-                
-                # Obtener la familia top para cada tienda seleccionada
-                familias_top = []
-                for tienda in tiendas_ranking['Tienda']:
-                    familias_tienda = familias_por_tienda[familias_por_tienda['NombreTPV'] == tienda]
-                    if not familias_tienda.empty:
-                        familia_top = familias_tienda.iloc[0]['Familia']
-                        familias_top.append(familia_top)
-                    else:
-                        familias_top.append('Sin datos')
-                
-                tiendas_ranking['Familia Top'] = familias_top
+                # Familia más vendida de cada tienda (cached)
+                familias_por_tienda = calculate_family_rankings(df_ventas, version=version_filtrada)
+                familias_top, _ = precalculo.ranking(
+                    version_filtrada, 'familia top tienda', familias_por_tienda, 'Cantidad', por='NombreTPV'
+                )
+                familia_top = pd.Series(familias_top['Familia'].astype(str).to_numpy(), index=familias_top['NombreTPV'].astype(str))
+                tiendas_ranking['Familia Top'] = tiendas_ranking['Tienda'].astype(str).map(familia_top).fillna('Sin datos')
                 
                 # Reordenar columnas
                 tiendas_ranking = tiendas_ranking[['Tienda', 'Ranking', 'Unidades Vendidas', 'Ventas (€)', 'Familia Top']]
@@ -637,7 +589,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 with col2:
                     # Top 20 tiendas con más ventas por ventas (€)
                     viz_title("Top 20 tiendas con más ventas")
-                    top_20_tiendas = ventas_por_tienda_completo.head(20)
+                    top_20_tiendas = top_20_tiendas_completo
                     
                     fig = px.bar(
                         top_20_tiendas,
@@ -667,7 +619,8 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 with col3:
                     # Top 20 tiendas con menos ventas por ventas (€)
                     viz_title("Top 20 tiendas con menos ventas")
-                    bottom_20_tiendas = ventas_por_tienda_completo.tail(20)
+                    # Mismo orden que el ranking: de más a menos ventas
+                    bottom_20_tiendas = bottom_20_tiendas_completo.iloc[::-1]
                     
                     fig = px.bar(
                         bottom_20_tiendas,
@@ -694,756 +647,9 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                     )
                     st.plotly_chart(fig, use_container_width=True)
 
-            # Col 4: Unidades Vendidas por Talla (centered)
-            col4a, col4b, col4c = st.columns([1, 2, 1])
-            
-            with col4b:
-                viz_title("Unidades Vendidas por Talla")
-                
-                familias = sorted(df_ventas['Familia'].unique())
-                familia_seleccionada = st.selectbox("Selecciona una familia:", familias)
-                
-                # Filtrar df_ventas por familia seleccionada
-                df_familia = df_ventas[df_ventas['Familia'] == familia_seleccionada].copy()
-
-                if df_familia.empty:
-                    st.warning("No hay datos de ventas para la familia seleccionada.")
-                else:
-                    # Agrupamos por Talla y Temporada
-                    tallas_sumadas = (
-                        df_familia.groupby(['Talla', 'Temporada'])['Cantidad']
-                        .sum()
-                        .reset_index()
-                    )
-                    
-                    # Orden personalizado de tallas
-                    tallas_presentes = df_familia['Talla'].dropna().unique()
-                    tallas_orden = sorted(tallas_presentes, key=custom_sort_key)
-
-                    # Gráfico de barras apiladas por Temporada
-                    temporada_colors = get_temporada_colors(df_ventas)
-                    fig = px.bar(
-                        tallas_sumadas,
-                        x='Talla',
-                        y='Cantidad',
-                        color='Temporada',
-                        text='Cantidad',
-                        category_orders={'Talla': tallas_orden},
-                        color_discrete_map=temporada_colors,
-                        height=450
-                    )
-                    
-                    fig.update_layout(
-                        xaxis_title="Talla",
-                        yaxis_title="Unidades Vendidas",
-                        barmode="stack",
-                        margin=dict(t=30, b=0, l=0, r=0),
-                        paper_bgcolor="rgba(0,0,0,0)",
-                        plot_bgcolor="rgba(0,0,0,0)"
-                    )
-                    
-                    fig.update_traces(texttemplate='%{text:.0f}', textposition='inside', opacity=0.9)
-                    st.plotly_chart(fig, use_container_width=True)
-
-
-
-            # Col 5,6: Tablas por Temporada con layout dinámico
-            # Preparar datos de entrada en almacén para las tablas por temporada
-            # Agregar Descripción Familia a df_productos usando ACT codes de df_ventas
-            df_productos_temp = df_productos.copy()
-            
-
-            
-            # Crear ACT_14 (primeros 14 caracteres) en df_productos
-            df_productos_temp['ACT_14'] = df_productos_temp['ACT'].astype(str).str[:14]
-            
-            # Crear mapeo de ACT a Descripción Familia desde df_ventas
-            act_to_familia = df_ventas[['ACT', 'Descripción Familia']].drop_duplicates().set_index('ACT')['Descripción Familia'].to_dict()
-            
-            # Agregar Descripción Familia a df_productos usando ACT_14
-            df_productos_temp['Descripción Familia'] = df_productos_temp['ACT_14'].map(act_to_familia)
-            
-            # Filtrar por la familia seleccionada
-            df_almacen_fam = df_productos_temp[
-                df_productos_temp['Descripción Familia'] == familia_seleccionada
-            ].copy()
-            
-            # Identificar productos sin familia asignada
-            df_sin_familia = df_productos_temp[
-                df_productos_temp['Descripción Familia'].isna()
-            ].copy()
-            
-            # Inicializar df_pendientes como DataFrame vacío
-            df_pendientes = pd.DataFrame()
-            
-
-            
-            if not df_almacen_fam.empty and 'Fecha REAL entrada en almacén' in df_almacen_fam.columns:
-                # Convertir fecha de entrada en almacén
-                df_almacen_fam['Fecha REAL entrada en almacén'] = pd.to_datetime(
-                    df_almacen_fam['Fecha REAL entrada en almacén'], errors='coerce'
-                )
-                
-                # Separar filas con fecha válida y sin fecha
-                df_almacen_fam_con_fecha = df_almacen_fam.dropna(subset=['Fecha REAL entrada en almacén'])
-                df_almacen_fam_sin_fecha = df_almacen_fam[df_almacen_fam['Fecha REAL entrada en almacén'].isna()].copy()
-                
-                # Agregar mes de entrada para filas con fecha válida
-                df_almacen_fam_con_fecha['Mes Entrada'] = df_almacen_fam_con_fecha['Fecha REAL entrada en almacén'].dt.to_period('M').astype(str)
-                
-                # Separar filas pendientes de entrega (sin fecha válida)
-                if not df_almacen_fam_sin_fecha.empty:
-                    # Crear DataFrame separado para pendientes de entrega
-                    df_pendientes = df_almacen_fam_sin_fecha.copy()
-                    df_pendientes['Estado'] = 'Pendiente de entrega'
-                else:
-                    df_pendientes = pd.DataFrame()
-                
-                # Usar solo las filas con fecha válida para el análisis de almacén
-                df_almacen_fam = df_almacen_fam_con_fecha
-                
-                # Obtener el último mes de df_ventas para filtrar los datos
-                ultimo_mes_ventas = df_ventas['Mes'].max()
-                
-                # Preparar datos para la tabla por Temporada
-                # Buscar la columna correcta para cantidad de entrada en almacén
-                cantidad_col = None
-                for col in df_almacen_fam.columns:
-                    if 'cantidad' in col.lower() and 'pedida' not in col.lower():
-                        cantidad_col = col
-                        break
-                
-                if cantidad_col is None:
-                    # Si no encontramos una columna específica, usar 'Cantidad' o la primera columna numérica
-                    numeric_cols = df_almacen_fam.select_dtypes(include=[np.number]).columns
-                    if 'Cantidad' in df_almacen_fam.columns:
-                        cantidad_col = 'Cantidad'
-                    elif len(numeric_cols) > 0:
-                        cantidad_col = numeric_cols[0]
-                    else:
-                        st.error("No se encontró una columna de cantidad válida")
-                        cantidad_col = 'Cantidad'  # Fallback
-                
-
-                
-                datos_tabla = (
-                    df_almacen_fam.groupby(['Mes Entrada', 'Talla'])[cantidad_col]
-                    .sum()
-                    .reset_index()
-                    .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
-                    .sort_values(['Mes Entrada', 'Talla'])
-                )
-                
-                # Filtrar datos hasta el último mes de ventas
-                datos_tabla = datos_tabla[datos_tabla['Mes Entrada'] <= ultimo_mes_ventas]
-                
-                if not datos_tabla.empty:
-                    # Crear Tema_6 (primeros 6 caracteres) en df_almacen_fam
-                    df_almacen_fam['Tema_6'] = df_almacen_fam['Tema'].astype(str).str[:6]
-                    
-                    # Obtener todos los temas únicos de df_productos (no solo los vendidos)
-                    temas_productos = sorted(df_almacen_fam['Tema_6'].unique())
-                    
-                    # Calcular temas y num_temas SIEMPRE
-                    temas = temas_productos
-                    num_temas = len(temas)
-
-                    if num_temas > 0:
-                        # --- Sección: Entradas almacén y traspasos ---
-                        st.markdown('<hr style="margin: 1em 0; border-top: 2px solid #bbb;">', unsafe_allow_html=True)
-                        st.markdown('<h4 style="color:#333;font-weight:bold;">Entradas almacén y traspasos</h4>', unsafe_allow_html=True)
-                        
-                        # Si se han seleccionado tiendas específicas, mostrar tabla de análisis temporal
-                        if tiendas_especificas:
-                            st.subheader("Análisis Temporal: Entrada Almacén → Envío → Primera Venta")
-                            # Preparar datos para el análisis temporal
-                            timeline_data = []
-                            df_almacen_fam_timeline = df_almacen_fam.copy()
-                            df_almacen_fam_timeline['Fecha REAL entrada en almacén'] = pd.to_datetime(
-                                df_almacen_fam_timeline['Fecha REAL entrada en almacén'], errors='coerce')
-                            df_traspasos_timeline = df_traspasos_filtrado.copy()
-                            df_traspasos_timeline['Fecha Enviado'] = pd.to_datetime(
-                                df_traspasos_timeline['Fecha Enviado'], errors='coerce')
-                            # Create ACT_14 in traspasos data to match warehouse data
-                            df_traspasos_timeline['ACT_14'] = df_traspasos_timeline['ACT'].astype(str).str[:14]
-                            df_ventas_timeline = df_ventas.copy()
-                            
-                            df_ventas_timeline['Fecha Documento'] = pd.to_datetime(
-                                df_ventas_timeline['Fecha Documento'], errors='coerce')
-                            
-                            merged = pd.merge(
-                                df_almacen_fam_timeline,
-                                df_traspasos_timeline,
-                                left_on=['ACT_14', 'Talla'],
-                                right_on=['ACT_14', 'Talla'],
-                                suffixes=('_almacen', '_traspaso')
-                            )
-                            merged = merged[merged['Fecha Enviado'] >= merged['Fecha REAL entrada en almacén']]
-                            
-                            for _, row in merged.iterrows():
-                                fecha_entrada = row['Fecha REAL entrada en almacén']
-                                fecha_envio = row['Fecha Enviado']
-                                act = row['ACT_almacen'].strip()  # Remove trailing spaces
-                                talla = row['Talla'].strip()  # Remove trailing spaces
-                                tienda_envio = row['Tienda']
-                                tema = row['Tema']
-                                
-                                ventas_producto = df_ventas_timeline[
-                                    (df_ventas_timeline['ACT'].str.strip() == act) &
-                                    (df_ventas_timeline['Talla'].str.strip() == talla) &
-                                    (df_ventas_timeline['NombreTPV'].str.strip() == tienda_envio.strip()) &
-                                    (df_ventas_timeline['Fecha Documento'] >= fecha_entrada) &
-                                    (df_ventas_timeline['Cantidad'] > 0)
-                                ]
-                                
-                                if not ventas_producto.empty:
-                                    primera_venta = ventas_producto.loc[ventas_producto['Fecha Documento'].idxmin()]
-                                    fecha_primera_venta = primera_venta['Fecha Documento']
-                                    dias_entrada_venta = (fecha_primera_venta - fecha_entrada).days
-                                else:
-                                    fecha_primera_venta = None
-                                    dias_entrada_venta = -1  # Use -1 instead of None for "Sin ventas"
-                                dias_entrada_envio = (fecha_envio - fecha_entrada).days
-                                timeline_data.append({
-                                    'ACT': act,
-                                    'Tema': tema,
-                                    'Talla': talla,
-                                    'Tienda Envío': tienda_envio,
-                                    'Fecha Entrada Almacén': fecha_entrada.strftime('%d/%m/%Y'),
-                                    'Fecha Enviado': fecha_envio.strftime('%d/%m/%Y'),
-                                    'Fecha Primera Venta': fecha_primera_venta.strftime('%d/%m/%Y') if fecha_primera_venta else "Sin ventas",
-                                    'Días Entrada-Envío': dias_entrada_envio,
-                                    'Días Entrada-Primera Venta': dias_entrada_venta if dias_entrada_venta != -1 else -1
-                                })
-                            
-                            if timeline_data:
-                                df_timeline = pd.DataFrame(timeline_data)
-                                df_timeline['Fecha Entrada Almacén'] = pd.to_datetime(df_timeline['Fecha Entrada Almacén'], format='%d/%m/%Y')
-                                df_timeline = df_timeline.sort_values('Fecha Entrada Almacén', ascending=False)
-                                df_timeline['Fecha Entrada Almacén'] = df_timeline['Fecha Entrada Almacén'].dt.strftime('%d/%m/%Y')
-                                st.dataframe(
-                                    df_timeline,
-                                    use_container_width=True,
-                                    hide_index=True
-                                )
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    avg_dias_envio = pd.to_numeric(df_timeline['Días Entrada-Envío'], errors='coerce').mean()
-                                    st.metric("Promedio días Entrada→Envío", f"{avg_dias_envio:.1f} días")
-                                with col2:
-                                    avg_dias_venta = pd.to_numeric(df_timeline['Días Entrada-Primera Venta'].replace('Sin ventas', pd.NA), errors='coerce').mean()
-                                    st.metric("Promedio días Entrada→Primera Venta", f"{avg_dias_venta:.1f} días" if not pd.isna(avg_dias_venta) else "N/A")
-                                with col3:
-                                    total_productos = len(df_timeline)
-                                    st.metric("Total productos analizados", f"{total_productos}")
-                            else:
-                                st.info("No se encontraron datos de envíos para los productos de entrada en almacén de la familia seleccionada.")
-                        else:
-                            if num_temas == 1:
-                                # Un tema: centrado
-                                col5a, col5b, col5c = st.columns([1, 2, 1])
-                                with col5b:
-                                    tema = temas[0]
-                                    st.subheader(f"Entrada Almacén - {tema}")
-                                    
-                                    # Crear gráfico de comparación enviado vs ventas
-                                    if tema == 'T_OI25':
-                                        temporada_comparacion = 'I2025'
-                                    elif tema == 'T_PV25':
-                                        temporada_comparacion = 'V2025'
-                                    else:
-                                        temporada_comparacion = None
-                                    
-                                    if temporada_comparacion:
-                                        ventas_temporada = df_ventas[df_ventas['Temporada'] == temporada_comparacion]
-                                        if not ventas_temporada.empty:
-                                            act_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]['ACT_14'].unique()
-                                            ventas_tema = ventas_temporada[ventas_temporada['ACT'].isin(act_tema)]
-                                            if not ventas_tema.empty:
-                                                ventas_por_talla = ventas_tema.groupby('Talla')['Cantidad'].sum().reset_index()
-                                                enviado_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                                enviado_por_talla = enviado_tema.groupby('Talla')[cantidad_col].sum().reset_index()
-                                                datos_comparacion = pd.merge(
-                                                    enviado_por_talla, 
-                                                    ventas_por_talla, 
-                                                    on='Talla', 
-                                                    how='outer'
-                                                ).fillna(0)
-                                                # Ordenar tallas
-                                                datos_comparacion = datos_comparacion.sort_values('Talla', key=lambda x: x.map(custom_sort_key))
-                                                fig, ax = plt.subplots(figsize=(10, 6))
-                                                x = np.arange(len(datos_comparacion))
-                                                width = 0.35
-                                                ax.bar(x - width/2, datos_comparacion[cantidad_col], width, label='Enviado Almacén', color='purple', alpha=0.8)
-                                                ax.bar(x + width/2, datos_comparacion['Cantidad'], width, label='Ventas', color='darkblue', alpha=0.8)
-                                                ax.set_xlabel('Talla')
-                                                ax.set_ylabel('Cantidad')
-                                                ax.set_title(f'Enviado vs Ventas - {tema} ({temporada_comparacion})')
-                                                ax.set_xticks(x)
-                                                ax.set_xticklabels(datos_comparacion['Talla'])
-                                                ax.legend()
-                                                ax.grid(True, alpha=0.3)
-                                                st.pyplot(fig)
-                                                plt.close()
-                                    
-                                    # Filtrar datos para este tema específico
-                                    datos_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                    datos_tabla_tema = (
-                                        datos_tema.groupby(['Mes Entrada', 'Talla'])[cantidad_col]
-                                        .sum()
-                                        .reset_index()
-                                        .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
-                                        .sort_values(['Mes Entrada', 'Talla'])
-                                    )
-                                    
-                                    if not datos_tabla_tema.empty:
-                                        # Crear tabla pivot para mejor visualización
-                                        tabla_pivot = datos_tabla_tema.pivot_table(
-                                            index='Mes Entrada',
-                                            columns='Talla',
-                                            values='Cantidad Entrada Almacén',
-                                            fill_value=0
-                                        ).round(0)
-                                        tallas_orden = sorted(tabla_pivot.columns, key=custom_sort_key)
-                                        tabla_pivot = tabla_pivot[tallas_orden]
-                                        st.dataframe(
-                                            tabla_pivot.style.format("{:,.0f}"),
-                                            use_container_width=True,
-                                            hide_index=False
-                                        )
-                                        total_temp = tabla_pivot.sum().sum()
-                                        st.write(f"**Total Entrada Almacén:** {total_temp:,.0f}")
-                                    else:
-                                        st.info(f"No hay datos para el tema {tema}")
-                            elif num_temas == 2:
-                                col5, col6 = st.columns(2)
-                                for i, tema in enumerate(temas):
-                                    with locals()[f'col{5+i}']:
-                                        st.subheader(f"Entrada Almacén - {tema}")
-                                        
-                                        # Crear gráfico de comparación enviado vs ventas
-                                        if tema == 'T_OI25':
-                                            temporada_comparacion = 'I2025'
-                                        elif tema == 'T_PV25':
-                                            temporada_comparacion = 'V2025'
-                                        else:
-                                            temporada_comparacion = None
-                                        
-                                        if temporada_comparacion:
-                                            ventas_temporada = df_ventas[df_ventas['Temporada'] == temporada_comparacion]
-                                            if not ventas_temporada.empty:
-                                                act_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]['ACT_14'].unique()
-                                                ventas_tema = ventas_temporada[ventas_temporada['ACT'].isin(act_tema)]
-                                                if not ventas_tema.empty:
-                                                    ventas_por_talla = ventas_tema.groupby('Talla')['Cantidad'].sum().reset_index()
-                                                    enviado_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                                    enviado_por_talla = enviado_tema.groupby('Talla')[cantidad_col].sum().reset_index()
-                                                    datos_comparacion = pd.merge(
-                                                        enviado_por_talla, 
-                                                        ventas_por_talla, 
-                                                        on='Talla', 
-                                                        how='outer'
-                                                    ).fillna(0)
-                                                    # Ordenar tallas
-                                                    datos_comparacion = datos_comparacion.sort_values('Talla', key=lambda x: x.map(custom_sort_key))
-                                                    fig, ax = plt.subplots(figsize=(8, 5))
-                                                    x = np.arange(len(datos_comparacion))
-                                                    width = 0.35
-                                                    ax.bar(x - width/2, datos_comparacion[cantidad_col], width, label='Enviado Almacén', color='purple', alpha=0.8)
-                                                    ax.bar(x + width/2, datos_comparacion['Cantidad'], width, label='Ventas', color='darkblue', alpha=0.8)
-                                                    ax.set_xlabel('Talla')
-                                                    ax.set_ylabel('Cantidad')
-                                                    ax.set_title(f'Enviado vs Ventas - {tema} ({temporada_comparacion})')
-                                                    ax.set_xticks(x)
-                                                    ax.set_xticklabels(datos_comparacion['Talla'])
-                                                    ax.legend()
-                                                    ax.grid(True, alpha=0.3)
-                                                    st.pyplot(fig)
-                                                    plt.close()
-                                        
-                                        # Filtrar datos para este tema específico
-                                        datos_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                        datos_tabla_tema = (
-                                            datos_tema.groupby(['Mes Entrada', 'Talla'])[cantidad_col]
-                                            .sum()
-                                            .reset_index()
-                                            .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
-                                            .sort_values(['Mes Entrada', 'Talla'])
-                                        )
-                                        
-                                        if not datos_tabla_tema.empty:
-                                            # Crear tabla pivot para mejor visualización
-                                            tabla_pivot = datos_tabla_tema.pivot_table(
-                                                index='Mes Entrada',
-                                                columns='Talla',
-                                                values='Cantidad Entrada Almacén',
-                                                fill_value=0
-                                            ).round(0)
-                                            tallas_orden = sorted(tabla_pivot.columns, key=custom_sort_key)
-                                            tabla_pivot = tabla_pivot[tallas_orden]
-                                            st.dataframe(
-                                                tabla_pivot.style.format("{:,.0f}"),
-                                                use_container_width=True,
-                                                hide_index=False
-                                            )
-                                            total_temp = tabla_pivot.sum().sum()
-                                            st.write(f"**Total Entrada Almacén:** {total_temp:,.0f}")
-                                        else:
-                                            st.info(f"No hay datos para el tema {tema}")
-                            else:
-                                col5, col6 = st.columns(2)
-                                mitad = (num_temas + 1) // 2
-                                temas_col5 = temas[:mitad]
-                                temas_col6 = temas[mitad:]
-                                with col5:
-                                    for tema in temas_col5:
-                                        st.subheader(f"Entrada Almacén - {tema}")
-                                        
-                                        # Crear gráfico de comparación enviado vs ventas
-                                        if tema == 'T_OI25':
-                                            temporada_comparacion = 'I2025'
-                                        elif tema == 'T_PV25':
-                                            temporada_comparacion = 'V2025'
-                                        else:
-                                            temporada_comparacion = None
-                                        
-                                        if temporada_comparacion:
-                                            # Obtener datos de ventas para la temporada
-                                            ventas_temporada = df_ventas[df_ventas['Temporada'] == temporada_comparacion]
-                                            if not ventas_temporada.empty:
-                                                # Obtener ACTs del tema actual
-                                                act_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]['ACT_14'].unique()
-                                                
-                                                # Filtrar ventas por ACTs del tema
-                                                ventas_tema = ventas_temporada[ventas_temporada['ACT'].isin(act_tema)]
-                                                
-                                                if not ventas_tema.empty:
-                                                    # Agrupar ventas por talla
-                                                    ventas_por_talla = ventas_tema.groupby('Talla')['Cantidad'].sum().reset_index()
-                                                    
-                                                    # Obtener datos de enviado del tema
-                                                    enviado_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                                    enviado_por_talla = enviado_tema.groupby('Talla')[cantidad_col].sum().reset_index()
-                                                    
-                                                    # Combinar datos
-                                                    datos_comparacion = pd.merge(
-                                                        enviado_por_talla, 
-                                                        ventas_por_talla, 
-                                                        on='Talla', 
-                                                        how='outer'
-                                                    ).fillna(0)
-                                                    
-                                                    # Ordenar tallas
-                                                    datos_comparacion = datos_comparacion.sort_values('Talla', key=lambda x: x.map(custom_sort_key))
-                                                    
-                                                    # Crear gráfico
-                                                    fig, ax = plt.subplots(figsize=(8, 5))
-                                                    
-                                                    x = np.arange(len(datos_comparacion))
-                                                    width = 0.35
-                                                    
-                                                    ax.bar(x - width/2, datos_comparacion[cantidad_col], width, label='Enviado Almacén', color='purple', alpha=0.8)
-                                                    ax.bar(x + width/2, datos_comparacion['Cantidad'], width, label='Ventas', color='darkblue', alpha=0.8)
-                                                    
-                                                    ax.set_xlabel('Talla')
-                                                    ax.set_ylabel('Cantidad')
-                                                    ax.set_title(f'Enviado vs Ventas - {tema} ({temporada_comparacion})')
-                                                    ax.set_xticks(x)
-                                                    ax.set_xticklabels(datos_comparacion['Talla'])
-                                                    ax.legend()
-                                                    ax.grid(True, alpha=0.3)
-                                                    st.pyplot(fig)
-                                                    plt.close()
-                                        
-                                        # Filtrar datos para este tema específico
-                                        datos_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                        datos_tabla_tema = (
-                                            datos_tema.groupby(['Mes Entrada', 'Talla'])[cantidad_col]
-                                            .sum()
-                                            .reset_index()
-                                            .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
-                                            .sort_values(['Mes Entrada', 'Talla'])
-                                        )
-                                        
-                                        if not datos_tabla_tema.empty:
-                                            # Crear tabla pivot para mejor visualización
-                                            tabla_pivot = datos_tabla_tema.pivot_table(
-                                                index='Mes Entrada',
-                                                columns='Talla',
-                                                values='Cantidad Entrada Almacén',
-                                                fill_value=0
-                                            ).round(0)
-                                            tallas_orden = sorted(tabla_pivot.columns, key=custom_sort_key)
-                                            tabla_pivot = tabla_pivot[tallas_orden]
-                                            st.dataframe(
-                                                tabla_pivot.style.format("{:,.0f}"),
-                                                use_container_width=True,
-                                                hide_index=False
-                                            )
-                                            total_temp = tabla_pivot.sum().sum()
-                                            st.write(f"**Total Entrada Almacén:** {total_temp:,.0f}")
-                                        else:
-                                            st.info(f"No hay datos para el tema {tema}")
-                                with col6:
-                                    for tema in temas_col6:
-                                        st.subheader(f"Entrada Almacén - {tema}")
-                                        
-                                        # Crear gráfico de comparación enviado vs ventas
-                                        if tema == 'T_OI25':
-                                            temporada_comparacion = 'I2025'
-                                        elif tema == 'T_PV25':
-                                            temporada_comparacion = 'V2025'
-                                        else:
-                                            temporada_comparacion = None
-                                        
-                                        if temporada_comparacion:
-                                            # Obtener datos de ventas para la temporada
-                                            ventas_temporada = df_ventas[df_ventas['Temporada'] == temporada_comparacion]
-                                            if not ventas_temporada.empty:
-                                                # Obtener ACTs del tema actual
-                                                act_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]['ACT_14'].unique()
-                                                
-                                                # Filtrar ventas por ACTs del tema
-                                                ventas_tema = ventas_temporada[ventas_temporada['ACT'].isin(act_tema)]
-                                                
-                                                if not ventas_tema.empty:
-                                                    # Agrupar ventas por talla
-                                                    ventas_por_talla = ventas_tema.groupby('Talla')['Cantidad'].sum().reset_index()
-                                                    
-                                                    # Obtener datos de enviado del tema
-                                                    enviado_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                                    enviado_por_talla = enviado_tema.groupby('Talla')[cantidad_col].sum().reset_index()
-                                                    
-                                                    # Combinar datos
-                                                    datos_comparacion = pd.merge(
-                                                        enviado_por_talla, 
-                                                        ventas_por_talla, 
-                                                        on='Talla', 
-                                                        how='outer'
-                                                    ).fillna(0)
-                                                    
-                                                    # Ordenar tallas
-                                                    datos_comparacion = datos_comparacion.sort_values('Talla', key=lambda x: x.map(custom_sort_key))
-                                                    
-                                                    # Crear gráfico
-                                                    fig, ax = plt.subplots(figsize=(8, 5))
-                                                    
-                                                    x = np.arange(len(datos_comparacion))
-                                                    width = 0.35
-                                                    
-                                                    ax.bar(x - width/2, datos_comparacion[cantidad_col], width, label='Enviado Almacén', color='purple', alpha=0.8)
-                                                    ax.bar(x + width/2, datos_comparacion['Cantidad'], width, label='Ventas', color='darkblue', alpha=0.8)
-                                                    
-                                                    ax.set_xlabel('Talla')
-                                                    ax.set_ylabel('Cantidad')
-                                                    ax.set_title(f'Enviado vs Ventas - {tema} ({temporada_comparacion})')
-                                                    ax.set_xticks(x)
-                                                    ax.set_xticklabels(datos_comparacion['Talla'])
-                                                    ax.legend()
-                                                    ax.grid(True, alpha=0.3)
-                                                    st.pyplot(fig)
-                                                    plt.close()
-                                        
-                                        # Filtrar datos para este tema específico
-                                        datos_tema = df_almacen_fam[df_almacen_fam['Tema_6'] == tema]
-                                        datos_tabla_tema = (
-                                            datos_tema.groupby(['Mes Entrada', 'Talla'])[cantidad_col]
-                                            .sum()
-                                            .reset_index()
-                                            .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
-                                            .sort_values(['Mes Entrada', 'Talla'])
-                                        )
-                                        
-                                        if not datos_tabla_tema.empty:
-                                            # Crear tabla pivot para mejor visualización
-                                            tabla_pivot = datos_tabla_tema.pivot_table(
-                                                index='Mes Entrada',
-                                                columns='Talla',
-                                                values='Cantidad Entrada Almacén',
-                                                fill_value=0
-                                            ).round(0)
-                                            tallas_orden = sorted(tabla_pivot.columns, key=custom_sort_key)
-                                            tabla_pivot = tabla_pivot[tallas_orden]
-                                            st.dataframe(
-                                                tabla_pivot.style.format("{:,.0f}"),
-                                                use_container_width=True,
-                                                hide_index=False
-                                            )
-                                            total_temp = tabla_pivot.sum().sum()
-                                            st.write(f"**Total Entrada Almacén:** {total_temp:,.0f}")
-                                        else:
-                                            st.info(f"No hay datos para el tema {tema}")
-                else:
-                    st.info("No hay datos de entrada en almacén disponibles para la familia seleccionada.")
-
-            # --- Tabla de Pendientes de Entrega ---
-            if not df_pendientes.empty:
-                st.markdown("---")
-                viz_title("Pendientes de Entrega")
-                
-                # Buscar la columna correcta para cantidad
-                cantidad_col_pendientes = None
-                for col in df_pendientes.columns:
-                    if 'cantidad' in col.lower() and 'pedida' not in col.lower():
-                        cantidad_col_pendientes = col
-                        break
-                
-                if cantidad_col_pendientes is None:
-                    # Si no encontramos una columna específica, usar 'Cantidad' o la primera columna numérica
-                    numeric_cols = df_pendientes.select_dtypes(include=[np.number]).columns
-                    if 'Cantidad' in df_pendientes.columns:
-                        cantidad_col_pendientes = 'Cantidad'
-                    elif len(numeric_cols) > 0:
-                        cantidad_col_pendientes = numeric_cols[0]
-                    else:
-                        st.error("No se encontró una columna de cantidad válida para pendientes")
-                        cantidad_col_pendientes = 'Cantidad'  # Fallback
-                
-                # Preparar datos de pendientes por talla
-                datos_pendientes = (
-                    df_pendientes.groupby(['Talla'])[cantidad_col_pendientes]
-                    .sum()
-                    .reset_index()
-                    .rename(columns={cantidad_col_pendientes: 'Cantidad Pendiente'})
-                    .sort_values('Talla', key=lambda x: x.map(custom_sort_key))
-                )
-                
-                if not datos_pendientes.empty:
-                    # Mostrar tabla de pendientes
-                    st.dataframe(
-                        datos_pendientes.style.format({
-                            'Cantidad Pendiente': '{:,.0f}'
-                        }),
-                        use_container_width=True,
-                        hide_index=True
-                    )
-                    
-                    # Mostrar total
-                    total_pendientes = datos_pendientes['Cantidad Pendiente'].sum()
-                    st.write(f"**Total Pendientes de Entrega:** {total_pendientes:,.0f}")
-                    
-                    # Mostrar información adicional
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Total productos pendientes", len(df_pendientes))
-                    with col2:
-                        st.metric("Tallas diferentes", len(datos_pendientes))
-                    with col3:
-                        st.metric("Promedio por talla", f"{total_pendientes/len(datos_pendientes):,.0f}")
-                else:
-                    st.info("No hay datos de pendientes de entrega para mostrar.")
-            else:
-                pass
-
-            # --- Tabla de Productos Sin Familia Asignada ---
-            if not df_sin_familia.empty:
-                st.markdown("---")
-                viz_title("Productos Sin Familia Asignada")
-                
-                # Buscar la columna correcta para cantidad
-                cantidad_col_sin_familia = None
-                for col in df_sin_familia.columns:
-                    if 'cantidad' in col.lower() and 'pedida' not in col.lower():
-                        cantidad_col_sin_familia = col
-                        break
-                
-                if cantidad_col_sin_familia is None:
-                    # Si no encontramos una columna específica, usar 'Cantidad' o la primera columna numérica
-                    numeric_cols = df_sin_familia.select_dtypes(include=[np.number]).columns
-                    if 'Cantidad' in df_sin_familia.columns:
-                        cantidad_col_sin_familia = 'Cantidad'
-                    elif len(numeric_cols) > 0:
-                        cantidad_col_sin_familia = numeric_cols[0]
-                    else:
-                        st.error("No se encontró una columna de cantidad válida para productos sin familia")
-                        cantidad_col_sin_familia = 'Cantidad'  # Fallback
-                
-                # Verificar si existe la columna 'Modelo Artículo'
-                if 'Modelo Artículo' in df_sin_familia.columns:
-                    # Preparar datos de productos sin familia por Modelo Artículo
-                    datos_sin_familia = (
-                        df_sin_familia.groupby(['Modelo Artículo'])[cantidad_col_sin_familia]
-                        .sum()
-                        .reset_index()
-                        .rename(columns={cantidad_col_sin_familia: 'Cantidad Total'})
-                        .sort_values('Cantidad Total', ascending=False)
-                    )
-                    
-                    if not datos_sin_familia.empty:
-                        # Mostrar tabla de productos sin familia
-                        st.dataframe(
-                            datos_sin_familia.style.format({
-                                'Cantidad Total': '{:,.0f}'
-                            }),
-                            use_container_width=True,
-                            hide_index=True
-                        )
-                        
-                        # Mostrar total
-                        total_sin_familia = datos_sin_familia['Cantidad Total'].sum()
-                        st.write(f"**Total Productos Sin Familia:** {total_sin_familia:,.0f}")
-                        
-                        # Mostrar información adicional
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Total productos sin familia", len(df_sin_familia))
-                        with col2:
-                            st.metric("Modelos diferentes", len(datos_sin_familia))
-                        with col3:
-                            st.metric("Promedio por modelo", f"{total_sin_familia/len(datos_sin_familia):,.0f}")
-                    else:
-                        st.info("No hay datos de productos sin familia para mostrar.")
-                else:
-                    st.warning("No se encontró la columna 'Modelo Artículo' en los datos de productos sin familia.")
-            else:
-                st.info("No hay productos sin familia asignada.")
-
-            # --- Tabla de Cantidad Pedida por Mes y Talla ---
-            # Solo mostrar esta tabla cuando NO se han seleccionado tiendas específicas
-            if not tiendas_especificas:
-                st.markdown("---")
-                viz_title("Cantidad Pedida por Mes y Talla")
-                
-                if not df_almacen_fam.empty and 'Cantidad Pedida' in df_almacen_fam.columns:
-                    # Preparar datos de cantidad pedida
-                    datos_pedida = (
-                        df_almacen_fam.groupby(['Mes Entrada', 'Talla'])['Cantidad Pedida']
-                        .sum()
-                        .reset_index()
-                        .rename(columns={'Mes Entrada': 'Mes', 'Cantidad Pedida': 'Cantidad Pedida'})
-                        .sort_values(['Mes', 'Talla'])
-                    )
-                    
-                    # Filtrar datos hasta el último mes de ventas
-                    datos_pedida = datos_pedida[datos_pedida['Mes'] <= ultimo_mes_ventas]
-                    
-                    if not datos_pedida.empty:
-                        # Crear tabla pivot para mejor visualización
-                        tabla_pedida_pivot = datos_pedida.pivot_table(
-                            index='Mes',
-                            columns='Talla',
-                            values='Cantidad Pedida',
-                            fill_value=0
-                        ).round(0)
-                        
-                        # Ordenar tallas usando la función custom_sort_key
-                        tallas_orden = sorted(tabla_pedida_pivot.columns, key=custom_sort_key)
-                        tabla_pedida_pivot = tabla_pedida_pivot[tallas_orden]
-                        
-                        # Mostrar la tabla
-                        st.dataframe(
-                            tabla_pedida_pivot.style.format("{:,.0f}"),
-                            use_container_width=True,
-                            hide_index=False
-                        )
-                        
-                        # Mostrar total
-                        total_pedida = tabla_pedida_pivot.sum().sum()
-                        st.write(f"**Total Cantidad Pedida:** {total_pedida:,.0f}")
-                    else:
-                        st.info("No hay datos de cantidad pedida para la familia seleccionada.")
-                else:
-                    st.info("No hay datos de cantidad pedida disponibles para la familia seleccionada.")
+            # Col 4-6: Ventas por talla y tablas de almacén de la familia seleccionada
+            panel_tallas_familia(df_ventas, df_productos, df_dim_producto, df_traspasos_filtrado,
+                                 cantidad_col_compra, tiendas_especificas, version_filtrada)
 
             # --- Ventas vs Traspasos por Tienda ---
             st.markdown("---")
@@ -1451,42 +657,33 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             
             # Preparar datos de traspasos hasta la fecha máxima de ventas
             ultimo_mes_ventas = df_ventas['Mes'].max()
-            df_traspasos_filtrado = df_traspasos_filtrado.copy()
+            df_traspasos_filtrado = df_traspasos_filtrado.copy(deep=False)
             
             # Convertir fecha de traspasos y filtrar hasta el último mes de ventas
-            df_traspasos_filtrado['Mes Enviado'] = pd.to_datetime(df_traspasos_filtrado['Fecha Enviado']).dt.to_period('M').astype(str)
+            df_traspasos_filtrado['Mes Enviado'] = df_traspasos_filtrado['Fecha Enviado'].dt.to_period('M').astype(str)
             df_traspasos_filtrado = df_traspasos_filtrado[df_traspasos_filtrado['Mes Enviado'] <= ultimo_mes_ventas]
             
-            # Agrupar ventas por tienda y temporada
-            ventas_por_tienda_temp = df_ventas.groupby(['Tienda', 'Temporada'])['Cantidad'].sum().reset_index()
-            ventas_por_tienda_temp['Tipo'] = 'Ventas'
+            # Ventas por tienda y temporada (calculos.agregados_resumen)
+            ventas_por_tienda_temp = agregados['ventas_tienda_temporada'].assign(Tipo='Ventas')
             ventas_por_tienda_temp = ventas_por_tienda_temp.rename(columns={'Cantidad': 'Cantidad Total'})
             
-            # Obtener ACTs que existen en ventas (limpiar espacios)
-            act_en_ventas = df_ventas['ACT'].str.strip().unique()
-            
-            # Limpiar ACTs en traspasos también
-            df_traspasos_filtrado['ACT_clean'] = df_traspasos_filtrado['ACT'].str.strip()
-            
-            # Filtrar traspasos para solo incluir ACTs que están en ventas
-            df_traspasos_filtrado_act = df_traspasos_filtrado[df_traspasos_filtrado['ACT_clean'].isin(act_en_ventas)]
+            # Filtrar traspasos para solo incluir ACTs que están en ventas. ACT llega limpio
+            # de la ingesta y comparte diccionario en ambas hojas: se comparan códigos
+            act_en_ventas = np.unique(df_ventas['ACT'].cat.codes)
+            df_traspasos_filtrado_act = df_traspasos_filtrado[np.isin(df_traspasos_filtrado['ACT'].cat.codes, act_en_ventas)]
             
             # Agrupar traspasos por tienda y temporada
             if not df_traspasos_filtrado_act.empty:
-                # Asegurar que la columna Temporada existe en traspasos
+                # Asegurar que la columna Temporada existe en traspasos (los alias se resuelven al ingerir)
                 if 'Temporada' not in df_traspasos_filtrado_act.columns:
-                    temporada_columns = [col for col in df_traspasos_filtrado_act.columns if 'temporada' in col.lower() or 'season' in col.lower()]
-                    if temporada_columns:
-                        df_traspasos_filtrado_act['Temporada'] = df_traspasos_filtrado_act[temporada_columns[0]]
-                    else:
-                        df_traspasos_filtrado_act['Temporada'] = 'Sin Temporada'
+                    df_traspasos_filtrado_act['Temporada'] = 'Sin Temporada'
                 else:
                     df_traspasos_filtrado_act['Temporada'] = df_traspasos_filtrado_act['Temporada'].fillna('Sin Temporada')
                 
                 # Limpiar temporada en traspasos para que coincida con ventas
                 df_traspasos_filtrado_act['Temporada'] = df_traspasos_filtrado_act['Temporada'].str.strip().str[:5]
                 
-                traspasos_por_tienda_temp = df_traspasos_filtrado_act.groupby(['Tienda', 'Temporada'])['Enviado'].sum().reset_index()
+                traspasos_por_tienda_temp = df_traspasos_filtrado_act.groupby(['Tienda', 'Temporada'], observed=True)['Enviado'].sum().reset_index()
                 traspasos_por_tienda_temp['Tipo'] = 'Traspasos'
                 traspasos_por_tienda_temp = traspasos_por_tienda_temp.rename(columns={'Enviado': 'Cantidad Total'})
             else:
@@ -1498,106 +695,33 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             
             if not datos_comparacion.empty:
                 # Obtener top 20 tiendas por ventas totales
-                top_tiendas_ventas = df_ventas.groupby('Tienda')['Cantidad'].sum().nlargest(20).index.tolist()
+                top_tiendas_ventas = agregados['top_tiendas_ventas']
                 
                 # Filtrar datos para top 20 tiendas
                 datos_top_tiendas = datos_comparacion[datos_comparacion['Tienda'].isin(top_tiendas_ventas)]
                 
                 if not datos_top_tiendas.empty:
-                    # Crear gráfico con exactamente 2 barras por tienda (Ventas y Traspasos)
-                    # Preparar datos para el nuevo formato
-                    ventas_data = datos_top_tiendas[datos_top_tiendas['Tipo'] == 'Ventas'].copy()
-                    traspasos_data = datos_top_tiendas[datos_top_tiendas['Tipo'] == 'Traspasos'].copy()
-                    
-                    # Obtener colores de temporada
-                    temporada_colors = get_temporada_colors(df_ventas)
-                    
-                    # Crear figura
-                    fig = go.Figure()
-                    
-                    # Obtener todas las tiendas únicas
-                    tiendas_unicas = sorted(datos_top_tiendas['Tienda'].unique())
-                    temporadas = sorted(datos_top_tiendas['Temporada'].unique())
-                    
-                    # Definir diferentes tonos de amarillo para traspasos por temporada
-                    yellow_colors = ['#ffff00', '#ffeb3b', '#ffc107', '#ff9800', '#ff5722', '#f57c00', '#ef6c00', '#e65100']
-                    
-                    # Crear datos para cada tienda con dos barras (Ventas y Traspasos)
-                    for tienda in tiendas_unicas:
-                        # Datos de ventas para esta tienda
-                        ventas_tienda = ventas_data[ventas_data['Tienda'] == tienda]
-                        traspasos_tienda = traspasos_data[traspasos_data['Tienda'] == tienda]
-                        
-                        # Agregar barra de VENTAS (dividida por temporada)
-                        if not ventas_tienda.empty:
-                            for i, temporada in enumerate(temporadas):
-                                ventas_temp = ventas_tienda[ventas_tienda['Temporada'] == temporada]
-                                if not ventas_temp.empty:
-                                    fig.add_trace(go.Bar(
-                                        name=f'Ventas - {temporada}',
-                                        x=[f'{tienda} - Ventas'],
-                                        y=ventas_temp['Cantidad Total'],
-                                        marker_color=temporada_colors.get(temporada, '#1f77b4'),
-                                        text=ventas_temp['Cantidad Total'],
-                                        texttemplate='%{text:,.0f}',
-                                        textposition='inside',
-                                        hovertemplate=f"Tienda: {tienda}<br>Tipo: Ventas<br>Temporada: {temporada}<br>Cantidad: %{{y:,.0f}}<extra></extra>",
-                                        opacity=0.8,
-                                        showlegend=True if tienda == tiendas_unicas[0] else False,  # Solo mostrar legend para la primera tienda
-                                        legendgroup=f'Ventas - {temporada}'
-                                    ))
-                        
-                        # Agregar barra de TRASPASOS (dividida por temporada)
-                        if not traspasos_tienda.empty:
-                            for i, temporada in enumerate(temporadas):
-                                traspasos_temp = traspasos_tienda[traspasos_tienda['Temporada'] == temporada]
-                                if not traspasos_temp.empty:
-                                    # Usar diferentes tonos de amarillo para cada temporada
-                                    yellow_color = yellow_colors[i % len(yellow_colors)]
-                                    fig.add_trace(go.Bar(
-                                        name=f'Traspasos - {temporada}',
-                                        x=[f'{tienda} - Traspasos'],
-                                        y=traspasos_temp['Cantidad Total'],
-                                        marker_color=yellow_color,  # Diferentes tonos de amarillo por temporada
-                                        text=traspasos_temp['Cantidad Total'],
-                                        texttemplate='%{text:,.0f}',
-                                        textposition='inside',
-                                        hovertemplate=f"Tienda: {tienda}<br>Tipo: Traspasos<br>Temporada: {temporada}<br>Cantidad: %{{y:,.0f}}<extra></extra>",
-                                        opacity=0.8,
-                                        showlegend=True if tienda == tiendas_unicas[0] else False,  # Solo mostrar legend para la primera tienda
-                                        legendgroup=f'Traspasos - {temporada}'
-                                    ))
-                    
-                    # Configurar layout
-                    fig.update_layout(
-                        title="Ventas vs Traspasos por Tienda",
-                        xaxis_title="Tienda",
-                        yaxis_title="Cantidad Total",
-                        barmode='stack',  # Barras apiladas por temporada
-                        xaxis_tickangle=45,
-                        showlegend=True,
-                        margin=dict(t=30, b=0, l=0, r=0),
-                        paper_bgcolor="rgba(0,0,0,0)",
-                        plot_bgcolor="rgba(0,0,0,0)",
-                        height=500
-                    )
-                    
+                    # Dos barras por tienda (Ventas y Traspasos) apiladas por temporada
+                    temporada_colors = get_temporada_colors(df_ventas, version=version_filtrada)
+                    fig = figura_ventas_traspasos(datos_top_tiendas, temporada_colors)
+
                     st.plotly_chart(fig, use_container_width=True)
                     
                     # Mostrar tabla resumen con breakdown por temporada
                     st.subheader("Resumen de Ventas vs Traspasos por Temporada")
                     
                     # Tabla con breakdown por temporada
-                    resumen_temporada = datos_top_tiendas.groupby(['Tienda', 'Tipo', 'Temporada'])['Cantidad Total'].sum().reset_index()
+                    resumen_temporada = datos_top_tiendas.groupby(['Tienda', 'Tipo', 'Temporada'], observed=True)['Cantidad Total'].sum().reset_index()
                     resumen_pivot_temp = resumen_temporada.pivot_table(
                         index=['Tienda', 'Temporada'], 
                         columns='Tipo', 
                         values='Cantidad Total', 
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     ).reset_index()
                     
                     # Calcular totales por tienda
-                    resumen_totales = datos_top_tiendas.groupby(['Tienda', 'Tipo'])['Cantidad Total'].sum().reset_index()
+                    resumen_totales = datos_top_tiendas.groupby(['Tienda', 'Tipo'], observed=True)['Cantidad Total'].sum().reset_index()
                     resumen_pivot_totales = resumen_totales.pivot(index='Tienda', columns='Tipo', values='Cantidad Total').fillna(0)
                     resumen_pivot_totales['Diferencia'] = resumen_pivot_totales['Ventas'] - resumen_pivot_totales['Traspasos']
                     
@@ -1605,7 +729,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                     resumen_pivot_totales['Eficiencia %'] = (resumen_pivot_totales['Ventas'] / resumen_pivot_totales['Traspasos'] * 100).fillna(0)
 
                     # Calcular Devoluciones (cantidad negativa) por tienda
-                    devoluciones_por_tienda = df_ventas[df_ventas['Cantidad'] < 0].groupby('Tienda')['Cantidad'].sum().abs()
+                    devoluciones_por_tienda = agregados['devoluciones_por_tienda']
                     resumen_pivot_totales['Devoluciones'] = devoluciones_por_tienda.reindex(resumen_pivot_totales.index).fillna(0)
                     
                     # Calcular Ratio de devolución (Devoluciones / Ventas * 100)
@@ -1641,159 +765,24 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             else:
                 st.info("No hay datos de traspasos disponibles para la comparación.")
 
-            
-            # --- REVISED: Top/Bottom 10 Complete Descriptions by Family ---
-            st.markdown("---")
-            viz_title("Análisis de Descripciones por Familia")
-
-            desc_path = os.path.join('data', 'datos_descripciones.xlsx')
-            if os.path.exists(desc_path):
-                try:
-                    df_desc = pd.read_excel(desc_path, engine='openpyxl')
-                    desc_cols = ['MANGA', 'CUELLO', 'TEJIDO', 'DETALLE', 'ESTILO', 'CORTE']
-                    col_filter1, col_filter2 = st.columns(2)
-                    with col_filter1:
-                        ventas_desc = df_ventas.copy()
-                        ventas_desc['ACT_clean'] = ventas_desc['ACT'].astype(str).str[:-1]
-                        familias_disponibles = sorted(ventas_desc['Familia'].dropna().unique())
-                        familia_seleccionada = st.selectbox(
-                            "Selecciona una Familia:", 
-                            familias_disponibles, 
-                            key="familia_desc_selector"
-                        )
-                    with col_filter2:
-                        opciones_desc = ["Descripción Completa"] + desc_cols
-                        tipo_descripcion = st.selectbox(
-                            "Selecciona Tipo de Descripción:", 
-                            opciones_desc, 
-                            key="tipo_desc_selector"
-                        )
-                    # Determinar columna requerida
-                    if tipo_descripcion == "Descripción Completa":
-                        # Unir todas las columnas de descripción de manera seguida (sin separadores)
-                        desc_cols_existentes = [col for col in desc_cols if col in df_desc.columns]
-                        if desc_cols_existentes:
-                            df_desc['Descripción Analizada'] = df_desc[desc_cols_existentes].fillna('').agg(' '.join, axis=1).str.replace(' +', ' ', regex=True).str.strip()
-                            df_desc['longitud_desc'] = df_desc['Descripción Analizada'].str.len()
-                            required_cols = ['ACT'] + desc_cols_existentes
-                        else:
-                            df_desc['Descripción Analizada'] = 'N/A'
-                            df_desc['longitud_desc'] = 0
-                            required_cols = ['ACT']
-                    else:
-                        required_cols = ['ACT', tipo_descripcion]
-                        if tipo_descripcion in df_desc.columns:
-                            df_desc['Descripción Analizada'] = df_desc[tipo_descripcion].fillna('N/A')
-                            df_desc['longitud_desc'] = df_desc['Descripción Analizada'].str.len()
-                        else:
-                            df_desc['Descripción Analizada'] = 'N/A'
-                            df_desc['longitud_desc'] = 0
-                    # Comprobar si existen las columnas necesarias
-                    if all(col in df_desc.columns for col in required_cols):
-                        df_desc_clean = df_desc[['ACT', 'Descripción Analizada', 'longitud_desc']].copy().dropna()
-                        ventas_con_desc = ventas_desc.merge(
-                            df_desc_clean,
-                            left_on='ACT_clean',
-                            right_on='ACT',
-                            how='inner'
-                        )
-                        df_familia_desc = ventas_con_desc[ventas_con_desc['Familia'] == familia_seleccionada]
-                        desc_group = df_familia_desc.groupby('Descripción Analizada').agg({
-                            'Ventas Dinero': 'sum',
-                            'Cantidad': 'sum',
-                            'longitud_desc': 'first'
-                        }).reset_index()
-                        desc_group = desc_group[desc_group['Descripción Analizada'] != 'N/A']
-                        desc_group = desc_group[desc_group['Descripción Analizada'].str.strip() != '']
-                        # Filtrar solo las descripciones más largas
-                        desc_group = desc_group.sort_values('longitud_desc', ascending=False)
-                        desc_group_largas = desc_group.head(30)  # Tomar las 30 más largas para asegurar variedad
-                        # Top 10 más vendidas entre las más largas
-                        top10 = desc_group_largas.sort_values('Ventas Dinero', ascending=False).head(10)
-                        # Top 10 menos vendidas entre las más largas
-                        bottom10 = desc_group_largas.sort_values('Ventas Dinero', ascending=True).head(10)
-                        altura_por_fila = 40
-                        altura_minima = 400
-                        altura_maxima = 800
-                        altura_top = min(max(len(top10) * altura_por_fila, altura_minima), altura_maxima)
-                        altura_bottom = min(max(len(bottom10) * altura_por_fila, altura_minima), altura_maxima)
-                        viz_title(f'Top 10 en {tipo_descripcion} (descripciones más largas) - {familia_seleccionada}')
-                        fig_top = px.bar(
-                            top10, 
-                            x='Ventas Dinero', 
-                            y='Descripción Analizada', 
-                            orientation='h', 
-                            color='Ventas Dinero', 
-                            color_continuous_scale=COLOR_GRADIENT,
-                            text='Cantidad'
-                        )
-                        fig_top.update_layout(
-                            showlegend=False, 
-                            height=altura_top,
-                            yaxis={'categoryorder':'total ascending', 'title': ''},
-                            margin=dict(t=30, b=0, l=0, r=0),
-                            paper_bgcolor="rgba(0,0,0,0)", 
-                            plot_bgcolor="rgba(0,0,0,0)"
-                        )
-                        fig_top.update_traces(
-                            texttemplate='%{text:,.0f} uds', 
-                            textposition='outside', 
-                            hovertemplate="Descripción: %{y}<br>Ventas: %{x:,.2f}€<br>Unidades: %{text:,.0f}<extra></extra>",
-                            opacity=0.8
-                        )
-                        st.plotly_chart(fig_top, use_container_width=True, key=f"top10_{tipo_descripcion}_{familia_seleccionada}")
-                        viz_title(f'Bottom 10 en {tipo_descripcion} (descripciones más largas) - {familia_seleccionada}')
-                        fig_bottom = px.bar(
-                            bottom10, 
-                            x='Ventas Dinero', 
-                            y='Descripción Analizada', 
-                            orientation='h', 
-                            color='Ventas Dinero', 
-                            color_continuous_scale=COLOR_GRADIENT,
-                            text='Cantidad'
-                        )
-                        fig_bottom.update_layout(
-                            showlegend=False, 
-                            height=altura_bottom,
-                            yaxis={'categoryorder':'total ascending', 'title': ''},
-                            margin=dict(t=30, b=0, l=0, r=0),
-                            paper_bgcolor="rgba(0,0,0,0)", 
-                            plot_bgcolor="rgba(0,0,0,0)"
-                        )
-                        fig_bottom.update_traces(
-                            texttemplate='%{text:,.0f} uds', 
-                            textposition='outside', 
-                            hovertemplate="Descripción: %{y}<br>Ventas: %{x:,.2f}€<br>Unidades: %{text:,.0f}<extra></extra>",
-                            opacity=0.8
-                        )
-                        st.plotly_chart(fig_bottom, use_container_width=True, key=f"bottom10_{tipo_descripcion}_{familia_seleccionada}")
-                    else:
-                        st.warning(f"Una o más columnas de descripción no se encontraron. Se necesitan: {required_cols}")
-                except Exception as e:
-                    st.error(f"Error crítico al procesar las descripciones de productos: {e}")
-            else:
-                st.warning("Archivo `datos_descripciones.xlsx` no encontrado en la carpeta `data/`.")
-
-            # --- END REVISED ---
+            # --- Análisis de descripciones por familia ---
+            panel_descripciones(df_ventas, df_dim_producto, version_filtrada)
 
         except Exception as e:
             st.error(f"Error al calcular KPIs: {e}")
 
     elif seccion == "Geográfico y Tiendas":
-        # Preparar datos
-        ventas_por_zona = df_ventas.groupby('Zona geográfica')['Cantidad'].sum().reset_index()
-        ventas_por_tienda = df_ventas.groupby('NombreTPV')['Cantidad'].sum().reset_index()
-        tiendas_por_zona = df_ventas[['NombreTPV', 'Zona geográfica']].drop_duplicates().groupby('Zona geográfica').count().reset_index()
+        # Preparar datos (agregados de calculos.agregados_geografico, compartidos: no modificar)
+        ventas_por_zona = agregados['ventas_por_zona']
+        ventas_por_tienda = agregados['ventas_por_tienda']
+        tiendas_por_zona = agregados['tiendas_por_zona']
 
         # 1. KPIs: Mejor y peor tienda por zona
         viz_title("KPIs por Zona - Mejor y Peor Tienda")
         
         try:
-            # Calcular ventas por tienda y zona
-            ventas_tienda_zona = df_ventas.groupby(['Zona geográfica', 'NombreTPV']).agg({
-                'Cantidad': 'sum',
-                'Ventas Dinero': 'sum'
-            }).reset_index()
+            # Ventas por tienda y zona
+            ventas_tienda_zona = agregados['ventas_tienda_zona'].copy(deep=False)
             
             # Asegurar que las columnas numéricas son del tipo correcto
             ventas_tienda_zona['Cantidad'] = pd.to_numeric(ventas_tienda_zona['Cantidad'], errors='coerce').fillna(0)
@@ -1817,31 +806,10 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 ventas_tienda_zona.loc[mask, 'Media_Zona'] * 100
             ).round(1)
             
-            # Encontrar mejor y peor tienda por zona con manejo de errores
-            mejores_tiendas = []
-            peores_tiendas = []
-            
-            for zona in ventas_tienda_zona['Zona geográfica'].unique():
-                zona_data = ventas_tienda_zona[ventas_tienda_zona['Zona geográfica'] == zona].copy()
-                if not zona_data.empty and len(zona_data) > 0:
-                    # Encontrar mejor tienda (máxima cantidad)
-                    try:
-                        mejor_idx = zona_data['Cantidad'].idxmax()
-                        if pd.notna(mejor_idx) and mejor_idx in zona_data.index:
-                            mejores_tiendas.append(zona_data.loc[mejor_idx].to_dict())
-                    except:
-                        pass
-                    
-                    # Encontrar peor tienda (mínima cantidad)
-                    try:
-                        peor_idx = zona_data['Cantidad'].idxmin()
-                        if pd.notna(peor_idx) and peor_idx in zona_data.index:
-                            peores_tiendas.append(zona_data.loc[peor_idx].to_dict())
-                    except:
-                        pass
-            
-            mejores_tiendas = pd.DataFrame(mejores_tiendas) if mejores_tiendas else pd.DataFrame()
-            peores_tiendas = pd.DataFrame(peores_tiendas) if peores_tiendas else pd.DataFrame()
+            # Mejor y peor tienda (máxima y mínima cantidad) de cada zona
+            mejores_tiendas, peores_tiendas = precalculo.ranking(
+                version_filtrada, 'tienda por zona', ventas_tienda_zona, 'Cantidad', por='Zona geográfica'
+            )
             
             # Mostrar KPIs en formato de tarjetas
             zonas = sorted([str(z) for z in df_ventas['Zona geográfica'].unique() if pd.notna(z)])
@@ -1926,7 +894,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
 
         # 3. Row: Evolución mensual por zona
         viz_title("Evolución Mensual por Zona")
-        zona_mes_evol = df_ventas.groupby(['Mes', 'Zona geográfica'])['Cantidad'].sum().reset_index()
+        zona_mes_evol = agregados['zona_mes_evol']
         fig = px.line(zona_mes_evol, 
                      x='Mes', 
                      y='Cantidad',
@@ -1949,83 +917,10 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
         with col3:
             viz_title("Mapa de Ventas - España")
             
-            # Separar datos por país
-            df_espana = df_ventas[~df_ventas['NombreTPV'].isin(TIENDAS_EXTRANJERAS)].copy()
-            
-            # Procesar datos de España usando Zona geográfica
-            mapeo_zona_ciudad = {
-                'Zona Madrid': 'MADRID',
-                'Zona Andalucía': 'SEVILLA',
-                'Zona Valencia': 'VALENCIA',
-                'Zona Galicia': 'VIGO',
-                'Zona Murcia': 'MURCIA',
-                'Zona Castilla y León': 'SALAMANCA',
-                'Zona País Vasco': 'BILBAO',
-                'Zona Aragón': 'ZARAGOZA',
-                'Zona Asturias': 'GIJON',
-                'Zona Castilla-La Mancha': 'ALBACETE',
-                'Zona Cataluña': 'BARCELONA',
-                'Zona Cantabria': 'SANTANDER',
-                'Zona Navarra': 'PAMPLONA',
-                'Zona La Rioja': 'LOGROÑO',
-                'Zona Extremadura': 'BADAJOZ',
-                'Zona Canarias': 'LAS PALMAS',
-                'Zona Baleares': 'PALMA'
-            }
-            
-            # Asignar ciudad basada en zona geográfica
-            df_espana['Ciudad'] = df_espana['Zona geográfica'].map(mapeo_zona_ciudad)
-            
-            # Para tiendas sin zona geográfica, intentar extraer del nombre
-            df_espana['Ciudad'] = df_espana['Ciudad'].fillna(
-                df_espana['NombreTPV'].str.extract(r'ET\d{1,2}-([\w\s\.\(\)]+)')[0]
-                .str.upper()
-                .str.replace(r'ECITRUCCO|ECI|XANADU|TRUCCO|CORT.*|\(.*\)', '', regex=True)
-                .str.strip()
+            # Ciudad y coordenadas de la dimensión de tienda, cruzada con los totales por tienda
+            ventas_ciudad_espana, n_tiendas_espana = ventas_por_ciudad(
+                agregados['ventas_tienda'], df_dim_tienda, PAIS_ESPANA
             )
-
-            coordenadas_espana = {
-                'MADRID': (40.4168, -3.7038),
-                'SEVILLA': (37.3886, -5.9823),
-                'MALAGA': (36.7213, -4.4214),
-                'VALENCIA': (39.4699, -0.3763),
-                'VIGO': (42.2406, -8.7207),
-                'MURCIA': (37.9834, -1.1299),
-                'SALAMANCA': (40.9701, -5.6635),
-                'CORDOBA': (37.8882, -4.7794),
-                'BILBAO': (43.2630, -2.9350),
-                'ZARAGOZA': (41.6488, -0.8891),
-                'JAEN': (37.7796, -3.7849),
-                'GIJON': (43.5453, -5.6615),
-                'ALBACETE': (38.9943, -1.8585),
-                'GRANADA': (37.1773, -3.5986),
-                'CARTAGENA': (37.6051, -0.9862),
-                'TARRAGONA': (41.1189, 1.2445),
-                'LEON': (42.5987, -5.5671),
-                'SANTANDER': (43.4623, -3.8099),
-                'PAMPLONA': (42.8125, -1.6458),
-                'VITORIA': (42.8467, -2.6727),
-                'CASTELLON': (39.9864, -0.0513),
-                'CADIZ': (36.5271, -6.2886),
-                'JEREZ': (36.6850, -6.1261),
-                'AVILES': (43.5560, -5.9222),
-                'BADAJOZ': (38.8794, -6.9707),
-                'BARCELONA': (41.3851, 2.1734),
-                'LOGROÑO': (42.4627, -2.4449),
-                'LAS PALMAS': (28.1235, -15.4366),
-                'PALMA': (39.5696, 2.6502)
-            }
-
-            # Procesar datos para España
-            df_espana['lat'] = df_espana['Ciudad'].map(lambda c: coordenadas_espana.get(c, (None, None))[0])
-            df_espana['lon'] = df_espana['Ciudad'].map(lambda c: coordenadas_espana.get(c, (None, None))[1])
-            df_espana = df_espana.dropna(subset=['lat', 'lon'])
-
-            # Agrupar por ciudad incluyendo tanto cantidad como ventas en euros
-            ventas_ciudad_espana = df_espana.groupby(['Ciudad', 'lat', 'lon']).agg({
-                'Cantidad': 'sum',
-                'Ventas Dinero': 'sum'
-            }).reset_index()
             
             # --- FIX: asegurar que 'Cantidad' no tenga valores negativos ni NaN para el mapa ---
             ventas_ciudad_espana['Cantidad'] = pd.to_numeric(ventas_ciudad_espana['Cantidad'], errors='coerce').fillna(0)
@@ -2071,7 +966,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 )
                 
                 # Mostrar información de debug
-                st.write(f"**Tiendas españolas:** {len(df_espana['NombreTPV'].unique())}")
+                st.write(f"**Tiendas españolas:** {n_tiendas_espana}")
                 st.write(f"**Ciudades mapeadas:** {len(ventas_ciudad_espana)}")
             else:
                 st.info("No hay datos disponibles para España.")
@@ -2082,42 +977,10 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
         with col5:
             viz_title("Mapa de Ventas - Italia")
             
-            # Separar datos por país
-            df_italia = df_ventas[df_ventas['NombreTPV'].isin(TIENDAS_EXTRANJERAS)].copy()
-            
-            # Procesar datos de Italia
-            df_italia['Ciudad'] = df_italia['NombreTPV'].str.extract(r'I\d{3}COIN([A-Z]+)')[0]
-            df_italia['Ciudad'] = df_italia['Ciudad'].fillna('MILANO')
-
-            coordenadas_italia = {
-                'BERGAMO': (45.6983, 9.6773),
-                'VARESE': (45.8206, 8.8256),
-                'BARICASAMASSIMA': (40.9634, 16.7514),
-                'MILANO5GIORNATE': (45.4642, 9.1900),
-                'ROMACINECITTA': (41.9028, 12.4964),
-                'GENOVA': (44.4056, 8.9463),
-                'SASSARI': (40.7259, 8.5557),
-                'CATANIA': (37.5079, 15.0830),
-                'CAGLIARI': (39.2238, 9.1217),
-                'LECCE': (40.3519, 18.1720),
-                'MILANOCANTORE': (45.4642, 9.1900),
-                'MESTRE': (45.4903, 12.2424),
-                'PADOVA': (45.4064, 11.8768),
-                'FIRENZE': (43.7696, 11.2558),
-                'ROMASANGIOVANNI': (41.9028, 12.4964),
-                'MILANO': (45.4642, 9.1900)
-            }
-
-            # Procesar datos para Italia
-            df_italia['lat'] = df_italia['Ciudad'].map(lambda c: coordenadas_italia.get(c, (None, None))[0])
-            df_italia['lon'] = df_italia['Ciudad'].map(lambda c: coordenadas_italia.get(c, (None, None))[1])
-            df_italia = df_italia.dropna(subset=['lat', 'lon'])
-
-            # Agrupar por ciudad incluyendo tanto cantidad como ventas en euros
-            ventas_ciudad_italia = df_italia.groupby(['Ciudad', 'lat', 'lon']).agg({
-                'Cantidad': 'sum',
-                'Ventas Dinero': 'sum'
-            }).reset_index()
+            # Ciudad y coordenadas de la dimensión de tienda, cruzada con los totales por tienda
+            ventas_ciudad_italia, n_tiendas_italia = ventas_por_ciudad(
+                agregados['ventas_tienda'], df_dim_tienda, PAIS_ITALIA
+            )
             
             # --- FIX: asegurar que 'Cantidad' no tenga valores negativos ni NaN para el mapa de Italia ---
             ventas_ciudad_italia['Cantidad'] = pd.to_numeric(ventas_ciudad_italia['Cantidad'], errors='coerce').fillna(0)
@@ -2163,129 +1026,36 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 )
                 
                 # Mostrar información de debug
-                st.write(f"**Tiendas italianas:** {len(df_italia['NombreTPV'].unique())}")
+                st.write(f"**Tiendas italianas:** {n_tiendas_italia}")
                 st.write(f"**Ciudades mapeadas:** {len(ventas_ciudad_italia)}")
             else:
                 st.info("No hay datos disponibles para Italia.")
 
 
     elif seccion == "Producto, Campaña, Devoluciones y Rentabilidad":
-        devoluciones = df_ventas[df_ventas['Cantidad'] < 0].copy()
-        ventas = df_ventas[df_ventas['Cantidad'] > 0].copy()
-
-        # Calcular descuento real basado en la diferencia entre PVP y precio real de venta
-        if all(col in df_ventas.columns for col in ['P.V.P.', 'Subtotal', 'Cantidad']):
-            df_ventas['Precio Real Unitario'] = df_ventas['Subtotal'] / df_ventas['Cantidad']
-            df_ventas['Descuento Real %'] = ((df_ventas['P.V.P.'] - df_ventas['Precio Real Unitario']) / df_ventas['P.V.P.'] * 100).fillna(0)
-            df_ventas['Descuento Real %'] = df_ventas['Descuento Real %'].clip(0, 100)  # Limitar entre 0 y 100%
+        devoluciones = df_ventas[df_ventas['Cantidad'] < 0]
+        ventas = df_ventas[df_ventas['Cantidad'] > 0]
 
         # ===== KPIs =====
         st.markdown("### 📊 **KPIs de Devoluciones, Rebajas y Margen**")
         
-        # Calculate KPIs
-        # Tienda con más devoluciones y ratio
-        tienda_mas_devoluciones = "Sin datos"
-        ratio_devolucion_valor = 0
-        if not devoluciones.empty:
-            devoluciones_por_tienda = devoluciones.groupby('NombreTPV').agg({'Cantidad': 'sum'}).reset_index()
-            devoluciones_por_tienda['Cantidad'] = abs(devoluciones_por_tienda['Cantidad'])
-            devoluciones_por_tienda = devoluciones_por_tienda.sort_values('Cantidad', ascending=False)
-            
-            # Calcular ratio de devolución por tienda
-            ventas_por_tienda = ventas.groupby('NombreTPV')['Cantidad'].sum().reset_index()
-            ratio_devolucion = ventas_por_tienda.merge(devoluciones_por_tienda, on='NombreTPV', how='left')
-            ratio_devolucion['Cantidad_y'] = ratio_devolucion['Cantidad_y'].fillna(0)
-            ratio_devolucion['Ratio Devolución %'] = (ratio_devolucion['Cantidad_y'] / ratio_devolucion['Cantidad_x'] * 100).round(2)
-            
-            top_tienda_devolucion = ratio_devolucion.loc[ratio_devolucion['Cantidad_y'].idxmax()]
-            tienda_mas_devoluciones = top_tienda_devolucion['NombreTPV']
-            ratio_devolucion_valor = top_tienda_devolucion['Ratio Devolución %']
-        
-        # Talla más devuelta
-        talla_mas_devuelta = "Sin datos"
-        talla_devuelta_unidades = 0
-        if not devoluciones.empty and 'Talla' in devoluciones.columns:
-            talla_mas_devuelta_data = devoluciones.groupby('Talla')['Cantidad'].sum().abs().sort_values(ascending=False).head(1)
-            if not talla_mas_devuelta_data.empty:
-                talla_mas_devuelta = talla_mas_devuelta_data.index[0]
-                talla_devuelta_unidades = talla_mas_devuelta_data.iloc[0]
-        
-        # Familia más devuelta (excluyendo GR.ART.FICTICIO)
-        familia_mas_devuelta = "Sin datos"
-        familia_devuelta_unidades = 0
-        familia_ficticio_unidades = 0
-        if not devoluciones.empty:
-            # Excluir 'GR.ART.FICTICIO' para el ranking principal
-            devoluciones_sin_ficticio = devoluciones[devoluciones['Familia'] != 'GR.ART.FICTICIO']
-            familia_mas_devuelta_data = devoluciones_sin_ficticio.groupby('Familia')['Cantidad'].sum().abs().sort_values(ascending=False).head(1)
-            if not familia_mas_devuelta_data.empty:
-                familia_mas_devuelta = familia_mas_devuelta_data.index[0]
-                familia_devuelta_unidades = familia_mas_devuelta_data.iloc[0]
-            # Calcular valor para 'GR.ART.FICTICIO' si existe
-            ficticio_data = devoluciones[devoluciones['Familia'] == 'GR.ART.FICTICIO'].groupby('Familia')['Cantidad'].sum().abs()
-            if not ficticio_data.empty:
-                familia_ficticio_unidades = ficticio_data.iloc[0]
-        
-        # Rebajas 1ª (Enero y Junio)
-        ventas_rebajas_1 = 0
-        porcentaje_rebajas_1 = 0
-        if 'Fecha Documento' in df_ventas.columns:
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['Fecha Documento'] = pd.to_datetime(df_ventas_temp['Fecha Documento'], errors='coerce')
-            df_ventas_temp['mes'] = df_ventas_temp['Fecha Documento'].dt.month
-            df_ventas_temp = df_ventas_temp[df_ventas_temp['Subtotal'] > 0]
-            rebajas_1 = df_ventas_temp[df_ventas_temp['mes'].isin([1, 6])]
-            
-            if 'precio_pvp' in rebajas_1.columns:
-                rebajas_1['Precio_venta'] = rebajas_1['Subtotal'] / rebajas_1['Cantidad']
-                rebajas_1_real = rebajas_1[rebajas_1['Precio_venta'] < rebajas_1['precio_pvp']]
-                ventas_rebajas_1 = rebajas_1_real['Subtotal'].sum()
-            else:
-                ventas_rebajas_1 = rebajas_1['Subtotal'].sum()
-            
-            if df_ventas_temp['Subtotal'].sum() > 0:
-                porcentaje_rebajas_1 = (ventas_rebajas_1 / df_ventas_temp['Subtotal'].sum() * 100)
-        
-        # Rebajas 2ª (Febrero y Julio)
-        ventas_rebajas_2 = 0
-        porcentaje_rebajas_2 = 0
-        if 'Fecha Documento' in df_ventas.columns:
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['Fecha Documento'] = pd.to_datetime(df_ventas_temp['Fecha Documento'], errors='coerce')
-            df_ventas_temp['mes'] = df_ventas_temp['Fecha Documento'].dt.month
-            df_ventas_temp = df_ventas_temp[df_ventas_temp['Subtotal'] > 0]
-            rebajas_2 = df_ventas_temp[df_ventas_temp['mes'].isin([2, 7])]
-            
-            if 'precio_pvp' in rebajas_2.columns:
-                rebajas_2['Precio_venta'] = rebajas_2['Subtotal'] / rebajas_2['Cantidad']
-                rebajas_2_real = rebajas_2[rebajas_2['Precio_venta'] < rebajas_2['precio_pvp']]
-                ventas_rebajas_2 = rebajas_2_real['Subtotal'].sum()
-            else:
-                ventas_rebajas_2 = rebajas_2['Subtotal'].sum()
-            
-            if df_ventas_temp['Subtotal'].sum() > 0:
-                porcentaje_rebajas_2 = (ventas_rebajas_2 / df_ventas_temp['Subtotal'].sum() * 100)
-        
-        # Margen bruto por unidad (promedio)
-        margen_unitario_promedio = 0
-        margen_unitario_promedio_positivo = 0
-        if all(col in df_ventas.columns for col in ['P.V.P.', 'Precio Coste']):
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['margen_unitario'] = df_ventas_temp['P.V.P.'] - df_ventas_temp['Precio Coste']
-            margen_unitario_promedio = df_ventas_temp['margen_unitario'].mean()
-            margen_unitario_promedio_positivo = df_ventas_temp[df_ventas_temp['margen_unitario'] > 0]['margen_unitario'].mean()
-        
-        # Margen porcentual (promedio)
-        margen_porcentual_promedio = 0
-        margen_porcentual_promedio_positivo = 0
-        if all(col in df_ventas.columns for col in ['P.V.P.', 'Precio Coste']):
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['margen_unitario'] = df_ventas_temp['P.V.P.'] - df_ventas_temp['Precio Coste']
-            df_ventas_temp['margen_%'] = df_ventas_temp['margen_unitario'] / df_ventas_temp['P.V.P.']
-            # Ignorar productos con P.V.P. = 0 para el promedio real
-            df_ventas_temp_validos = df_ventas_temp[df_ventas_temp['P.V.P.'] != 0]
-            margen_porcentual_promedio = df_ventas_temp_validos['margen_%'].mean() * 100
-            margen_porcentual_promedio_positivo = df_ventas_temp_validos[df_ventas_temp_validos['margen_%'] > 0]['margen_%'].mean() * 100
+        # KPIs de devoluciones, rebajas y margen (calculos.agregados_producto)
+        kpis = agregados['kpis']
+        tienda_mas_devoluciones = kpis['tienda_mas_devoluciones']
+        ratio_devolucion_valor = kpis['ratio_devolucion_valor']
+        talla_mas_devuelta = kpis['talla_mas_devuelta']
+        talla_devuelta_unidades = kpis['talla_devuelta_unidades']
+        familia_mas_devuelta = kpis['familia_mas_devuelta']
+        familia_devuelta_unidades = kpis['familia_devuelta_unidades']
+        familia_ficticio_unidades = kpis['familia_ficticio_unidades']
+        ventas_rebajas_1 = kpis['ventas_rebajas_1']
+        porcentaje_rebajas_1 = kpis['porcentaje_rebajas_1']
+        ventas_rebajas_2 = kpis['ventas_rebajas_2']
+        porcentaje_rebajas_2 = kpis['porcentaje_rebajas_2']
+        margen_unitario_promedio = kpis['margen_unitario_promedio']
+        margen_unitario_promedio_positivo = kpis['margen_unitario_promedio_positivo']
+        margen_porcentual_promedio = kpis['margen_porcentual_promedio']
+        margen_porcentual_promedio_positivo = kpis['margen_porcentual_promedio_positivo']
         
         # KPIs in HTML style like Resumen General
         st.markdown("""
@@ -2367,9 +1137,7 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
 
         # Tabla de depuración: productos con margen negativo
         if all(col in df_ventas.columns for col in ['P.V.P.', 'Precio Coste']):
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['margen_unitario'] = df_ventas_temp['P.V.P.'] - df_ventas_temp['Precio Coste']
-            productos_margen_negativo = df_ventas_temp[df_ventas_temp['margen_unitario'] < 0]
+            productos_margen_negativo = agregados['productos_margen_negativo']
             if not productos_margen_negativo.empty:
                 st.markdown('### Tabla de depuración: Productos con margen negativo (PVP < Precio Coste)')
                 st.dataframe(productos_margen_negativo[['ACT', 'Descripción Familia', 'Temporada', 'Fecha Documento', 'P.V.P.', 'Precio Coste', 'margen_unitario']], use_container_width=True, hide_index=True)
@@ -2382,12 +1150,8 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
         
         if not devoluciones.empty:
             # Preparar datos para comparación
-            ventas_por_familia = ventas.groupby('Familia')['Cantidad'].sum().reset_index()
-            ventas_por_familia['Tipo'] = 'Ventas'
-            
-            devoluciones_por_familia = devoluciones.groupby('Familia')['Cantidad'].sum().reset_index()
-            devoluciones_por_familia['Cantidad'] = abs(devoluciones_por_familia['Cantidad'])
-            devoluciones_por_familia['Tipo'] = 'Devoluciones'
+            ventas_por_familia = agregados['ventas_por_familia'].assign(Tipo='Ventas')
+            devoluciones_por_familia = agregados['devoluciones_por_familia'].assign(Tipo='Devoluciones')
             
             # Combinar datos
             comparacion_familias = pd.concat([ventas_por_familia, devoluciones_por_familia], ignore_index=True)
@@ -2423,8 +1187,9 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             
             with col_talla1:
                 # Talla más devuelta por familia
-                talla_mas_devuelta_familia = devoluciones.groupby(['Familia', 'Talla'])['Cantidad'].sum().abs().reset_index()
-                talla_mas_devuelta_familia = talla_mas_devuelta_familia.loc[talla_mas_devuelta_familia.groupby('Familia')['Cantidad'].idxmax()]
+                talla_mas_devuelta_familia, talla_menos_devuelta_familia = precalculo.ranking(
+                    version_filtrada, 'talla devuelta', agregados['devoluciones_familia_talla'], 'Cantidad', por='Familia'
+                )
                 
                 fig = px.bar(
                     talla_mas_devuelta_familia,
@@ -2445,9 +1210,6 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
             
             with col_talla2:
                 # Talla menos devuelta por familia
-                talla_menos_devuelta_familia = devoluciones.groupby(['Familia', 'Talla'])['Cantidad'].sum().abs().reset_index()
-                talla_menos_devuelta_familia = talla_menos_devuelta_familia.loc[talla_menos_devuelta_familia.groupby('Familia')['Cantidad'].idxmin()]
-                
                 fig = px.bar(
                     talla_menos_devuelta_familia,
                     x='Familia',
@@ -2471,48 +1233,8 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
         st.markdown("#### ** Análisis de Ventas por Temporada**")
         
         if 'Temporada' in df_ventas.columns:
-            # Función para determinar si un producto fue vendido fuera de su temporada
-            def vendido_fuera_temporada(row):
-                temporada = row['Temporada']
-                fecha = row['Fecha Documento']
-
-                # Si la temporada no está bien definida, marcamos como fuera de temporada
-                if not isinstance(temporada, str) or len(temporada) < 5:
-                    return 1
-
-                tipo_temporada = temporada[0]   # 'I' o 'V'
-                ano_temporada_str = temporada[1:]
-
-                # Validar que ano_temporada_str es numérico y tipo_temporada es válido
-                if tipo_temporada not in ['I', 'V'] or not ano_temporada_str.isdigit():
-                    return 1
-
-                ano_temporada = int(ano_temporada_str)
-
-                if tipo_temporada == 'I':  # Invierno: sept (año-1) a feb (año)
-                    inicio = pd.Timestamp(year=ano_temporada - 1, month=9, day=1)
-                    fin = pd.Timestamp(year=ano_temporada, month=2, day=28)  # ignoramos bisiestos
-                    if inicio <= fecha <= fin:
-                        return 0  # Vendido dentro de su temporada (Invierno)
-                    else:
-                        return 1  # Vendido fuera de temporada
-
-                elif tipo_temporada == 'V':  # Verano: marzo a agosto año
-                    inicio = pd.Timestamp(year=ano_temporada, month=3, day=1)
-                    fin = pd.Timestamp(year=ano_temporada, month=8, day=31)
-                    if inicio <= fecha <= fin:
-                        return 0  # Vendido dentro de su temporada (Verano)
-                    else:
-                        return 1  # Vendido fuera de temporada
-                else:
-                    return 1  # Temporada no reconocida
-
-            # Aplicar la función al DataFrame
-            df_ventas_temp = df_ventas.copy()
-            df_ventas_temp['vendido_fuera_temporada'] = df_ventas_temp.apply(vendido_fuera_temporada, axis=1)
-            
-            # Agrupar por temporada y tipo de venta
-            analisis_temporada = df_ventas_temp.groupby(['Temporada', 'vendido_fuera_temporada'])['Cantidad'].sum().reset_index()
+            # Ventas por temporada y tipo de venta (calculos.vendido_fuera_temporada)
+            analisis_temporada = agregados['analisis_temporada'].copy(deep=False)
             analisis_temporada['Tipo_Venta'] = analisis_temporada['vendido_fuera_temporada'].map({
                 0: 'En Temporada',
                 1: 'Fuera de Temporada'
@@ -2545,7 +1267,8 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
                 index='Temporada',
                 columns='Tipo_Venta',
                 values='Cantidad',
-                fill_value=0
+                fill_value=0,
+                observed=True
             ).reset_index()
             # Asegurar que ambas columnas existen
             for col in ['En Temporada', 'Fuera de Temporada']:
@@ -2566,106 +1289,654 @@ def mostrar_dashboard(df_productos, df_traspasos, df_ventas, seccion):
         else:
             st.info("No hay datos de temporada disponibles para el análisis.")
 
-        # ===== TABLA DE PRODUCTOS CON BAJO MARGEN (al final) =====
+        panel_bajo_margen(df_ventas)
+
+
+# ===== Paneles con widgets propios =====
+# Cada panel es un fragmento de Streamlit con sus entradas explícitas: al cambiar
+# uno de sus widgets solo se vuelve a ejecutar ese panel, no todo mostrar_dashboard.
+
+@st.fragment
+def panel_tallas_familia(df_ventas, df_productos, df_dim_producto, df_traspasos_filtrado,
+                         cantidad_col_compra, tiendas_especificas, version_filtrada):
+    """Ventas por talla, entradas en almacén, pendientes y pedidos de la familia seleccionada"""
+    # Col 4: Unidades Vendidas por Talla (centered)
+    col4a, col4b, col4c = st.columns([1, 2, 1])
+
+    with col4b:
+        viz_title("Unidades Vendidas por Talla")
+
+        familias = sorted(df_ventas['Familia'].unique())
+        familia_seleccionada = st.selectbox("Selecciona una familia:", familias)
+
+        # Filtrar df_ventas por familia seleccionada
+        df_familia = df_ventas[df_ventas['Familia'] == familia_seleccionada]
+
+        if df_familia.empty:
+            st.warning("No hay datos de ventas para la familia seleccionada.")
+        else:
+            # Agrupamos por Talla y Temporada
+            tallas_sumadas = (
+                df_familia.groupby(['Talla', 'Temporada'], observed=True)['Cantidad']
+                .sum()
+                .reset_index()
+            )
+
+            # Talla es una categórica ordenada por talla: sus categorías presentes ya vienen en orden
+            tallas_orden = df_familia['Talla'].cat.remove_unused_categories().cat.categories.tolist()
+
+            # Gráfico de barras apiladas por Temporada
+            temporada_colors = get_temporada_colors(df_ventas, version=version_filtrada)
+            fig = px.bar(
+                tallas_sumadas,
+                x='Talla',
+                y='Cantidad',
+                color='Temporada',
+                text='Cantidad',
+                category_orders={'Talla': tallas_orden},
+                color_discrete_map=temporada_colors,
+                height=450
+            )
+
+            fig.update_layout(
+                xaxis_title="Talla",
+                yaxis_title="Unidades Vendidas",
+                barmode="stack",
+                margin=dict(t=30, b=0, l=0, r=0),
+                paper_bgcolor="rgba(0,0,0,0)",
+                plot_bgcolor="rgba(0,0,0,0)"
+            )
+
+            fig.update_traces(texttemplate='%{text:.0f}', textposition='inside', opacity=0.9)
+            st.plotly_chart(fig, use_container_width=True)
+
+
+
+    # Col 5,6: Tablas por Temporada con layout dinámico
+    # Preparar datos de entrada en almacén para las tablas por temporada
+    # Agregar Descripción Familia a df_productos usando ACT codes de df_ventas
+    # ACT_14 (primeros 14 caracteres) viene codificado desde la ingesta
+    df_productos_temp = df_productos.copy(deep=False)
+
+    # Crear mapeo de ACT a Descripción Familia desde la dimensión de producto,
+    # limitado a los ACT vendidos con los filtros actuales (códigos del diccionario)
+    vendidos = np.unique(df_ventas['ACT'].cat.codes)
+    productos_vendidos = df_dim_producto.iloc[vendidos[vendidos >= 0]]
+    act_to_familia = dict(zip(productos_vendidos['ACT'].astype(str), productos_vendidos['Descripción Familia']))
+
+    # Agregar Descripción Familia a df_productos usando ACT_14
+    df_productos_temp['Descripción Familia'] = df_productos_temp['ACT_14'].map(act_to_familia)
+
+    # Filtrar por la familia seleccionada
+    df_almacen_fam = df_productos_temp[
+        df_productos_temp['Descripción Familia'] == familia_seleccionada
+    ].copy()
+
+    # Identificar productos sin familia asignada
+    df_sin_familia = df_productos_temp[
+        df_productos_temp['Descripción Familia'].isna()
+    ].copy()
+
+    # Inicializar df_pendientes como DataFrame vacío
+    df_pendientes = pd.DataFrame()
+
+
+
+    if not df_almacen_fam.empty and 'Fecha REAL entrada en almacén' in df_almacen_fam.columns:
+        # La fecha de entrada en almacén ya llega como datetime desde la ingesta
+        # Separar filas con fecha válida y sin fecha
+        df_almacen_fam_con_fecha = df_almacen_fam.dropna(subset=['Fecha REAL entrada en almacén'])
+        df_almacen_fam_sin_fecha = df_almacen_fam[df_almacen_fam['Fecha REAL entrada en almacén'].isna()].copy()
+
+        # Agregar mes de entrada para filas con fecha válida
+        df_almacen_fam_con_fecha['Mes Entrada'] = df_almacen_fam_con_fecha['Fecha REAL entrada en almacén'].dt.to_period('M').astype(str)
+
+        # Separar filas pendientes de entrega (sin fecha válida)
+        if not df_almacen_fam_sin_fecha.empty:
+            # Crear DataFrame separado para pendientes de entrega
+            df_pendientes = df_almacen_fam_sin_fecha.copy()
+            df_pendientes['Estado'] = 'Pendiente de entrega'
+        else:
+            df_pendientes = pd.DataFrame()
+
+        # Usar solo las filas con fecha válida para el análisis de almacén
+        df_almacen_fam = df_almacen_fam_con_fecha
+
+        # Obtener el último mes de df_ventas para filtrar los datos
+        ultimo_mes_ventas = df_ventas['Mes'].max()
+
+        # Preparar datos para la tabla por Temporada
+        cantidad_col = cantidad_col_compra
+        if cantidad_col is None:
+            st.error("No se encontró una columna de cantidad válida")
+            cantidad_col = 'Cantidad'  # Fallback
+
+
+
+        datos_tabla = (
+            df_almacen_fam.groupby(['Mes Entrada', 'Talla'], observed=True)[cantidad_col]
+            .sum()
+            .reset_index()
+            .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
+            .sort_values(['Mes Entrada', 'Talla'])
+        )
+
+        # Filtrar datos hasta el último mes de ventas
+        datos_tabla = datos_tabla[datos_tabla['Mes Entrada'] <= ultimo_mes_ventas]
+
+        if not datos_tabla.empty:
+            # Tema_6 (primeros 6 caracteres) viene codificado desde la ingesta.
+            # Enviado vs ventas y entradas por mes de todos los temas en una pasada
+            # (calculos.comparacion_temas), cacheada por dataset filtrado y familia
+            version_temas = (version_filtrada, familia_seleccionada, cantidad_col) if version_filtrada is not None else None
+            resultado_temas = comparar_temas(df_almacen_fam, df_ventas, cantidad_col, version=version_temas)
+            temas = list(resultado_temas)
+            num_temas = len(temas)
+
+            if num_temas > 0:
+                # --- Sección: Entradas almacén y traspasos ---
+                st.markdown('<hr style="margin: 1em 0; border-top: 2px solid #bbb;">', unsafe_allow_html=True)
+                st.markdown('<h4 style="color:#333;font-weight:bold;">Entradas almacén y traspasos</h4>', unsafe_allow_html=True)
+
+                # Si se han seleccionado tiendas específicas, mostrar tabla de análisis temporal
+                if tiendas_especificas:
+                    st.subheader("Análisis Temporal: Entrada Almacén → Envío → Primera Venta")
+                    # Primera venta de cada entrada/envío por join as-of (calculos.linea_temporal_almacen)
+                    df_timeline = linea_temporal_almacen(df_almacen_fam, df_traspasos_filtrado, df_ventas)
+
+                    if not df_timeline.empty:
+                        st.dataframe(
+                            df_timeline,
+                            use_container_width=True,
+                            hide_index=True
+                        )
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            avg_dias_envio = pd.to_numeric(df_timeline['Días Entrada-Envío'], errors='coerce').mean()
+                            st.metric("Promedio días Entrada→Envío", f"{avg_dias_envio:.1f} días")
+                        with col2:
+                            avg_dias_venta = pd.to_numeric(df_timeline['Días Entrada-Primera Venta'].replace('Sin ventas', pd.NA), errors='coerce').mean()
+                            st.metric("Promedio días Entrada→Primera Venta", f"{avg_dias_venta:.1f} días" if not pd.isna(avg_dias_venta) else "N/A")
+                        with col3:
+                            total_productos = len(df_timeline)
+                            st.metric("Total productos analizados", f"{total_productos}")
+                    else:
+                        st.info("No se encontraron datos de envíos para los productos de entrada en almacén de la familia seleccionada.")
+                else:
+                    if num_temas == 1:
+                        # Un tema: centrado
+                        col5a, col5b, col5c = st.columns([1, 2, 1])
+                        columnas = [(col5b, temas, (10, 6))]
+                    else:
+                        col5, col6 = st.columns(2)
+                        mitad = (num_temas + 1) // 2
+                        columnas = [(col5, temas[:mitad], (8, 5)), (col6, temas[mitad:], (8, 5))]
+                    for columna, temas_columna, figsize in columnas:
+                        with columna:
+                            for tema in temas_columna:
+                                mostrar_tema_almacen(tema, resultado_temas[tema], cantidad_col, figsize)
+        else:
+            st.info("No hay datos de entrada en almacén disponibles para la familia seleccionada.")
+
+    # --- Tabla de Pendientes de Entrega ---
+    if not df_pendientes.empty:
         st.markdown("---")
-        st.markdown("### **Productos con Bajo Margen**")
-        
-        # Buscar columnas que podrían ser Precio Coste
-        columnas_disponibles = df_ventas.columns.tolist()
-        coste_col = None
-        
-        # Buscar Precio Coste
-        for col in ['precio_cost', 'precio_coste', 'Precio Coste', 'Precio Costo', 'Coste', 'Costo', 'coste', 'costo']:
-            if col in columnas_disponibles:
-                coste_col = col
-                break
-        
-        if coste_col and 'Subtotal' in df_ventas.columns and 'Cantidad' in df_ventas.columns:
-            # Slider para ajustar el umbral de margen
-            umbral_margen = st.slider(
-                "Umbral de margen % (productos por debajo de este valor):",
-                min_value=0.0,
-                max_value=1.0,
-                value=0.36,
-                step=0.01,
-                format="%.2f"
+        viz_title("Pendientes de Entrega")
+
+        cantidad_col_pendientes = cantidad_col_compra
+        if cantidad_col_pendientes is None:
+            st.error("No se encontró una columna de cantidad válida")
+            cantidad_col_pendientes = 'Cantidad'  # Fallback
+
+        # Preparar datos de pendientes por talla
+        datos_pendientes = (
+            df_pendientes.groupby(['Talla'], observed=True)[cantidad_col_pendientes]
+            .sum()
+            .reset_index()
+            .rename(columns={cantidad_col_pendientes: 'Cantidad Pendiente'})
+            .sort_values('Talla')
+        )
+
+        if not datos_pendientes.empty:
+            # Mostrar tabla de pendientes
+            st.dataframe(
+                datos_pendientes.style.format({
+                    'Cantidad Pendiente': '{:,.0f}'
+                }),
+                use_container_width=True,
+                hide_index=True
             )
-            
-            # Calcular márgenes usando Ventas Dinero (Subtotal) como precio de venta
-            # Excluir devoluciones (Cantidad < 0)
-            df_ventas_temp = df_ventas[df_ventas['Cantidad'] > 0].copy()
-            df_ventas_temp['Precio_venta'] = df_ventas_temp['Subtotal'] / df_ventas_temp['Cantidad']
-            df_ventas_temp['margen_unitario'] = df_ventas_temp['Precio_venta'] - df_ventas_temp[coste_col]
-            df_ventas_temp['margen_%'] = df_ventas_temp['margen_unitario'] / df_ventas_temp['Precio_venta']
-            
-            # Filtrar productos con margen bajo (incluyendo márgenes negativos)
-            productos_bajo_margen = df_ventas_temp[df_ventas_temp['margen_%'] < umbral_margen].copy()
-            
-            if not productos_bajo_margen.empty:
-                # Preparar tabla con las columnas solicitadas
-                tabla_bajo_margen = productos_bajo_margen[[
-                    'ACT', 'Descripción Familia', 'Temporada', 'Fecha Documento', 
-                    'Precio_venta', coste_col, 'margen_%'
-                ]].copy()
-                
-                # Formatear columnas
-                tabla_bajo_margen['Fecha Documento'] = pd.to_datetime(tabla_bajo_margen['Fecha Documento']).dt.strftime('%d/%m/%Y')
-                tabla_bajo_margen['Precio_venta'] = tabla_bajo_margen['Precio_venta'].round(2)
-                tabla_bajo_margen[coste_col] = tabla_bajo_margen[coste_col].round(2)
-                tabla_bajo_margen['margen_%'] = (tabla_bajo_margen['margen_%'] * 100).round(1)
-                
-                # Renombrar columnas para mejor visualización
-                tabla_bajo_margen.columns = [
-                    'ACT', 'Familia', 'Temporada', 'Fecha Venta', 
-                    'Precio Venta (€)', f'{coste_col} (€)', 'Margen %'
-                ]
-                
-                st.markdown(f"**Productos con margen inferior al {umbral_margen*100:.0f}% ({len(tabla_bajo_margen)} productos):**")
+
+            # Mostrar total
+            total_pendientes = datos_pendientes['Cantidad Pendiente'].sum()
+            st.write(f"**Total Pendientes de Entrega:** {total_pendientes:,.0f}")
+
+            # Mostrar información adicional
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Total productos pendientes", len(df_pendientes))
+            with col2:
+                st.metric("Tallas diferentes", len(datos_pendientes))
+            with col3:
+                st.metric("Promedio por talla", f"{total_pendientes/len(datos_pendientes):,.0f}")
+        else:
+            st.info("No hay datos de pendientes de entrega para mostrar.")
+    else:
+        pass
+
+    # --- Tabla de Productos Sin Familia Asignada ---
+    if not df_sin_familia.empty:
+        st.markdown("---")
+        viz_title("Productos Sin Familia Asignada")
+
+        cantidad_col_sin_familia = cantidad_col_compra
+        if cantidad_col_sin_familia is None:
+            st.error("No se encontró una columna de cantidad válida")
+            cantidad_col_sin_familia = 'Cantidad'  # Fallback
+
+        # Verificar si existe la columna 'Modelo Artículo'
+        if 'Modelo Artículo' in df_sin_familia.columns:
+            # Preparar datos de productos sin familia por Modelo Artículo
+            datos_sin_familia = (
+                df_sin_familia.groupby(['Modelo Artículo'])[cantidad_col_sin_familia]
+                .sum()
+                .reset_index()
+                .rename(columns={cantidad_col_sin_familia: 'Cantidad Total'})
+                .sort_values('Cantidad Total', ascending=False)
+            )
+
+            if not datos_sin_familia.empty:
+                # Mostrar tabla de productos sin familia
                 st.dataframe(
-                    tabla_bajo_margen,
+                    datos_sin_familia.style.format({
+                        'Cantidad Total': '{:,.0f}'
+                    }),
                     use_container_width=True,
                     hide_index=True
                 )
-                
-                # Estadísticas adicionales con manejo de errores
-                col_stats1, col_stats2, col_stats3 = st.columns(3)
-                with col_stats1:
-                    st.metric("Total productos", len(tabla_bajo_margen))
-                with col_stats2:
-                    margen_promedio_bajo = tabla_bajo_margen['Margen %'].mean()
-                    if pd.isna(margen_promedio_bajo) or margen_promedio_bajo == float('inf') or margen_promedio_bajo == float('-inf'):
-                        st.metric("Margen promedio", "N/A")
-                    else:
-                        st.metric("Margen promedio", f"{margen_promedio_bajo:.1f}%")
-                with col_stats3:
-                    # Calcular pérdida estimada de manera más robusta
-                    try:
-                        # Solo considerar productos con margen negativo o muy bajo
-                        productos_perdida = tabla_bajo_margen[tabla_bajo_margen['Margen %'] < 0].copy()
-                        if not productos_perdida.empty:
-                            # Usar los nombres de columnas originales para el cálculo
-                            coste_col_name = f'{coste_col} (€)'
-                            precio_venta_col = 'Precio Venta (€)'
-                            perdida_total = ((productos_perdida[coste_col_name] - productos_perdida[precio_venta_col]) * 
-                                           abs(productos_perdida['Margen %'] / 100)).sum()
-                            if pd.isna(perdida_total) or perdida_total == float('inf') or perdida_total == float('-inf'):
-                                st.metric("Pérdida estimada", "N/A")
-                            else:
-                                st.metric("Pérdida estimada", f"{perdida_total:.0f}€")
-                        else:
-                            st.metric("Pérdida estimada", "0€")
-                    except Exception as e:
-                        st.metric("Pérdida estimada", f"Error: {str(e)}")
+
+                # Mostrar total
+                total_sin_familia = datos_sin_familia['Cantidad Total'].sum()
+                st.write(f"**Total Productos Sin Familia:** {total_sin_familia:,.0f}")
+
+                # Mostrar información adicional
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total productos sin familia", len(df_sin_familia))
+                with col2:
+                    st.metric("Modelos diferentes", len(datos_sin_familia))
+                with col3:
+                    st.metric("Promedio por modelo", f"{total_sin_familia/len(datos_sin_familia):,.0f}")
+            else:
+                st.info("No hay datos de productos sin familia para mostrar.")
+        else:
+            st.warning("No se encontró la columna 'Modelo Artículo' en los datos de productos sin familia.")
+    else:
+        st.info("No hay productos sin familia asignada.")
+
+    # --- Tabla de Cantidad Pedida por Mes y Talla ---
+    # Solo mostrar esta tabla cuando NO se han seleccionado tiendas específicas
+    if not tiendas_especificas:
+        st.markdown("---")
+        viz_title("Cantidad Pedida por Mes y Talla")
+
+        if not df_almacen_fam.empty and 'Cantidad Pedida' in df_almacen_fam.columns:
+            # Preparar datos de cantidad pedida
+            datos_pedida = (
+                df_almacen_fam.groupby(['Mes Entrada', 'Talla'], observed=True)['Cantidad Pedida']
+                .sum()
+                .reset_index()
+                .rename(columns={'Mes Entrada': 'Mes', 'Cantidad Pedida': 'Cantidad Pedida'})
+                .sort_values(['Mes', 'Talla'])
+            )
+
+            # Filtrar datos hasta el último mes de ventas
+            datos_pedida = datos_pedida[datos_pedida['Mes'] <= ultimo_mes_ventas]
+
+            if not datos_pedida.empty:
+                # Crear tabla pivot para mejor visualización
+                tabla_pedida_pivot = datos_pedida.pivot_table(
+                    index='Mes',
+                    columns='Talla',
+                    values='Cantidad Pedida',
+                    fill_value=0,
+                    observed=True
+                ).round(0)
+
+                # Mostrar la tabla
+                st.dataframe(
+                    tabla_pedida_pivot.style.format("{:,.0f}"),
+                    use_container_width=True,
+                    hide_index=False
+                )
+
+                # Mostrar total
+                total_pedida = tabla_pedida_pivot.sum().sum()
+                st.write(f"**Total Cantidad Pedida:** {total_pedida:,.0f}")
+            else:
+                st.info("No hay datos de cantidad pedida para la familia seleccionada.")
+        else:
+            st.info("No hay datos de cantidad pedida disponibles para la familia seleccionada.")
+
+
+@st.fragment
+def panel_descripciones(df_ventas, df_dim_producto, version_filtrada):
+    """Top/bottom 10 de descripciones de producto de la familia seleccionada"""
+    # --- REVISED: Top/Bottom 10 Complete Descriptions by Family ---
+    st.markdown("---")
+    viz_title("Análisis de Descripciones por Familia")
+
+    desc_path = os.path.join('data', 'datos_descripciones.xlsx')
+    if os.path.exists(desc_path):
+        try:
+            # Índice de descripciones cacheado por ruta y fecha de modificación del fichero
+            version_desc = (desc_path, os.path.getmtime(desc_path))
+            indice_desc = descripciones_fichero(desc_path, version=version_desc)
+            col_filter1, col_filter2 = st.columns(2)
+            with col_filter1:
+                familias_disponibles = sorted(df_ventas['Familia'].dropna().unique())
+                familia_seleccionada = st.selectbox(
+                    "Selecciona una Familia:", 
+                    familias_disponibles, 
+                    key="familia_desc_selector"
+                )
+            with col_filter2:
+                tipo_descripcion = st.selectbox(
+                    "Selecciona Tipo de Descripción:", 
+                    TIPOS_DESCRIPCION, 
+                    key="tipo_desc_selector"
+                )
+            # Comprobar si existen las columnas necesarias
+            if tipo_descripcion in indice_desc:
+                # Ventas por familia y clave de descripción (ACT sin el último carácter), una vez
+                # por dataset filtrado; la tabla de cada familia y tipo también queda cacheada
+                ventas_desc = ventas_descripciones(df_ventas, df_dim_producto, version=version_filtrada)
+                version_familia = (
+                    (version_filtrada, version_desc, familia_seleccionada, tipo_descripcion)
+                    if version_filtrada is not None else None
+                )
+                desc_group_largas = descripciones_por_familia(
+                    ventas_desc, indice_desc[tipo_descripcion], familia_seleccionada, version=version_familia
+                )
+                # Top 10 más y menos vendidas entre las más largas
+                top10, bottom10 = precalculo.ranking(
+                    version_familia, 'descripciones', desc_group_largas, 'Ventas Dinero', k=10
+                )
+                altura_por_fila = 40
+                altura_minima = 400
+                altura_maxima = 800
+                altura_top = min(max(len(top10) * altura_por_fila, altura_minima), altura_maxima)
+                altura_bottom = min(max(len(bottom10) * altura_por_fila, altura_minima), altura_maxima)
+                viz_title(f'Top 10 en {tipo_descripcion} (descripciones más largas) - {familia_seleccionada}')
+                fig_top = px.bar(
+                    top10, 
+                    x='Ventas Dinero', 
+                    y='Descripción Analizada', 
+                    orientation='h', 
+                    color='Ventas Dinero', 
+                    color_continuous_scale=COLOR_GRADIENT,
+                    text='Cantidad'
+                )
+                fig_top.update_layout(
+                    showlegend=False, 
+                    height=altura_top,
+                    yaxis={'categoryorder':'total ascending', 'title': ''},
+                    margin=dict(t=30, b=0, l=0, r=0),
+                    paper_bgcolor="rgba(0,0,0,0)", 
+                    plot_bgcolor="rgba(0,0,0,0)"
+                )
+                fig_top.update_traces(
+                    texttemplate='%{text:,.0f} uds', 
+                    textposition='outside', 
+                    hovertemplate="Descripción: %{y}<br>Ventas: %{x:,.2f}€<br>Unidades: %{text:,.0f}<extra></extra>",
+                    opacity=0.8
+                )
+                st.plotly_chart(fig_top, use_container_width=True, key=f"top10_{tipo_descripcion}_{familia_seleccionada}")
+                viz_title(f'Bottom 10 en {tipo_descripcion} (descripciones más largas) - {familia_seleccionada}')
+                fig_bottom = px.bar(
+                    bottom10, 
+                    x='Ventas Dinero', 
+                    y='Descripción Analizada', 
+                    orientation='h', 
+                    color='Ventas Dinero', 
+                    color_continuous_scale=COLOR_GRADIENT,
+                    text='Cantidad'
+                )
+                fig_bottom.update_layout(
+                    showlegend=False, 
+                    height=altura_bottom,
+                    yaxis={'categoryorder':'total ascending', 'title': ''},
+                    margin=dict(t=30, b=0, l=0, r=0),
+                    paper_bgcolor="rgba(0,0,0,0)", 
+                    plot_bgcolor="rgba(0,0,0,0)"
+                )
+                fig_bottom.update_traces(
+                    texttemplate='%{text:,.0f} uds', 
+                    textposition='outside', 
+                    hovertemplate="Descripción: %{y}<br>Ventas: %{x:,.2f}€<br>Unidades: %{text:,.0f}<extra></extra>",
+                    opacity=0.8
+                )
+                st.plotly_chart(fig_bottom, use_container_width=True, key=f"bottom10_{tipo_descripcion}_{familia_seleccionada}")
             else:
-                st.info(f"No hay productos con margen inferior al {umbral_margen*100:.0f}%")
+                required_cols = ['ACT'] if tipo_descripcion == DESCRIPCION_COMPLETA else ['ACT', tipo_descripcion]
+                st.warning(f"Una o más columnas de descripción no se encontraron. Se necesitan: {required_cols}")
+        except Exception as e:
+            st.error(f"Error crítico al procesar las descripciones de productos: {e}")
+    else:
+        st.warning("Archivo `datos_descripciones.xlsx` no encontrado en la carpeta `data/`.")
+
+
+@st.fragment
+def panel_bajo_margen(df_ventas):
+    """Tabla de productos con margen por debajo del umbral elegido"""
+    # ===== TABLA DE PRODUCTOS CON BAJO MARGEN (al final) =====
+    st.markdown("---")
+    st.markdown("### **Productos con Bajo Margen**")
+
+    # Los alias de coste (precio_coste, Coste...) se renombran a 'Precio Coste' al ingerir
+    coste_col = 'Precio Coste' if 'Precio Coste' in df_ventas.columns else None
+
+    if coste_col and 'Subtotal' in df_ventas.columns and 'Cantidad' in df_ventas.columns:
+        # Slider para ajustar el umbral de margen
+        umbral_margen = st.slider(
+            "Umbral de margen % (productos por debajo de este valor):",
+            min_value=0.0,
+            max_value=1.0,
+            value=0.36,
+            step=0.01,
+            format="%.2f"
+        )
+
+        # Calcular márgenes usando Ventas Dinero (Subtotal) como precio de venta
+        # Excluir devoluciones (Cantidad < 0)
+        df_ventas_temp = df_ventas[df_ventas['Cantidad'] > 0]
+        df_ventas_temp['Precio_venta'] = df_ventas_temp['Subtotal'] / df_ventas_temp['Cantidad']
+        df_ventas_temp['margen_unitario'] = df_ventas_temp['Precio_venta'] - df_ventas_temp[coste_col]
+        df_ventas_temp['margen_%'] = df_ventas_temp['margen_unitario'] / df_ventas_temp['Precio_venta']
+
+        # Filtrar productos con margen bajo (incluyendo márgenes negativos)
+        productos_bajo_margen = df_ventas_temp[df_ventas_temp['margen_%'] < umbral_margen]
+
+        if not productos_bajo_margen.empty:
+            # Preparar tabla con las columnas solicitadas
+            tabla_bajo_margen = productos_bajo_margen[[
+                'ACT', 'Descripción Familia', 'Temporada', 'Fecha Documento', 
+                'Precio_venta', coste_col, 'margen_%'
+            ]].copy()
+
+            # Formatear columnas
+            tabla_bajo_margen['Fecha Documento'] = tabla_bajo_margen['Fecha Documento'].dt.strftime('%d/%m/%Y')
+            tabla_bajo_margen['Precio_venta'] = tabla_bajo_margen['Precio_venta'].round(2)
+            tabla_bajo_margen[coste_col] = tabla_bajo_margen[coste_col].round(2)
+            tabla_bajo_margen['margen_%'] = (tabla_bajo_margen['margen_%'] * 100).round(1)
+
+            # Renombrar columnas para mejor visualización
+            tabla_bajo_margen.columns = [
+                'ACT', 'Familia', 'Temporada', 'Fecha Venta', 
+                'Precio Venta (€)', f'{coste_col} (€)', 'Margen %'
+            ]
+
+            st.markdown(f"**Productos con margen inferior al {umbral_margen*100:.0f}% ({len(tabla_bajo_margen)} productos):**")
+            st.dataframe(
+                tabla_bajo_margen,
+                use_container_width=True,
+                hide_index=True
+            )
+
+            # Estadísticas adicionales con manejo de errores
+            col_stats1, col_stats2, col_stats3 = st.columns(3)
+            with col_stats1:
+                st.metric("Total productos", len(tabla_bajo_margen))
+            with col_stats2:
+                margen_promedio_bajo = tabla_bajo_margen['Margen %'].mean()
+                if pd.isna(margen_promedio_bajo) or margen_promedio_bajo == float('inf') or margen_promedio_bajo == float('-inf'):
+                    st.metric("Margen promedio", "N/A")
+                else:
+                    st.metric("Margen promedio", f"{margen_promedio_bajo:.1f}%")
+            with col_stats3:
+                # Calcular pérdida estimada de manera más robusta
+                try:
+                    # Solo considerar productos con margen negativo o muy bajo
+                    productos_perdida = tabla_bajo_margen[tabla_bajo_margen['Margen %'] < 0].copy()
+                    if not productos_perdida.empty:
+                        # Usar los nombres de columnas originales para el cálculo
+                        coste_col_name = f'{coste_col} (€)'
+                        precio_venta_col = 'Precio Venta (€)'
+                        perdida_total = ((productos_perdida[coste_col_name] - productos_perdida[precio_venta_col]) * 
+                                       abs(productos_perdida['Margen %'] / 100)).sum()
+                        if pd.isna(perdida_total) or perdida_total == float('inf') or perdida_total == float('-inf'):
+                            st.metric("Pérdida estimada", "N/A")
+                        else:
+                            st.metric("Pérdida estimada", f"{perdida_total:.0f}€")
+                    else:
+                        st.metric("Pérdida estimada", "0€")
+                except Exception as e:
+                    st.metric("Pérdida estimada", f"Error: {str(e)}")
         else:
-            st.info("No hay datos de Precio Coste, Subtotal o Cantidad disponibles para el análisis de márgenes.")
+            st.info(f"No hay productos con margen inferior al {umbral_margen*100:.0f}%")
+    else:
+        st.info("No hay datos de Precio Coste, Subtotal o Cantidad disponibles para el análisis de márgenes.")
+
+
+def mostrar_tema_almacen(tema, resultado, cantidad_col, figsize):
+    """Gráfico enviado vs ventas y tabla de entradas por mes de un tema (calculos.comparacion_temas)"""
+    st.subheader(f"Entrada Almacén - {tema}")
+
+    datos_comparacion = resultado['comparacion']
+    if datos_comparacion is not None:
+        fig, ax = plt.subplots(figsize=figsize)
+        x = np.arange(len(datos_comparacion))
+        width = 0.35
+        ax.bar(x - width/2, datos_comparacion[cantidad_col], width, label='Enviado Almacén', color='purple', alpha=0.8)
+        ax.bar(x + width/2, datos_comparacion['Cantidad'], width, label='Ventas', color='darkblue', alpha=0.8)
+        ax.set_xlabel('Talla')
+        ax.set_ylabel('Cantidad')
+        ax.set_title(f"Enviado vs Ventas - {tema} ({resultado['temporada']})")
+        ax.set_xticks(x)
+        ax.set_xticklabels(datos_comparacion['Talla'])
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+        st.pyplot(fig)
+        plt.close()
+
+    tabla_pivot = resultado['pivot']
+    if tabla_pivot is not None:
+        st.dataframe(
+            tabla_pivot.style.format("{:,.0f}"),
+            use_container_width=True,
+            hide_index=False
+        )
+        total_temp = tabla_pivot.sum().sum()
+        st.write(f"**Total Entrada Almacén:** {total_temp:,.0f}")
+    else:
+        st.info(f"No hay datos para el tema {tema}")
+
+
+# Tonos de amarillo de las barras de traspasos, por temporada
+COLORES_TRASPASOS = ['#ffff00', '#ffeb3b', '#ffc107', '#ff9800', '#ff5722', '#f57c00', '#ef6c00', '#e65100']
+
+
+def figura_ventas_traspasos(datos, temporada_colors):
+    """
+    Barras apiladas de ventas y traspasos por tienda y temporada. Una traza por
+    (tipo, temporada) con todas sus tiendas; las barras de cada tienda se ordenan
+    por tienda, primero ventas y luego traspasos.
+    """
+    tipos = ['Ventas', 'Traspasos']
+    temporadas = sorted(datos['Temporada'].unique())
+    grupos = dict(tuple(datos.groupby(['Tipo', 'Temporada'], observed=True)))
+
+    # Orden del eje x: tiendas ordenadas y, en cada una, sus tipos con datos
+    presentes = set(zip(datos['Tienda'], datos['Tipo']))
+    categorias = [
+        f'{tienda} - {tipo}'
+        for tienda in sorted(datos['Tienda'].unique())
+        for tipo in tipos
+        if (tienda, tipo) in presentes
+    ]
+
+    fig = go.Figure()
+    for tipo in tipos:
+        for i, temporada in enumerate(temporadas):
+            datos_traza = grupos.get((tipo, temporada))
+            if datos_traza is None:
+                continue
+            if tipo == 'Ventas':
+                color = temporada_colors.get(temporada, '#1f77b4')
+            else:
+                color = COLORES_TRASPASOS[i % len(COLORES_TRASPASOS)]
+            fig.add_trace(go.Bar(
+                name=f'{tipo} - {temporada}',
+                x=datos_traza['Tienda'].astype(str) + f' - {tipo}',
+                y=datos_traza['Cantidad Total'],
+                customdata=datos_traza['Tienda'],
+                marker_color=color,
+                texttemplate='%{y:,.0f}',
+                textposition='inside',
+                hovertemplate=f"Tienda: %{{customdata}}<br>Tipo: {tipo}<br>Temporada: {temporada}<br>Cantidad: %{{y:,.0f}}<extra></extra>",
+                opacity=0.8,
+                legendgroup=f'{tipo} - {temporada}'
+            ))
+
+    fig.update_layout(
+        title="Ventas vs Traspasos por Tienda",
+        xaxis_title="Tienda",
+        yaxis_title="Cantidad Total",
+        barmode='stack',  # Barras apiladas por temporada
+        xaxis_tickangle=45,
+        xaxis=dict(categoryorder='array', categoryarray=categorias),
+        showlegend=True,
+        margin=dict(t=30, b=0, l=0, r=0),
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        height=500
+    )
+    return fig
+
+
+# Índice de descripciones por fichero (keyed by path + modification time)
+descripciones_fichero = precalculo.por_version(leer_descripciones)
+
+
+# Ventas por familia y clave de descripción (keyed by the filtered version token)
+@precalculo.por_version
+def ventas_descripciones(df_ventas, df_dim_producto):
+    """Ventas por familia y clave de descripción del dataset filtrado"""
+    claves = atributo_producto(df_ventas['ACT'], df_dim_producto, 'Clave Descripción')
+    return ventas_por_descripcion(df_ventas, claves)
+
+
+# Descripciones de una familia y tipo (keyed by filtered version, file version, family and type)
+descripciones_por_familia = precalculo.por_version(descripciones_familia)
+
+# Comparación por tema de la familia seleccionada (keyed by filtered version + family)
+comparar_temas = precalculo.por_version(comparacion_temas)
 
-# Cached function for calculating store rankings
-@st.cache_data
+# Cached function for calculating store rankings (keyed by the dataset version token)
+@precalculo.por_version
 def calculate_store_rankings(df_ventas):
     """Cache the store ranking calculations"""
-    ventas_por_tienda = df_ventas.groupby('NombreTPV').agg({
+    ventas_por_tienda = df_ventas.groupby('NombreTPV', observed=True).agg({
         'Cantidad': 'sum',
         'Ventas Dinero': 'sum'
     }).reset_index()
@@ -2676,62 +1947,98 @@ def calculate_store_rankings(df_ventas):
     ventas_por_tienda['Ranking'] = ventas_por_tienda.index + 1
     return ventas_por_tienda
 
-# Cached function for calculating family rankings per store
-@st.cache_data
+# Cached function for calculating family rankings per store (keyed by the version token)
+@precalculo.por_version
 def calculate_family_rankings(df_ventas):
     """Cache the family ranking calculations per store"""
-    familias_por_tienda = df_ventas.groupby(['NombreTPV', 'Familia'])['Cantidad'].sum().reset_index()
+    familias_por_tienda = df_ventas.groupby(['NombreTPV', 'Familia'], observed=True)['Cantidad'].sum().reset_index()
     familias_por_tienda = familias_por_tienda.sort_values('Cantidad', ascending=False)
     return familias_por_tienda
 
-# Cached function for data preprocessing
-@st.cache_data
+# Cached function for data preprocessing (keyed by the dataset digest)
+@precalculo.por_version
 def preprocess_ventas_data(df_ventas):
-    """Cache the data preprocessing to avoid reprocessing on every interaction"""
-    df_ventas = df_ventas.copy()
+    """
+    Construye la tabla de ventas canónica una sola vez tras la carga: fechas y
+    cantidades validadas, columnas derivadas (Mes, año, mes, Familia...) y marca
+    df.attrs['canonica']. Con copy-on-write activo en app.py las secciones la
+    consumen sin copiarla ni volver a parsear fechas; no deben modificarla.
+    """
+    # Copia superficial: las columnas nuevas no tocan la tabla ingerida
+    df_ventas = df_ventas.copy(deep=False)
     
-    # Asegurarnos que las columnas existen y están en el formato correcto
-    df_ventas['Fecha Documento'] = pd.to_datetime(df_ventas['Fecha Documento'], format='%d/%m/%Y', errors='coerce')
-    df_ventas = df_ventas.dropna(subset=['Fecha Documento'])
-
-    df_ventas['Mes'] = df_ventas['Fecha Documento'].dt.to_period('M').astype(str)
-    df_ventas['Tienda'] = df_ventas['NombreTPV'].astype(str)
+    # La ingesta ya tipa las columnas; solo se convierten si llegan sin tipar
+    if not pd.api.types.is_datetime64_any_dtype(df_ventas['Fecha Documento']):
+        df_ventas['Fecha Documento'] = pd.to_datetime(df_ventas['Fecha Documento'], format='%d/%m/%Y', errors='coerce')
+    # Ordenada por fecha: aplicar_filtros corta el rango por búsqueda binaria
+    df_ventas = df_ventas.dropna(subset=['Fecha Documento']).sort_values('Fecha Documento', kind='stable')
+
+    fechas = df_ventas['Fecha Documento'].dt
+    df_ventas['Mes'] = fechas.to_period('M').astype(str)
+    df_ventas['año'] = fechas.year.astype('int16')
+    df_ventas['mes'] = fechas.month.astype('int8')
+    # Mismo diccionario de tiendas que 'Tienda' en traspasos (claves codificadas al ingerir)
+    df_ventas['Tienda'] = df_ventas['NombreTPV']
     df_ventas['Producto'] = df_ventas['ACT']
-    df_ventas['Familia'] = df_ventas['Descripción Familia'].fillna("Sin Familia")
+    df_ventas['Familia'] = rellenar_categoria(df_ventas['Descripción Familia'], "Sin Familia")
     
     # Asegurar que todas las columnas numéricas están en el formato correcto
-    df_ventas['Cantidad'] = pd.to_numeric(df_ventas['Cantidad'], errors='coerce').fillna(0)
-    df_ventas['Subtotal'] = pd.to_numeric(df_ventas['Subtotal'], errors='coerce').fillna(0)
-    
-    # Handle precio_pvp column if it exists
-    if 'precio_pvp' in df_ventas.columns:
-        df_ventas['precio_pvp'] = pd.to_numeric(df_ventas['precio_pvp'], errors='coerce').fillna(0)
+    for col in ['Cantidad', 'Subtotal', 'precio_pvp']:
+        if col not in df_ventas.columns:
+            continue
+        if not pd.api.types.is_numeric_dtype(df_ventas[col]):
+            df_ventas[col] = pd.to_numeric(df_ventas[col], errors='coerce').fillna(0)
+        elif df_ventas[col].hasnans:
+            df_ventas[col] = df_ventas[col].fillna(0)
     
     # Calcular ventas en dinero usando Subtotal
     df_ventas['Ventas Dinero'] = df_ventas['Subtotal']
     
     df_ventas['Descripción Color'] = df_ventas.get('Descripción Color', 'Desconocido')
     
-    # Asegurar que la columna Temporada existe y está mapeada correctamente
+    # Asegurar que la columna Temporada existe (los alias se resuelven al ingerir)
     if 'Temporada' not in df_ventas.columns:
-        # Buscar columnas que puedan contener la temporada
-        temporada_columns = [col for col in df_ventas.columns if 'temporada' in col.lower() or 'season' in col.lower()]
-        if temporada_columns:
-            df_ventas['Temporada'] = df_ventas[temporada_columns[0]]
-        else:
-            # Si no hay columna de temporada, crear una por defecto
-            df_ventas['Temporada'] = 'Sin Temporada'
+        # Si no hay columna de temporada, crear una por defecto
+        df_ventas['Temporada'] = 'Sin Temporada'
     else:
         # Asegurar que la columna Temporada no tenga valores nulos
-        df_ventas['Temporada'] = df_ventas['Temporada'].fillna('Sin Temporada')
+        df_ventas['Temporada'] = rellenar_categoria(df_ventas['Temporada'], 'Sin Temporada')
     
     # Identificar tiendas online y físicas
-    df_ventas['Es_Online'] = df_ventas['NombreTPV'].str.contains('ONLINE', case=False, na=False)
+    df_ventas['Es_Online'] = marcar_online(df_ventas['NombreTPV'])
     
+    df_ventas.attrs['canonica'] = True
     return df_ventas
 
-# Cached function for consistent temporada colors
-@st.cache_data
+def anexar_ventas_canonicas(df_canonica, df_delta):
+    """
+    Tabla canónica tras anexar un periodo: une la tabla canónica previa con la del
+    delta (preprocess_ventas_data de solo las filas nuevas, cacheada con su propio
+    token) sin volver a preprocesar el histórico. Cada categórica toma el diccionario
+    del delta cuando este ya amplía el previo (claves compartidas, cuyos códigos usan
+    las dimensiones) y si no la unión ordenada, como al concatenar las hojas.
+    """
+    if df_delta.empty:
+        return df_canonica
+    df_canonica = df_canonica.copy(deep=False)
+    df_delta = df_delta.copy(deep=False)
+    for col, tipo in df_delta.dtypes.items():
+        previo = df_canonica[col].dtype
+        if previo == tipo or not isinstance(tipo, pd.CategoricalDtype) or not isinstance(previo, pd.CategoricalDtype):
+            continue
+        if not previo.categories.isin(tipo.categories).all():
+            tipo = pd.CategoricalDtype(tipo.categories.union(previo.categories))
+            df_delta[col] = df_delta[col].cat.set_categories(tipo.categories, ordered=False)
+        df_canonica[col] = df_canonica[col].cat.set_categories(tipo.categories, ordered=tipo.ordered)
+    df_ventas = pd.concat([df_canonica, df_delta])
+    # Mismo orden que preprocesar la tabla completa: por fecha, el histórico antes que el delta
+    if not df_ventas['Fecha Documento'].is_monotonic_increasing:
+        df_ventas = df_ventas.sort_values('Fecha Documento', kind='stable')
+    df_ventas.attrs['canonica'] = True
+    return df_ventas
+
+# Cached function for consistent temporada colors (keyed by the version token)
+@precalculo.por_version
 def get_temporada_colors(df_ventas):
     """Get consistent color mapping for temporadas across all charts"""
     temporadas = sorted(df_ventas['Temporada'].unique())
@@ -2740,168 +2047,171 @@ def get_temporada_colors(df_ventas):
         color_mapping[temp] = TEMPORADA_COLORS[i % len(TEMPORADA_COLORS)]
     return color_mapping
 
-@st.cache_resource
+# Model and feature files of the improved and the original models
+IMPROVED_MODEL_FILES = {
+    'model_en': 'modelos_mejorados/model_en_robust.pkl',
+    'model_fuera': 'modelos_mejorados/model_fuera_robust.pkl',
+    'config_en': 'modelos_mejorados/features_en_robust.json',
+    'config_fuera': 'modelos_mejorados/features_fuera_robust.json',
+}
+ORIGINAL_MODEL_FILES = {
+    'model_en': 'modelos_finales/model_en_final.pkl',
+    'model_fuera': 'modelos_finales/model_fuera_final.pkl',
+    'config_en': 'modelos_finales/features_en_final.json',
+    'config_fuera': 'modelos_finales/features_fuera_final.json',
+}
+
+def models_version():
+    """
+    Cheap token of the models on disk: whether the improved models are used plus
+    each model/config file with its modification time and size
+    """
+    is_improved = os.path.exists(IMPROVED_MODEL_FILES['model_en'])
+    files = IMPROVED_MODEL_FILES if is_improved else ORIGINAL_MODEL_FILES
+    signatures = []
+    for path in files.values():
+        try:
+            stat = os.stat(path)
+            signatures.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signatures.append((path, None, None))
+    return is_improved, tuple(signatures)
+
 def load_trained_models():
-    """Load the improved trained models and configurations"""
+    """Load the trained models and configurations, reloaded when a model file changes"""
+    return _load_trained_models(models_version())
+
+@st.cache_resource(max_entries=1)
+def _load_trained_models(version):
+    """Load the improved trained models and configurations (the version token is the cache key)"""
+    is_improved = version[0]
     try:
-        # Try to load improved models first
-        improved_model_path = 'modelos_mejorados/model_en_robust.pkl'
-        if os.path.exists(improved_model_path):
+        if is_improved:
+            # Load improved models first
             print("🔧 Loading improved models...")
-            
-            # Load improved models
-            model_en = joblib.load('modelos_mejorados/model_en_robust.pkl')
-            model_fuera = joblib.load('modelos_mejorados/model_fuera_robust.pkl')
-            
-            # Load improved configurations
-            with open('modelos_mejorados/features_en_robust.json', 'r') as f:
-                config_en = json.load(f)
-            
-            with open('modelos_mejorados/features_fuera_robust.json', 'r') as f:
-                config_fuera = json.load(f)
-            
-            print("✅ Improved models loaded successfully")
-            
-            return {
-                'model_en': model_en,
-                'model_fuera': model_fuera,
-                'config_en': config_en,
-                'config_fuera': config_fuera,
-                'is_improved': True
-            }
+            files = IMPROVED_MODEL_FILES
         else:
             # Fallback to original models
             print("⚠️ Improved models not found, using original models...")
-            
-            model_en = joblib.load('modelos_finales/model_en_final.pkl')
-            model_fuera = joblib.load('modelos_finales/model_fuera_final.pkl')
-            
-            with open('modelos_finales/features_en_final.json', 'r') as f:
-                config_en = json.load(f)
-            
-            with open('modelos_finales/features_fuera_final.json', 'r') as f:
-                config_fuera = json.load(f)
-            
-            return {
-                'model_en': model_en,
-                'model_fuera': model_fuera,
-                'config_en': config_en,
-                'config_fuera': config_fuera,
-                'is_improved': False
-            }
+            files = ORIGINAL_MODEL_FILES
+
+        model_en = joblib.load(files['model_en'])
+        model_fuera = joblib.load(files['model_fuera'])
+
+        with open(files['config_en'], 'r') as f:
+            config_en = json.load(f)
+
+        with open(files['config_fuera'], 'r') as f:
+            config_fuera = json.load(f)
+
+        if is_improved:
+            print("✅ Improved models loaded successfully")
+
+        return {
+            'model_en': model_en,
+            'model_fuera': model_fuera,
+            'config_en': config_en,
+            'config_fuera': config_fuera,
+            'is_improved': is_improved,
+            # Identifies the loaded models in the prediction cache key
+            'version': version
+        }
     except Exception as e:
         st.error(f"Error loading models: {str(e)}")
         return None
 
-@st.cache_resource
 def load_training_data():
-    """Load and cache the training data"""
+    """Load the training data from the shared dataset store (cached, invalidated on file change)"""
     try:
-        training_data_path = 'data/datos_modelo_catboost.xlsx'
-        if not os.path.exists(training_data_path):
-            return None
-        
-        df_training = pd.read_excel(training_data_path)
-        df_training['Fecha Documento'] = pd.to_datetime(df_training['Fecha Documento'], format='%d/%m/%Y', errors='coerce', dayfirst=True)
-        return df_training
+        return cargar_datos_entrenamiento()
     except Exception as e:
         st.error(f"Error loading training data: {str(e)}")
         return None
 
-@st.cache_data
-def prepare_all_predictions_data(timestamp=None):
+# Cached function for the prediction dataset (keyed by the training data signature + day).
+# Errors propagate so that a failed run is not cached; the caller reports them.
+@precalculo.por_version
+def prepare_all_predictions_data(df_training):
     """Prepare all prediction data in advance"""
-    try:
-        df_training = load_training_data()
-        if df_training is None:
-            return None, None, None
-        
-        # Prepare dataset with future months (12 months ahead)
-        future_months = []
-        current_date = datetime.now()
-        for i in range(1, 13):  # 12 months ahead
-            future_date = current_date + timedelta(days=30*i)
-            future_months.append(future_date.strftime('%Y-%m-01'))
-        
-        # Prepare dataset with future months
-        en_temporada, fuera_temporada, monthly = prepare_final_dataset_improved(
-            df_training, meses_futuros=future_months
-        )
-        
-        return monthly, en_temporada, fuera_temporada
-        
-    except Exception as e:
-        st.error(f"Error preparing prediction data: {str(e)}")
-        return None, None, None
+    # Prepare dataset with future months (12 months ahead)
+    future_months = []
+    current_date = datetime.now()
+    for i in range(1, 13):  # 12 months ahead
+        future_date = current_date + timedelta(days=30*i)
+        future_months.append(future_date.strftime('%Y-%m-01'))
+
+    # Prepare dataset with future months
+    en_temporada, fuera_temporada, monthly = prepare_final_dataset_improved(
+        df_training, meses_futuros=future_months
+    )
+
+    return monthly, en_temporada, fuera_temporada
 
-@st.cache_data
-def make_all_predictions(monthly, _models_config, timestamp=None):
+# Cached function for the predictions (keyed by training data signature, loaded models + day).
+# Errors propagate so that a failed run is not cached; the caller reports them.
+@precalculo.por_version
+def make_all_predictions(monthly, _models_config):
     """Make all predictions in advance and cache them"""
-    try:
-        # Get future data (where we don't have actual values)
-        future_data = monthly[
-            (monthly['Cantidad_en_temporada'].isna()) | 
-            (monthly['Cantidad_fuera_temporada'].isna())
-        ].copy()
-        
-        if future_data.empty:
-            return monthly
-        
-        # Check if we're using improved models
-        is_improved = _models_config.get('is_improved', False)
-        
-        if is_improved:
-            # Use improved prediction method with constraints
-            print("🔧 Using improved models with constraints...")
-            
-            # Prepare model info for EN TEMPORADA
-            model_info_en = {
-                'model': _models_config['model_en'],
-                'features': _models_config['config_en']['features'],
-                'categorical_features': _models_config['config_en']['cat_features'],
-                'prediction_constraints': _models_config['config_en'].get('prediction_constraints', {'min_value': 0, 'max_multiplier': 3})
-            }
-            
-            # Prepare model info for FUERA TEMPORADA
-            model_info_fuera = {
-                'model': _models_config['model_fuera'],
-                'features': _models_config['config_fuera']['features'],
-                'categorical_features': _models_config['config_fuera']['cat_features'],
-                'prediction_constraints': _models_config['config_fuera'].get('prediction_constraints', {'min_value': 0, 'max_multiplier': 3})
-            }
-            
-            # Make predictions with constraints
-            pred_en = predict_with_constraints(model_info_en, future_data)
-            pred_fuera = predict_with_constraints(model_info_fuera, future_data)
-            
-        else:
-            # Use original prediction method
-            print("⚠️ Using original models...")
-            
-            # Make EN TEMPORADA predictions
-            X_en = future_data[_models_config['config_en']['features']].fillna(0)
-            cat_indices_en = [X_en.columns.get_loc(c) for c in _models_config['config_en']['cat_features'] if c in X_en.columns]
-            pool_en = Pool(X_en, cat_features=cat_indices_en)
-            pred_en = _models_config['model_en'].predict(pool_en)
-            
-            # Make FUERA TEMPORADA predictions
-            X_fuera = future_data[_models_config['config_fuera']['features']].fillna(0)
-            cat_indices_fuera = [X_fuera.columns.get_loc(c) for c in _models_config['config_fuera']['cat_features'] if c in X_fuera.columns]
-            pool_fuera = Pool(X_fuera, cat_features=cat_indices_fuera)
-            pred_fuera = _models_config['model_fuera'].predict(pool_fuera)
-        
-        # Update the monthly dataframe with predictions
-        monthly_pred = monthly.copy()
-        for i, idx in enumerate(future_data.index):
-            monthly_pred.loc[idx, 'Pred_Cantidad_en_temporada'] = pred_en[i]
-            monthly_pred.loc[idx, 'Pred_Cantidad_fuera_temporada'] = pred_fuera[i]
-            monthly_pred.loc[idx, 'Pred_Cantidad_Total'] = pred_en[i] + pred_fuera[i]
-        
-        return monthly_pred
-        
-    except Exception as e:
-        st.error(f"Error making predictions: {str(e)}")
+    # Get future data (where we don't have actual values)
+    future_data = monthly[
+        (monthly['Cantidad_en_temporada'].isna()) | 
+        (monthly['Cantidad_fuera_temporada'].isna())
+    ].copy()
+    
+    if future_data.empty:
         return monthly
+    
+    # Check if we're using improved models
+    is_improved = _models_config.get('is_improved', False)
+    
+    if is_improved:
+        # Use improved prediction method with constraints
+        print("🔧 Using improved models with constraints...")
+        
+        # Prepare model info for EN TEMPORADA
+        model_info_en = {
+            'model': _models_config['model_en'],
+            'features': _models_config['config_en']['features'],
+            'categorical_features': _models_config['config_en']['cat_features'],
+            'prediction_constraints': _models_config['config_en'].get('prediction_constraints', {'min_value': 0, 'max_multiplier': 3})
+        }
+        
+        # Prepare model info for FUERA TEMPORADA
+        model_info_fuera = {
+            'model': _models_config['model_fuera'],
+            'features': _models_config['config_fuera']['features'],
+            'categorical_features': _models_config['config_fuera']['cat_features'],
+            'prediction_constraints': _models_config['config_fuera'].get('prediction_constraints', {'min_value': 0, 'max_multiplier': 3})
+        }
+        
+        # Make predictions with constraints
+        pred_en = predict_with_constraints(model_info_en, future_data)
+        pred_fuera = predict_with_constraints(model_info_fuera, future_data)
+        
+    else:
+        # Use original prediction method
+        print("⚠️ Using original models...")
+        
+        # Make EN TEMPORADA predictions
+        X_en = future_data[_models_config['config_en']['features']].fillna(0)
+        cat_indices_en = [X_en.columns.get_loc(c) for c in _models_config['config_en']['cat_features'] if c in X_en.columns]
+        pool_en = Pool(X_en, cat_features=cat_indices_en)
+        pred_en = _models_config['model_en'].predict(pool_en)
+        
+        # Make FUERA TEMPORADA predictions
+        X_fuera = future_data[_models_config['config_fuera']['features']].fillna(0)
+        cat_indices_fuera = [X_fuera.columns.get_loc(c) for c in _models_config['config_fuera']['cat_features'] if c in X_fuera.columns]
+        pool_fuera = Pool(X_fuera, cat_features=cat_indices_fuera)
+        pred_fuera = _models_config['model_fuera'].predict(pool_fuera)
+    
+    # Update the monthly dataframe with predictions
+    monthly_pred = monthly.copy()
+    for i, idx in enumerate(future_data.index):
+        monthly_pred.loc[idx, 'Pred_Cantidad_en_temporada'] = pred_en[i]
+        monthly_pred.loc[idx, 'Pred_Cantidad_fuera_temporada'] = pred_fuera[i]
+        monthly_pred.loc[idx, 'Pred_Cantidad_Total'] = pred_en[i] + pred_fuera[i]
+    
+    return monthly_pred
 
 def create_prediction_data(df_ventas, selected_stores, selected_families, selected_sizes, months_ahead):
     """Create prediction data for the selected parameters"""
@@ -2942,6 +2252,9 @@ def show_prediction_interface(df_ventas):
     col1, col2 = st.columns([1, 3])
     with col1:
         if st.button("🔄 Regenerar"):
+            # Drop the cached prediction data and predictions so they are computed again
+            precalculo.descartar(prepare_all_predictions_data)
+            precalculo.descartar(make_all_predictions)
             st.session_state.models_loaded = False
             st.session_state.monthly_predictions = None
             st.session_state.df_training = None
@@ -2986,7 +2299,15 @@ def show_prediction_interface(df_ventas):
         
         # Step 3: Prepare prediction data (70%)
         status_text.text("Preparando datos para predicciones...")
-        monthly_all, en_temporada, fuera_temporada = prepare_all_predictions_data(timestamp=datetime.now())
+        # Same training data and day: same future months, so the prediction data is reused
+        version_training = (version_entrenamiento(), datetime.now().date())
+        try:
+            monthly_all, en_temporada, fuera_temporada = prepare_all_predictions_data(
+                df_training, version=version_training
+            )
+        except Exception as e:
+            st.error(f"Error preparing prediction data: {str(e)}")
+            monthly_all = None
         if monthly_all is None:
             st.error("No se pudieron preparar los datos de predicción.")
             return
@@ -2994,7 +2315,14 @@ def show_prediction_interface(df_ventas):
         
         # Step 4: Make predictions (100%)
         status_text.text("Generando predicciones...")
-        monthly_pred_all = make_all_predictions(monthly_all, models_config, timestamp=datetime.now())
+        # Same prediction data and loaded models: the predictions are reused
+        try:
+            monthly_pred_all = make_all_predictions(
+                monthly_all, models_config, version=version_training + (models_config['version'],)
+            )
+        except Exception as e:
+            st.error(f"Error making predictions: {str(e)}")
+            monthly_pred_all = monthly_all
         if monthly_pred_all is None:
             st.error("No se pudieron generar las predicciones.")
             return
@@ -3246,17 +2574,19 @@ def create_comparison_graph(future_pred, selected_family, selected_season):
             season_months = [9, 10, 11, 12, 1, 2]  # Septiembre a Marzo
             season_name = "Invierno"
         
-        # Prepare historical data (real data) - use correct column name
-        df_training['Fecha Documento'] = pd.to_datetime(df_training['Fecha Documento'], format='%d/%m/%Y', errors='coerce', dayfirst=True)
-        df_training['año'] = df_training['Fecha Documento'].dt.year
-        df_training['mes'] = df_training['Fecha Documento'].dt.month
+        # Prepare historical data (real data) - dates are already parsed by the dataset store,
+        # which is shared and must not be modified
+        año_training = df_training['Fecha Documento'].dt.year
+        mes_training = df_training['Fecha Documento'].dt.month
         
         # Filter historical data for the selected family and season
         historical_data = df_training[
             (df_training['Descripción Familia'] == selected_family) &
-            (df_training['mes'].isin(season_months)) &
-            (df_training['año'].isin([2023, 2024, 2025]))
+            (mes_training.isin(season_months)) &
+            (año_training.isin([2023, 2024, 2025]))
         ].copy()
+        historical_data['año'] = año_training
+        historical_data['mes'] = mes_training
         
         if historical_data.empty:
             st.warning(f"No hay datos históricos disponibles para {selected_family} en {season_name}.")
@@ -0,0 +1,69 @@
+"""
+Almacén único del dataset de entrenamiento (data/datos_modelo_catboost.xlsx).
+
+El Excel se convierte una sola vez a Parquet tipado (caché en disco por digest) y
+el DataFrame resultante se comparte en memoria entre la app, el dashboard y el
+script de entrenamiento. Se invalida cuando cambia la fecha de modificación o el
+tamaño del fichero; si el contenido no ha cambiado se reutiliza el Parquet.
+El DataFrame devuelto es compartido: los consumidores no deben modificarlo.
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+from cache_datos import digest_fichero, leer_libro, guardar_libro, preparar_para_parquet
+
+RUTA_ENTRENAMIENTO = os.path.join('data', 'datos_modelo_catboost.xlsx')
+VERSION_ENTRENAMIENTO = 1
+
+_TABLA = "entrenamiento"
+_memoria = {}
+_bloqueo = threading.Lock()
+
+
+def _firma(ruta):
+    estado = os.stat(ruta)
+    return estado.st_mtime_ns, estado.st_size
+
+
+def _leer_excel(ruta):
+    df = pd.read_excel(ruta)
+    df['Fecha Documento'] = pd.to_datetime(df['Fecha Documento'], format='%d/%m/%Y', errors='coerce', dayfirst=True)
+    return preparar_para_parquet(df)
+
+
+def version_entrenamiento(ruta=RUTA_ENTRENAMIENTO):
+    """Token barato del dataset de entrenamiento (fecha de modificación y tamaño), o None si no existe"""
+    ruta = os.path.abspath(ruta)
+    if not os.path.exists(ruta):
+        return None
+    return (ruta, VERSION_ENTRENAMIENTO) + _firma(ruta)
+
+
+def cargar_datos_entrenamiento(ruta=RUTA_ENTRENAMIENTO):
+    """DataFrame de entrenamiento con 'Fecha Documento' ya parseada, o None si no existe"""
+    ruta = os.path.abspath(ruta)
+    if not os.path.exists(ruta):
+        return None
+
+    with _bloqueo:
+        firma = _firma(ruta)
+        entrada = _memoria.get(ruta)
+        if entrada is not None and entrada[0] == firma:
+            return entrada[1]
+
+        clave = f"{_TABLA}-{digest_fichero(ruta)}-v{VERSION_ENTRENAMIENTO}"
+        tablas = leer_libro(clave, [_TABLA])
+        if tablas is not None:
+            df = tablas[_TABLA]
+        else:
+            df = _leer_excel(ruta)
+            try:
+                guardar_libro(clave, {_TABLA: df})
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar el dataset de entrenamiento en la caché: {e}")
+
+        _memoria[ruta] = (firma, df)
+        return df
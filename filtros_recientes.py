@@ -0,0 +1,46 @@
+"""
+Resultados de filtros recientes de la sesión (temporada, rango de fechas y tiendas).
+
+Cada resultado se guarda en st.session_state por (digest del dataset, temporada,
+filtros), de modo que volver a una combinación usada hace poco no recorre las
+tablas ni hashea DataFrames. La caché es LRU y se limita por número de entradas
+y por memoria; el resultado más reciente se conserva siempre. Los resultados son
+compartidos con el dashboard: no deben modificarse.
+"""
+
+import os
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+MAX_FILTROS = int(os.environ.get("TRUCCO_FILTROS_MAX", "8"))
+PRESUPUESTO_BYTES = int(os.environ.get("TRUCCO_FILTROS_MB", "256")) * 1024 * 1024
+
+_CLAVE_SESION = "filtros_recientes"
+
+
+def _tamano(valor):
+    """Bytes aproximados de los DataFrames de un resultado (un DataFrame o una tupla)"""
+    partes = valor if isinstance(valor, tuple) else (valor,)
+    return sum(int(p.memory_usage(index=True).sum()) for p in partes if isinstance(p, pd.DataFrame))
+
+
+def recordar(clave, funcion, *args):
+    """Resultado de funcion(*args) memorizado en la sesión por clave"""
+    recientes = st.session_state.get(_CLAVE_SESION)
+    if recientes is None:
+        recientes = st.session_state[_CLAVE_SESION] = OrderedDict()
+
+    entrada = recientes.get(clave)
+    if entrada is not None:
+        recientes.move_to_end(clave)
+        return entrada[0]
+
+    valor = funcion(*args)
+    recientes[clave] = (valor, _tamano(valor))
+    total = sum(tamano for _, tamano in recientes.values())
+    while len(recientes) > 1 and (len(recientes) > MAX_FILTROS or total > PRESUPUESTO_BYTES):
+        _, (_, tamano) = recientes.popitem(last=False)
+        total -= tamano
+    return valor
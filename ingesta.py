@@ -0,0 +1,864 @@
+"""
+Lectura del libro Excel de ventas, compras y traspasos.
+"""
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.api.types import union_categoricals
+
+from cache_datos import preparar_para_parquet
+
+HOJA_COMPRA = "Compra"
+HOJA_TRASPASOS = "Traspasos de almacén a tienda"
+HOJA_VENTAS = "ventas 23 24 25"
+HOJAS_LIBRO = (HOJA_COMPRA, HOJA_TRASPASOS, HOJA_VENTAS)
+# Hojas que admiten carga incremental (un libro con solo el periodo nuevo)
+HOJAS_INCREMENTALES = (HOJA_TRASPASOS, HOJA_VENTAS)
+# Dimensión de producto (una fila por ACT), guardada en la caché junto al libro
+DIMENSION_PRODUCTO = "dimension producto"
+# Dimensión de tienda (una fila por tienda), guardada en la caché junto al libro
+DIMENSION_TIENDA = "dimension tienda"
+
+# Por encima de este tamaño de fichero la hoja de ventas se lee en streaming
+UMBRAL_STREAMING_BYTES = int(os.environ.get("TRUCCO_STREAMING_MB", "20")) * 1024 * 1024
+TAMANO_LOTE = 50_000
+
+
+# Versión del esquema: forma parte de la clave de la caché en disco para no servir
+# tablas guardadas con tipos antiguos (o sin las dimensiones / claves codificadas)
+VERSION_ESQUEMA = 8
+
+# Tipo declarado de cada columna conocida, por hoja.
+#   'fecha'     -> datetime64 (formato dd/mm/aaaa, con reintento genérico)
+#   'categoria' -> category (sobre texto)
+#   'texto'     -> object con valores str (las tallas numéricas pasan a '36', '38'...)
+#   'int32'     -> entero, vacíos a 0
+#   'float32' / 'float64'
+ESQUEMAS = {
+    HOJA_VENTAS: {
+        'Fecha Documento': 'fecha',
+        'NombreTPV': 'categoria',
+        'ACT': 'texto',
+        'Talla': 'categoria',
+        'Temporada': 'categoria',
+        'Descripción Familia': 'categoria',
+        'Descripción Color': 'texto',
+        'Zona geográfica': 'texto',
+        'Cantidad': 'int32',
+        'Subtotal': 'float64',
+        'P.V.P.': 'float32',
+        'precio_pvp': 'float32',
+        'Precio Coste': 'float32',
+    },
+    HOJA_COMPRA: {
+        'ACT': 'texto',
+        'Talla': 'texto',
+        'Tema': 'texto',
+        'Modelo Artículo': 'texto',
+        'Fecha REAL entrada en almacén': 'fecha',
+        'Cantidad Pedida': 'int32',
+    },
+    HOJA_TRASPASOS: {
+        'ACT': 'texto',
+        'Talla': 'texto',
+        'Tienda': 'texto',
+        'Temporada': 'texto',
+        'Fecha Enviado': 'fecha',
+        'Enviado': 'int32',
+    },
+}
+
+# Columnas sin las que el dashboard no puede funcionar
+OBLIGATORIAS = {
+    HOJA_VENTAS: ['Fecha Documento', 'NombreTPV', 'ACT', 'Cantidad', 'Subtotal'],
+    HOJA_COMPRA: ['ACT', 'Talla'],
+    HOJA_TRASPASOS: ['ACT', 'Talla', 'Tienda', 'Fecha Enviado', 'Enviado'],
+}
+
+# Nombres alternativos que se renombran a la columna canónica al ingerir
+ALIAS = {
+    HOJA_VENTAS: {
+        'Precio Coste': ['precio_cost', 'precio_coste', 'Precio Costo', 'Coste', 'Costo', 'coste', 'costo'],
+        'Temporada': ['temporada', 'Season', 'season'],
+    },
+    HOJA_TRASPASOS: {
+        'Talla': ['Size'],
+        'Temporada': ['temporada', 'Season', 'season'],
+    },
+}
+
+
+def _rol_cantidad_compra(columnas, numericas):
+    """Columna de unidades entradas en almacén: la primera 'cantidad' que no sea la pedida"""
+    for col in columnas:
+        if 'cantidad' in str(col).lower() and 'pedida' not in str(col).lower():
+            return col
+    if 'Cantidad' in columnas:
+        return 'Cantidad'
+    return numericas[0] if numericas else None
+
+
+# Columnas con un papel en el dashboard cuyo nombre no es fijo en el Excel
+ROLES = {
+    HOJA_COMPRA: {'cantidad': _rol_cantidad_compra},
+}
+
+# Claves que se cruzan entre hojas. Todas las columnas de un mismo grupo comparten
+# diccionario (CategoricalDtype), así que merges y groupbys trabajan sobre códigos
+# enteros compatibles entre ventas, compra y traspasos.
+CLAVES_COMPARTIDAS = {
+    'ACT': [(HOJA_VENTAS, 'ACT'), (HOJA_COMPRA, 'ACT'), (HOJA_TRASPASOS, 'ACT')],
+    'Talla': [(HOJA_VENTAS, 'Talla'), (HOJA_COMPRA, 'Talla'), (HOJA_TRASPASOS, 'Talla')],
+    'Tienda': [(HOJA_VENTAS, 'NombreTPV'), (HOJA_TRASPASOS, 'Tienda')],
+}
+
+
+
+def clave_talla(talla):
+    """
+    Clave de ordenación de negocio para tallas.
+    Prioriza: 1. Tallas numéricas, 2. Tallas de letra estándar, 3. Tallas únicas, 4. Resto.
+    """
+    talla_str = str(talla).upper()
+
+    # Prioridad 1: Tallas numéricas (e.g., '36', '38')
+    if talla_str.isdigit():
+        return (0, int(talla_str))
+
+    # Prioridad 2: Tallas de letra estándar
+    size_order = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+    if talla_str in size_order:
+        return (1, size_order.index(talla_str))
+
+    # Prioridad 3: Tallas únicas
+    if talla_str in ['U', 'ÚNICA', 'UNICA', 'TU']:
+        return (2, talla_str)
+
+    # Prioridad 4: Resto, ordenado alfabéticamente
+    return (3, talla_str)
+
+
+# Claves con orden de negocio: su diccionario es una categórica ordenada, de modo que
+# ordenar, pivotar y fijar el orden de los gráficos por talla trabaja sobre los códigos
+ORDEN_CLAVES = {
+    'Talla': clave_talla,
+}
+
+# Claves derivadas: columna origen y función sobre su texto
+CLAVES_DERIVADAS = {
+    'ACT_14': ('ACT', lambda s: s.str[:14]),
+    'Tema_6': ('Tema', lambda s: s.str[:6]),
+}
+
+# Claves de documento para deduplicar al anexar un periodo nuevo, y columna de fecha
+# que delimita la ventana en la que puede haber solape con el histórico
+CLAVES_DOCUMENTO = {
+    HOJA_VENTAS: ['Fecha Documento', 'NombreTPV', 'ACT', 'Talla', 'Cantidad', 'Subtotal'],
+    HOJA_TRASPASOS: ['Fecha Enviado', 'Tienda', 'ACT', 'Talla', 'Enviado'],
+}
+FECHA_DOCUMENTO = {
+    HOJA_VENTAS: 'Fecha Documento',
+    HOJA_TRASPASOS: 'Fecha Enviado',
+}
+
+
+def _a_texto(s):
+    if pd.api.types.infer_dtype(s, skipna=True) in ('string', 'empty'):
+        return s.astype(object)
+
+    def convertir(v):
+        # Las tallas numéricas llegan como 36 o 36.0: se guardan como '36'
+        if isinstance(v, float) and v.is_integer():
+            return str(int(v))
+        return str(v)
+    return s.map(convertir, na_action='ignore').astype(object)
+
+
+def _a_fecha(s):
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    fechas = pd.to_datetime(s, format='%d/%m/%Y', errors='coerce')
+    pendientes = fechas.isna() & s.notna()
+    if pendientes.any():
+        fechas[pendientes] = pd.to_datetime(s[pendientes], errors='coerce', dayfirst=True)
+    return fechas
+
+
+def _aplicar_tipo(s, tipo):
+    if tipo == 'fecha':
+        return _a_fecha(s)
+    if tipo == 'texto':
+        return _a_texto(s)
+    if tipo == 'categoria':
+        return _a_texto(s).astype('category')
+    if tipo == 'int32':
+        return pd.to_numeric(s, errors='coerce').fillna(0).astype('int32')
+    return pd.to_numeric(s, errors='coerce').astype(tipo)
+
+
+def informe_esquema(columnas, hoja):
+    """Columnas desconocidas y obligatorias que faltan en una hoja (no depende de los datos)"""
+    esquema = ESQUEMAS.get(hoja, {})
+    return {
+        'desconocidas': [c for c in columnas if c not in esquema],
+        'faltantes': [c for c in OBLIGATORIAS.get(hoja, []) if c not in columnas],
+    }
+
+
+def aplicar_esquema(df, hoja, inferir=True):
+    """
+    Aplica el esquema declarado de la hoja en una sola pasada: renombra alias y
+    convierte cada columna conocida a su tipo. Las columnas desconocidas solo se
+    convierten a número si todos sus valores lo son (con inferir=False se dejan sin
+    tocar, para inferirlas después sobre la hoja completa con inferir_no_declaradas).
+    El informe queda en df.attrs['esquema'] para mostrarlo una única vez.
+    """
+    renombrar = {}
+    for canonica, alias in ALIAS.get(hoja, {}).items():
+        if canonica in df.columns:
+            continue
+        for nombre in alias:
+            if nombre in df.columns:
+                renombrar[nombre] = canonica
+                break
+    if renombrar:
+        df = df.rename(columns=renombrar)
+
+    esquema = ESQUEMAS.get(hoja, {})
+    for col in df.columns:
+        if col in esquema:
+            df[col] = _aplicar_tipo(df[col], esquema[col])
+    if inferir:
+        inferir_no_declaradas(df, hoja)
+
+    informe = informe_esquema(list(df.columns), hoja)
+    informe['renombradas'] = renombrar
+    df.attrs['esquema'] = informe
+    return df
+
+
+def inferir_no_declaradas(df, hoja):
+    """
+    Tipo de las columnas que el esquema no declara: a número si todos sus valores lo
+    son y, si mezclan tipos, a texto (preparar_para_parquet)
+    """
+    esquema = ESQUEMAS.get(hoja, {})
+    for col in df.columns:
+        if col not in esquema and df[col].dtype == 'object':
+            numerica = pd.to_numeric(df[col], errors='coerce')
+            if numerica.notna().sum() == df[col].notna().sum():
+                df[col] = numerica
+            elif df[col].hasnans:
+                # Vacíos como NaN, igual que read_excel (openpyxl en streaming devuelve None)
+                df[col] = df[col].where(df[col].notna(), np.nan)
+    return preparar_para_parquet(df)
+
+
+def rellenar_categoria(s, valor):
+    """fillna que también funciona sobre columnas categóricas (mantiene las categorías ordenadas)"""
+    if isinstance(s.dtype, pd.CategoricalDtype) and valor not in s.cat.categories:
+        s = s.cat.set_categories(sorted([*s.cat.categories, valor]))
+    return s.fillna(valor)
+
+
+def columna_rol(df, hoja, rol):
+    """Nombre de la columna que cumple un rol (p. ej. la cantidad de entrada de 'Compra')"""
+    numericas = list(df.select_dtypes(include='number').columns)
+    return ROLES[hoja][rol](list(df.columns), numericas)
+
+
+def _cabecera(fila):
+    """Nombres de columna como los genera pandas.read_excel"""
+    return [
+        f"Unnamed: {i}" if valor is None else (str(valor) if not isinstance(valor, str) else valor)
+        for i, valor in enumerate(fila)
+    ]
+
+
+def iterar_lotes(data, hoja, tamano_lote=TAMANO_LOTE):
+    """
+    Recorre la hoja con openpyxl en modo solo lectura y devuelve lotes ya tipados
+    según el esquema. Solo hay en memoria un lote de filas sin tipar a la vez. Las
+    columnas no declaradas se dejan sin inferir: un lote no ve toda la columna.
+    """
+    libro = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        filas = libro[hoja].iter_rows(values_only=True)
+        cabecera = _cabecera(next(filas, ()))
+        lote = []
+        for fila in filas:
+            if all(v is None for v in fila):
+                continue
+            lote.append(fila[:len(cabecera)])
+            if len(lote) >= tamano_lote:
+                yield aplicar_esquema(pd.DataFrame.from_records(lote, columns=cabecera), hoja, inferir=False)
+                lote = []
+        if lote or not cabecera:
+            yield aplicar_esquema(pd.DataFrame.from_records(lote, columns=cabecera), hoja, inferir=False)
+    finally:
+        libro.close()
+
+
+def concatenar_tipado(lotes):
+    """Concatena tablas tipadas conservando las categóricas (unión de categorías)"""
+    if not lotes:
+        return pd.DataFrame()
+    categoricas = [col for col, tipo in lotes[0].dtypes.items() if isinstance(tipo, pd.CategoricalDtype)]
+    uniones = {}
+    for col in categoricas:
+        if not all(col in lote.columns for lote in lotes):
+            continue
+        if all(lote[col].dtype == lotes[0][col].dtype for lote in lotes):
+            # Mismo diccionario en todos los lotes (claves ya codificadas): pd.concat lo conserva
+            continue
+        if all(isinstance(lote[col].dtype, pd.CategoricalDtype) for lote in lotes):
+            # El histórico puede traer la talla ya ordenada: codificar_claves vuelve a fijar el orden
+            uniones[col] = union_categoricals([lote[col] for lote in lotes], sort_categories=True, ignore_order=True)
+    df = pd.concat([lote.drop(columns=list(uniones)) for lote in lotes], ignore_index=True)
+    for col, valores in uniones.items():
+        df[col] = valores
+    df = df[list(lotes[0].columns)]
+    df.attrs['esquema'] = lotes[0].attrs.get('esquema', {})
+    return df
+
+
+def leer_hoja_streaming(data, hoja, tamano_lote=TAMANO_LOTE):
+    """Lee una hoja por lotes tipados con memoria acotada y los concatena"""
+    # Las columnas no declaradas se infieren sobre la hoja completa, como con read_excel
+    return inferir_no_declaradas(concatenar_tipado(list(iterar_lotes(data, hoja, tamano_lote))), hoja)
+
+
+def _parsear_hoja(data, hoja):
+    """Parsea y tipa una hoja del libro (se ejecuta dentro de un proceso del pool)"""
+    if hoja == HOJA_VENTAS and len(data) > UMBRAL_STREAMING_BYTES:
+        return leer_hoja_streaming(data, hoja)
+    df = pd.read_excel(io.BytesIO(data), sheet_name=hoja, engine="openpyxl")
+    return aplicar_esquema(df, hoja)
+
+
+def parsear_libro(data, hojas=HOJAS_LIBRO):
+    """
+    Parsea las hojas del libro en paralelo, una por proceso, de modo que la carga
+    cuesta aproximadamente lo que la hoja más grande. Si no se puede crear el pool
+    (entornos sin fork, límites de procesos...) se parsean una tras otra.
+    """
+    workers = min(len(hojas), os.cpu_count() or 1)
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futuros = {hoja: pool.submit(_parsear_hoja, data, hoja) for hoja in hojas}
+                return {hoja: futuro.result() for hoja, futuro in futuros.items()}
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            print(f"⚠️ Parseo en paralelo no disponible, se usa parseo secuencial: {e}")
+
+    return {hoja: _parsear_hoja(data, hoja) for hoja in hojas}
+
+
+def hojas_del_libro(data):
+    """Nombres de las hojas de un libro sin cargar sus datos"""
+    libro = load_workbook(io.BytesIO(data), read_only=True)
+    try:
+        return list(libro.sheetnames)
+    finally:
+        libro.close()
+
+
+def completar_dimensiones(tablas):
+    """Añade a las tablas del libro las dimensiones de producto y tienda que se guardan en la caché"""
+    tablas[DIMENSION_PRODUCTO] = dimension_producto(tablas)
+    tablas[DIMENSION_TIENDA] = dimension_tienda(tablas)
+    return tablas
+
+
+def _con_ordinal(df, claves):
+    """Índice (claves..., nº de aparición) para distinguir filas idénticas legítimas"""
+    texto = df[claves].astype(str)
+    ordinal = texto.groupby(claves, sort=False).cumcount()
+    return pd.MultiIndex.from_frame(texto.assign(_ordinal=ordinal.values))
+
+
+def filas_nuevas(historico, nuevas, hoja):
+    """
+    Filas de `nuevas` que no están ya en el histórico según las claves de documento.
+    Solo se compara con la parte del histórico posterior a la primera fecha del
+    periodo nuevo, así que el coste depende del tamaño del delta y del solape.
+    """
+    claves = [c for c in CLAVES_DOCUMENTO.get(hoja, []) if c in nuevas.columns and c in historico.columns]
+    fecha = FECHA_DOCUMENTO.get(hoja)
+    if not claves or nuevas.empty:
+        return nuevas
+    solape = historico
+    if fecha in claves and nuevas[fecha].notna().any():
+        solape = historico[historico[fecha] >= nuevas[fecha].min()]
+    if solape.empty:
+        return nuevas
+    repetidas = _con_ordinal(nuevas, claves).isin(_con_ordinal(solape, claves))
+    return nuevas[~repetidas]
+
+
+def anexar_libro(historico, nuevas):
+    """
+    Anexa al histórico (tablas ya codificadas, con sus dimensiones) las hojas de un
+    libro con solo el periodo nuevo. Las filas repetidas se descartan, el delta se
+    codifica con los diccionarios del histórico (codificar_delta) y las dimensiones
+    se actualizan con el delta, sin recorrer todo el histórico.
+    Devuelve las tablas resultantes y el nº de filas añadidas por hoja.
+    """
+    tablas = dict(historico)
+    anadidas = {}
+    deltas = {}
+    for hoja, df in nuevas.items():
+        if hoja not in HOJAS_INCREMENTALES:
+            continue
+        delta = filas_nuevas(historico[hoja], df, hoja)
+        anadidas[hoja] = len(delta)
+        if not delta.empty:
+            deltas[hoja] = delta
+    if not deltas:
+        return tablas, anadidas
+
+    tablas, deltas = codificar_delta(tablas, deltas)
+    for hoja, delta in deltas.items():
+        tablas[hoja] = concatenar_tipado([tablas[hoja], delta])
+
+    ventas = deltas.get(HOJA_VENTAS)
+    # Las dimensiones crecen con los productos y tiendas nuevos y se actualizan con las ventas del delta
+    tablas[DIMENSION_PRODUCTO] = dimension_producto(tablas, historico.get(DIMENSION_PRODUCTO), ventas)
+    tablas[DIMENSION_TIENDA] = dimension_tienda(tablas, historico.get(DIMENSION_TIENDA), ventas)
+    return tablas, anadidas
+
+
+def _categorias(series, orden=None):
+    """Valores distintos (texto, sin nulos) de varias columnas; con `orden`, categórica ordenada por esa clave"""
+    valores = set()
+    for s in series:
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            valores.update(s.cat.categories[np.unique(s.cat.codes[s.cat.codes >= 0])])
+        else:
+            valores.update(s.dropna().unique())
+    return pd.CategoricalDtype(sorted((str(v) for v in valores), key=orden), ordered=orden is not None)
+
+
+def _recodificar(s, tipo):
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.set_categories(tipo.categories, ordered=tipo.ordered)
+    return s.astype(tipo)
+
+
+def _derivar(s, funcion):
+    """Aplica la función de texto sobre el diccionario y reparte el resultado por códigos"""
+    if not isinstance(s.dtype, pd.CategoricalDtype):
+        s = s.astype('category')
+    categorias = s.cat.categories
+    derivadas = funcion(pd.Series(categorias, dtype=object))
+    tipo = pd.CategoricalDtype(sorted(derivadas.dropna().unique()))
+    mapa = np.append(tipo.categories.get_indexer(derivadas), -1)
+    return pd.Series(pd.Categorical.from_codes(mapa[s.cat.codes], dtype=tipo), index=s.index)
+
+
+def codificar_claves(tablas):
+    """
+    Convierte las claves de cruce de las tres hojas a categóricas con diccionario
+    compartido (ordenado por la clave de negocio en las de ORDEN_CLAVES) y añade las
+    claves derivadas (ACT_14, Tema_6), calculadas sobre el diccionario en lugar de
+    fila a fila.
+    """
+    for grupo, columnas in CLAVES_COMPARTIDAS.items():
+        presentes = [(hoja, col) for hoja, col in columnas if hoja in tablas and col in tablas[hoja].columns]
+        if not presentes:
+            continue
+        tipo = _categorias((tablas[hoja][col] for hoja, col in presentes), ORDEN_CLAVES.get(grupo))
+        for hoja, col in presentes:
+            tablas[hoja][col] = _recodificar(tablas[hoja][col], tipo)
+
+    for derivada, (origen, funcion) in CLAVES_DERIVADAS.items():
+        hojas = [hoja for hoja in HOJAS_LIBRO if hoja in tablas and origen in tablas[hoja].columns]
+        series = {hoja: _derivar(tablas[hoja][origen], funcion) for hoja in hojas}
+        if not series:
+            continue
+        # Mismo diccionario para la clave derivada en todas las hojas
+        tipo = _categorias(series.values())
+        for hoja, s in series.items():
+            tablas[hoja][derivada] = _recodificar(s, tipo)
+    return tablas
+
+
+def _ampliar(tipo, valores, orden=None):
+    """
+    Diccionario con los valores nuevos añadidos. Sin `orden` van al final, de modo que
+    los códigos existentes no cambian; con `orden` (claves ordenadas) se recoloca todo.
+    """
+    nuevos = sorted({str(v) for v in valores} - set(tipo.categories))
+    if not nuevos:
+        return tipo
+    if orden is not None:
+        return pd.CategoricalDtype(sorted([*tipo.categories, *nuevos], key=orden), ordered=True)
+    return pd.CategoricalDtype([*tipo.categories, *nuevos], ordered=tipo.ordered)
+
+
+def _a_tipo(s, tipo):
+    """Recodifica s al diccionario tipo; si tipo solo añade categorías al final, sin tocar los códigos"""
+    if s.dtype == tipo:
+        return s
+    if (isinstance(s.dtype, pd.CategoricalDtype) and not tipo.ordered
+            and tipo.categories[:len(s.cat.categories)].equals(s.cat.categories)):
+        return s.cat.add_categories(tipo.categories[len(s.cat.categories):])
+    return _recodificar(s, tipo)
+
+
+def codificar_delta(historico, deltas):
+    """
+    Codifica las claves compartidas y derivadas de las hojas de un delta con los
+    diccionarios del histórico, ampliados con los valores nuevos del delta. Los valores
+    nuevos se añaden al final del diccionario, así que solo se codifica el delta y el
+    histórico conserva sus códigos; solo una talla nueva (clave ordenada) obliga a
+    recodificar el histórico, por códigos. Devuelve (histórico, deltas) con los
+    diccionarios ampliados.
+    """
+    historico = dict(historico)
+    deltas = dict(deltas)
+
+    def ampliar_columnas(columnas, valores_delta, orden=None):
+        en_historico = [(hoja, col) for hoja, col in columnas if hoja in historico and col in historico[hoja].columns]
+        if not en_historico:
+            return None
+        hoja, col = en_historico[0]
+        tipo = _ampliar(historico[hoja][col].dtype, valores_delta, orden)
+        for hoja, col in en_historico:
+            historico[hoja] = historico[hoja].assign(**{col: _a_tipo(historico[hoja][col], tipo)})
+        return tipo
+
+    for grupo, columnas in CLAVES_COMPARTIDAS.items():
+        en_delta = [(hoja, col) for hoja, col in columnas if hoja in deltas and col in deltas[hoja].columns]
+        if not en_delta:
+            continue
+        valores = set()
+        for hoja, col in en_delta:
+            valores.update(deltas[hoja][col].dropna().unique())
+        tipo = ampliar_columnas(columnas, valores, ORDEN_CLAVES.get(grupo))
+        if tipo is None:
+            tipo = _categorias((deltas[hoja][col] for hoja, col in en_delta), ORDEN_CLAVES.get(grupo))
+        for hoja, col in en_delta:
+            deltas[hoja] = deltas[hoja].assign(**{col: _recodificar(deltas[hoja][col], tipo)})
+
+    for derivada, (origen, funcion) in CLAVES_DERIVADAS.items():
+        series = {
+            hoja: _derivar(delta[origen], funcion) for hoja, delta in deltas.items() if origen in delta.columns
+        }
+        if not series:
+            continue
+        valores = set()
+        for s in series.values():
+            valores.update(s.dropna().unique())
+        tipo = ampliar_columnas([(hoja, derivada) for hoja in HOJAS_LIBRO], valores)
+        if tipo is None:
+            tipo = _categorias(series.values())
+        for hoja, s in series.items():
+            deltas[hoja] = deltas[hoja].assign(**{derivada: _recodificar(s, tipo)})
+    return historico, deltas
+
+
+def _por_codigo(df, clave, columnas, n_codigos):
+    """Última fila de df por valor de la clave, alineada con los códigos de su diccionario"""
+    ultimas = df[df[clave].notna()].drop_duplicates(clave, keep='last')
+    return ultimas[columnas].set_axis(ultimas[clave].cat.codes.to_numpy()).reindex(np.arange(n_codigos))
+
+
+def _ultimas(df, clave, columnas, n_codigos, previa=None, columna_fecha=None):
+    """
+    Fila más reciente de df (por 'Fecha Documento', orden estable) por valor de la
+    clave, alineada con sus códigos. Con `previa` (el resultado anterior, con la
+    fecha en columna_fecha) df es solo el delta: se compite con las filas previas,
+    que van delante, y el resultado es el mismo que sobre histórico + delta.
+    """
+    columnas = [col for col in columnas if col in df.columns]
+    if 'Fecha Documento' in df.columns:
+        columnas = columnas + ['Fecha Documento']
+    fuente = df[[clave] + columnas]
+    if previa is not None:
+        anteriores = previa.rename(columns={columna_fecha: 'Fecha Documento'})[columnas]
+        anteriores.insert(0, clave, pd.Categorical.from_codes(np.arange(len(previa)), dtype=df[clave].dtype))
+        fuente = concatenar_tipado([anteriores[anteriores[columnas].notna().any(axis=1)], fuente])
+    if 'Fecha Documento' in fuente.columns:
+        fuente = fuente.sort_values('Fecha Documento', kind='stable')
+    return _por_codigo(fuente, clave, columnas, n_codigos)
+
+
+def _es_ampliacion(previa, columna, tipo, *columnas):
+    """True si la dimensión previa sirve de base: su diccionario es un prefijo de tipo y tiene las columnas"""
+    return (
+        previa is not None and all(col in previa.columns for col in columnas)
+        and tipo.categories[:len(previa)].equals(previa[columna].cat.categories)
+    )
+
+
+def dimension_producto(tablas, previa=None, delta=None):
+    """
+    Dimensión de producto sobre las tablas ya codificadas: una fila por ACT del
+    diccionario compartido, en el orden de sus códigos, de modo que el código de
+    la categórica ACT es la clave subrogada ('id_producto'). Incluye ACT_14,
+    Tema_6, la clave de descripción (ACT sin el último carácter) y la familia,
+    temporada y fecha de la venta más reciente del producto. Con `previa` (la
+    dimensión del histórico) y `delta` (las ventas anexadas) las columnas de venta
+    se actualizan solo con el delta.
+    """
+    tipo = next(tablas[hoja]['ACT'].dtype for hoja in HOJAS_LIBRO if hoja in tablas and 'ACT' in tablas[hoja].columns)
+    n_productos = len(tipo.categories)
+    act = pd.Series(pd.Categorical.from_codes(np.arange(n_productos), dtype=tipo))
+
+    # ACT_14 y la clave de descripción se derivan sobre el diccionario; ACT_14 con el
+    # mismo diccionario que en las hojas
+    act_14 = _derivar(act, CLAVES_DERIVADAS['ACT_14'][1])
+    hoja_14 = next((hoja for hoja in HOJAS_LIBRO if hoja in tablas and 'ACT_14' in tablas[hoja].columns), None)
+    dimension = pd.DataFrame({
+        'id_producto': np.arange(n_productos, dtype='int32'),
+        'ACT': act,
+        'ACT_14': _recodificar(act_14, tablas[hoja_14]['ACT_14'].dtype) if hoja_14 else act_14,
+        'Clave Descripción': _derivar(act, lambda s: s.str[:-1]),
+    })
+
+    columnas_venta = ['Descripción Familia', 'Temporada']
+    incremental = delta is not None and _es_ampliacion(previa, 'ACT', tipo, 'Fecha Última Venta')
+
+    compra = tablas.get(HOJA_COMPRA)
+    if incremental and 'Tema_6' in previa.columns:
+        # La hoja de compra no se anexa: los productos nuevos no tienen tema
+        dimension['Tema_6'] = previa['Tema_6'].reindex(np.arange(n_productos))
+    elif compra is not None and 'Tema_6' in compra.columns:
+        dimension['Tema_6'] = _por_codigo(compra, 'ACT', ['Tema_6'], n_productos)['Tema_6']
+
+    if incremental:
+        ultimas = _ultimas(delta, 'ACT', columnas_venta, n_productos, previa, 'Fecha Última Venta')
+    elif tablas.get(HOJA_VENTAS) is not None:
+        ultimas = _ultimas(tablas[HOJA_VENTAS], 'ACT', columnas_venta, n_productos)
+    else:
+        return dimension
+    for col, serie in ultimas.rename(columns={'Fecha Documento': 'Fecha Última Venta'}).items():
+        dimension[col] = serie
+    return dimension
+
+
+def atributo_producto(act, dimension, columna):
+    """Columna de la dimensión de producto para cada fila de una columna ACT codificada, por códigos"""
+    valores = dimension[columna]
+    mapa = np.append(valores.cat.codes.to_numpy(), -1)
+    return pd.Series(pd.Categorical.from_codes(mapa[act.cat.codes.to_numpy()], dtype=valores.dtype), index=act.index)
+
+
+# ===== Dimensión de tienda =====
+
+TIENDAS_EXTRANJERAS = [
+    "I301COINBERGAMO(TRUCCO)", "I302COINVARESE(TRUCCO)", "I303COINBARICASAMASSIMA(TRUCCO)",
+    "I304COINMILANO5GIORNATE(TRUCCO)", "I305COINROMACINECITTA(TRUCCO)", "I306COINGENOVA(TRUCCO)",
+    "I309COINSASSARI(TRUCCO)", "I314COINCATANIA(TRUCCO)", "I315COINCAGLIARI(TRUCCO)",
+    "I316COINLECCE(TRUCCO)", "I317COINMILANOCANTORE(TRUCCO)", "I318COINMESTRE(TRUCCO)",
+    "I319COINPADOVA(TRUCCO)", "I320COINFIRENZE(TRUCCO)", "I321COINROMASANGIOVANNI(TRUCCO)",
+    "TRUCCOONLINEB2C"
+]
+
+# Ciudad de referencia de cada zona geográfica (tiendas de España)
+MAPEO_ZONA_CIUDAD = {
+    'Zona Madrid': 'MADRID',
+    'Zona Andalucía': 'SEVILLA',
+    'Zona Valencia': 'VALENCIA',
+    'Zona Galicia': 'VIGO',
+    'Zona Murcia': 'MURCIA',
+    'Zona Castilla y León': 'SALAMANCA',
+    'Zona País Vasco': 'BILBAO',
+    'Zona Aragón': 'ZARAGOZA',
+    'Zona Asturias': 'GIJON',
+    'Zona Castilla-La Mancha': 'ALBACETE',
+    'Zona Cataluña': 'BARCELONA',
+    'Zona Cantabria': 'SANTANDER',
+    'Zona Navarra': 'PAMPLONA',
+    'Zona La Rioja': 'LOGROÑO',
+    'Zona Extremadura': 'BADAJOZ',
+    'Zona Canarias': 'LAS PALMAS',
+    'Zona Baleares': 'PALMA'
+}
+
+COORDENADAS_ESPANA = {
+    'MADRID': (40.4168, -3.7038),
+    'SEVILLA': (37.3886, -5.9823),
+    'MALAGA': (36.7213, -4.4214),
+    'VALENCIA': (39.4699, -0.3763),
+    'VIGO': (42.2406, -8.7207),
+    'MURCIA': (37.9834, -1.1299),
+    'SALAMANCA': (40.9701, -5.6635),
+    'CORDOBA': (37.8882, -4.7794),
+    'BILBAO': (43.2630, -2.9350),
+    'ZARAGOZA': (41.6488, -0.8891),
+    'JAEN': (37.7796, -3.7849),
+    'GIJON': (43.5453, -5.6615),
+    'ALBACETE': (38.9943, -1.8585),
+    'GRANADA': (37.1773, -3.5986),
+    'CARTAGENA': (37.6051, -0.9862),
+    'TARRAGONA': (41.1189, 1.2445),
+    'LEON': (42.5987, -5.5671),
+    'SANTANDER': (43.4623, -3.8099),
+    'PAMPLONA': (42.8125, -1.6458),
+    'VITORIA': (42.8467, -2.6727),
+    'CASTELLON': (39.9864, -0.0513),
+    'CADIZ': (36.5271, -6.2886),
+    'JEREZ': (36.6850, -6.1261),
+    'AVILES': (43.5560, -5.9222),
+    'BADAJOZ': (38.8794, -6.9707),
+    'BARCELONA': (41.3851, 2.1734),
+    'LOGROÑO': (42.4627, -2.4449),
+    'LAS PALMAS': (28.1235, -15.4366),
+    'PALMA': (39.5696, 2.6502)
+}
+
+COORDENADAS_ITALIA = {
+    'BERGAMO': (45.6983, 9.6773),
+    'VARESE': (45.8206, 8.8256),
+    'BARICASAMASSIMA': (40.9634, 16.7514),
+    'MILANO5GIORNATE': (45.4642, 9.1900),
+    'ROMACINECITTA': (41.9028, 12.4964),
+    'GENOVA': (44.4056, 8.9463),
+    'SASSARI': (40.7259, 8.5557),
+    'CATANIA': (37.5079, 15.0830),
+    'CAGLIARI': (39.2238, 9.1217),
+    'LECCE': (40.3519, 18.1720),
+    'MILANOCANTORE': (45.4642, 9.1900),
+    'MESTRE': (45.4903, 12.2424),
+    'PADOVA': (45.4064, 11.8768),
+    'FIRENZE': (43.7696, 11.2558),
+    'ROMASANGIOVANNI': (41.9028, 12.4964),
+    'MILANO': (45.4642, 9.1900)
+}
+
+PAIS_ESPANA = "España"
+PAIS_ITALIA = "Italia"
+
+
+def marcar_online(tiendas):
+    """True para las tiendas online (nombre con 'ONLINE'), evaluado sobre el diccionario de tiendas"""
+    if not isinstance(tiendas.dtype, pd.CategoricalDtype):
+        tiendas = tiendas.astype('category')
+    online = pd.Series(tiendas.cat.categories, dtype=object).str.contains('ONLINE', case=False, na=False)
+    return pd.Series(np.append(online.to_numpy(dtype=bool), False)[tiendas.cat.codes.to_numpy()], index=tiendas.index)
+
+
+def _ciudad_espana(nombres, zonas):
+    """Ciudad de la zona geográfica o, sin zona, la que aparece en el nombre de la tienda"""
+    del_nombre = (
+        nombres.str.extract(r'ET\d{1,2}-([\w\s\.\(\)]+)')[0]
+        .str.upper()
+        .str.replace(r'ECITRUCCO|ECI|XANADU|TRUCCO|CORT.*|\(.*\)', '', regex=True)
+        .str.strip()
+    )
+    # Texto explícito: fillna sobre object intentaría reducir el tipo (FutureWarning en pandas 2.x)
+    ciudades = zonas.map(MAPEO_ZONA_CIUDAD).astype(object)
+    return ciudades.where(ciudades.notna(), del_nombre)
+
+
+def dimension_tienda(tablas, previa=None, delta=None):
+    """
+    Dimensión de tienda sobre las tablas ya codificadas: una fila por tienda del
+    diccionario compartido (NombreTPV / Tienda), en el orden de sus códigos
+    ('id_tienda'). Incluye canal, país, la zona geográfica de la venta más
+    reciente, la ciudad y sus coordenadas para los mapas, y el importe vendido y
+    el ranking de la tienda en todo el dataset. Con `previa` (la dimensión del
+    histórico) y `delta` (las ventas anexadas) zona e importe se actualizan solo
+    con el delta.
+    """
+    tipo = next(
+        tablas[hoja][col].dtype for hoja, col in CLAVES_COMPARTIDAS['Tienda']
+        if hoja in tablas and col in tablas[hoja].columns
+    )
+    n_tiendas = len(tipo.categories)
+    tienda = pd.Series(pd.Categorical.from_codes(np.arange(n_tiendas), dtype=tipo))
+    nombres = pd.Series(tipo.categories, dtype=object)
+
+    extranjera = nombres.isin(TIENDAS_EXTRANJERAS)
+    dimension = pd.DataFrame({
+        'id_tienda': np.arange(n_tiendas, dtype='int32'),
+        'NombreTPV': tienda,
+        'Es_Online': marcar_online(tienda),
+        'País': np.where(extranjera, PAIS_ITALIA, PAIS_ESPANA),
+    })
+    dimension['Canal'] = dimension['Es_Online'].map({True: 'Online', False: 'Física'})
+
+    incremental = delta is not None and _es_ampliacion(previa, 'NombreTPV', tipo, 'Fecha Zona', 'Importe')
+    ventas = delta if incremental else tablas.get(HOJA_VENTAS)
+    zonas = pd.Series(np.nan, index=dimension.index, dtype=object)
+    fechas_zona = pd.Series(pd.NaT, index=dimension.index)
+    importe = previa['Importe'].reindex(np.arange(n_tiendas), fill_value=0).to_numpy() if incremental else np.zeros(n_tiendas)
+    if ventas is not None and 'NombreTPV' in ventas.columns:
+        codigos = ventas['NombreTPV'].cat.codes.to_numpy()
+        con_tienda = codigos >= 0
+        if 'Zona geográfica' in ventas.columns:
+            ultimas = _ultimas(
+                ventas[ventas['Zona geográfica'].notna()], 'NombreTPV', ['Zona geográfica'], n_tiendas,
+                previa if incremental else None, 'Fecha Zona'
+            )
+            zonas = ultimas['Zona geográfica']
+            if 'Fecha Documento' in ultimas.columns:
+                fechas_zona = ultimas['Fecha Documento']
+        if 'Subtotal' in ventas.columns:
+            subtotal = ventas['Subtotal'].fillna(0).to_numpy(dtype=float)
+            importe = importe + np.bincount(codigos[con_tienda], weights=subtotal[con_tienda], minlength=n_tiendas)
+    dimension['Zona geográfica'] = zonas
+    dimension['Fecha Zona'] = fechas_zona
+
+    # Italia: ciudad en el nombre de la tienda COIN (Milán por defecto); España: por zona
+    ciudad_italia = nombres.str.extract(r'I\d{3}COIN([A-Z]+)')[0].fillna('MILANO')
+    dimension['Ciudad'] = ciudad_italia.where(extranjera, _ciudad_espana(nombres, zonas))
+    coordenadas = [
+        (COORDENADAS_ITALIA if es_extranjera else COORDENADAS_ESPANA).get(ciudad, (None, None))
+        for ciudad, es_extranjera in zip(dimension['Ciudad'], extranjera)
+    ]
+    dimension['lat'] = pd.to_numeric(pd.Series([c[0] for c in coordenadas]), errors='coerce')
+    dimension['lon'] = pd.to_numeric(pd.Series([c[1] for c in coordenadas]), errors='coerce')
+
+    dimension['Importe'] = importe
+    dimension['Ranking'] = pd.Series(-importe).rank(method='first').astype('int32')
+    return dimension
+
+
+# ===== Descripciones de producto =====
+
+COLUMNAS_DESCRIPCION = ['MANGA', 'CUELLO', 'TEJIDO', 'DETALLE', 'ESTILO', 'CORTE']
+DESCRIPCION_COMPLETA = "Descripción Completa"
+TIPOS_DESCRIPCION = [DESCRIPCION_COMPLETA] + COLUMNAS_DESCRIPCION
+
+
+def indice_descripciones(df_desc):
+    """
+    Descripción analizada y su longitud por ACT de descripción para cada tipo de
+    TIPOS_DESCRIPCION ({tipo: DataFrame ACT, Descripción Analizada, longitud_desc}).
+    Los tipos cuyas columnas no están en el fichero no aparecen en el índice.
+    """
+    indice = {}
+    if 'ACT' not in df_desc.columns:
+        return indice
+    existentes = [col for col in COLUMNAS_DESCRIPCION if col in df_desc.columns]
+    variantes = {col: df_desc[col].fillna('N/A') for col in existentes}
+    if existentes:
+        # Todas las columnas de descripción unidas con un solo espacio
+        variantes[DESCRIPCION_COMPLETA] = (
+            df_desc[existentes].fillna('').agg(' '.join, axis=1).str.replace(' +', ' ', regex=True).str.strip()
+        )
+    for tipo, descripcion in variantes.items():
+        indice[tipo] = pd.DataFrame({
+            'ACT': df_desc['ACT'],
+            'Descripción Analizada': descripcion,
+            'longitud_desc': descripcion.str.len(),
+        }).dropna()
+    if not existentes:
+        indice[DESCRIPCION_COMPLETA] = pd.DataFrame({
+            'ACT': df_desc['ACT'], 'Descripción Analizada': 'N/A', 'longitud_desc': 0
+        }).dropna()
+    return indice
+
+
+def leer_descripciones(ruta):
+    """Índice de descripciones (indice_descripciones) del Excel de descripciones"""
+    return indice_descripciones(pd.read_excel(ruta, engine='openpyxl'))
@@ -26,6 +26,8 @@ from sklearn.cluster import KMeans
 from sklearn.model_selection import TimeSeriesSplit, cross_val_score
 from sklearn.ensemble import RandomForestRegressor
 import warnings
+
+from calculos import vendido_fuera_temporada
 warnings.filterwarnings('ignore')
 
 # Prepare Data - IMPROVED VERSION
@@ -48,6 +50,10 @@ def prepare_final_dataset_improved(df, meses_futuros=None):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
 
+    # In/out of season flag from the shared season-window engine when the input lacks it
+    if 'vendido_fuera_temporada' not in df.columns:
+        df['vendido_fuera_temporada'] = vendido_fuera_temporada(df['Temporada'], df['ds'])
+
     # Handle season data
     df['Temporada'] = df['Temporada'].fillna('Unknown_Season').astype(str)
     df['Season'] = df['Temporada'].str[0].str.upper()
@@ -0,0 +1,212 @@
+"""
+Caché en memoria de los agregados de cada sección del dashboard y precalentamiento
+en segundo plano.
+
+Los agregados se guardan por (versión del dataset, filtros, sección). La versión
+identifica el dataset ya filtrado por temporada (digest + temporada). El cubo de
+ventas, la rotación por venta, los índices de filtrado y los rankings de cada versión
+también se guardan aquí, igual que los resultados de las funciones decoradas con por_version. Tras subir un
+libro, un hilo calcula las tres secciones con los filtros por defecto, de modo que
+la primera visita a cualquier sección encuentra el resultado hecho. Si el usuario
+llega a una sección mientras el hilo la está calculando, espera a ese cálculo en
+lugar de repetirlo. La caché se acota por número de entradas y por bytes. Los
+resultados se comparten entre sesiones: no deben modificarse.
+"""
+
+import functools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from calculos import (
+    SECCION_RESUMEN, SECCIONES, agregados_seccion, clave_filtros, construir_cubo, construir_indice, extremos,
+    filtros_por_defecto, filtrar_cubo, filtrar_ventas, rotacion_por_venta
+)
+
+MAX_ENTRADAS = int(os.environ.get("TRUCCO_AGREGADOS_MAX", "48"))
+PRESUPUESTO_BYTES = int(os.environ.get("TRUCCO_AGREGADOS_MB", "1024")) * 1024 * 1024
+
+_entradas = OrderedDict()
+_tamanos = {}
+_bloqueo = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precalculo")
+
+
+def _tamano(valor):
+    """Bytes aproximados de un resultado: DataFrames, Series y arrays, también dentro de tuplas, listas o dicts"""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(index=True))
+    if isinstance(valor, pd.Index):
+        return int(valor.memory_usage())
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, dict):
+        return sum(_tamano(v) for v in valor.values())
+    if isinstance(valor, (tuple, list)):
+        return sum(_tamano(v) for v in valor)
+    return 0
+
+
+def _recortar(conservar):
+    """
+    Expulsa las entradas menos usadas hasta cumplir MAX_ENTRADAS y PRESUPUESTO_BYTES,
+    sin tocar la entrada conservar. Se llama con _bloqueo tomado.
+    """
+    total = sum(_tamanos.values())
+    for clave in list(_entradas):
+        if len(_entradas) <= MAX_ENTRADAS and total <= PRESUPUESTO_BYTES:
+            break
+        if clave != conservar:
+            del _entradas[clave]
+            total -= _tamanos.pop(clave, 0)
+
+
+def obtener(clave, funcion, *args):
+    """
+    Resultado de funcion(*args) cacheado por clave (LRU de MAX_ENTRADAS entradas y
+    PRESUPUESTO_BYTES bytes; el tamaño de una entrada se conoce al resolverse)
+    """
+    with _bloqueo:
+        futuro = _entradas.get(clave)
+        propio = futuro is None
+        if propio:
+            futuro = Future()
+            _entradas[clave] = futuro
+            _recortar(clave)
+        else:
+            _entradas.move_to_end(clave)
+
+    if propio:
+        try:
+            valor = funcion(*args)
+        except Exception as e:
+            futuro.set_exception(e)
+            with _bloqueo:
+                if _entradas.get(clave) is futuro:
+                    del _entradas[clave]
+        else:
+            futuro.set_result(valor)
+            tamano = _tamano(valor)
+            with _bloqueo:
+                if _entradas.get(clave) is futuro:
+                    _tamanos[clave] = tamano
+                    _recortar(clave)
+    return futuro.result()
+
+
+def indices(version, df_ventas, df_traspasos):
+    """
+    Índices de filtrado (ventas por fecha y tienda, traspasos por tienda) de la versión
+    del dataset; (None, None) sin versión o si las ventas no están ordenadas por fecha.
+    """
+    if version is None:
+        return None, None
+    return (
+        obtener((version, 'indice ventas'), construir_indice, df_ventas, 'NombreTPV', 'Fecha Documento'),
+        obtener((version, 'indice traspasos'), construir_indice, df_traspasos, 'Tienda'),
+    )
+
+
+def cubo(version, filtros, df_ventas, df_ventas_filtrado):
+    """
+    Cubo de ventas recortado a los filtros. Con versión se construye una vez sobre
+    df_ventas (el dataset de la temporada) y se recorta; sin versión se construye
+    directamente sobre las ventas ya filtradas, sin caché.
+    """
+    if version is None or filtros is None:
+        return construir_cubo(df_ventas_filtrado)
+    return filtrar_cubo(obtener((version, 'cubo'), construir_cubo, df_ventas), *filtros)
+
+
+def por_version(funcion):
+    """
+    Cachea funcion por un token de versión en vez de hashear sus DataFrames: la
+    función decorada acepta version=token y el resultado se guarda por
+    (nombre de la función, token), con los DataFrames recibidos por referencia.
+    El token debe identificar todos los argumentos; sin token no hay caché.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, version=None, **kwargs):
+        if version is None:
+            return funcion(*args, **kwargs)
+        return obtener((funcion.__qualname__, version), functools.partial(funcion, *args, **kwargs))
+    return envoltura
+
+
+def descartar(funcion):
+    """Quita de la caché los resultados de una función decorada con por_version (de todas sus versiones)"""
+    with _bloqueo:
+        for clave in [c for c in _entradas if c[0] == funcion.__qualname__]:
+            del _entradas[clave]
+            _tamanos.pop(clave, None)
+
+
+def rotacion(version, df_ventas, df_ventas_filtrado, df_productos, df_traspasos):
+    """
+    Rotación por venta (calculos.rotacion_por_venta) de las filas de df_ventas_filtrado.
+    Se calcula una vez por versión sobre df_ventas (el dataset de la temporada) y se
+    recorta a las filas filtradas; sin versión devuelve None y la sección la calcula
+    sobre las ventas filtradas.
+    """
+    if version is None or df_ventas is None:
+        return None
+    por_venta = obtener((version, 'rotacion'), rotacion_por_venta, df_ventas, df_productos, df_traspasos)
+    if por_venta is None or len(df_ventas_filtrado) == len(df_ventas):
+        return por_venta
+    return por_venta[por_venta.index.isin(df_ventas_filtrado.index)]
+
+
+def ranking(version, nombre, df, medida, k=1, por=None):
+    """
+    Top y bottom k (calculos.extremos) de df, cacheados por versión y nombre del
+    ranking; la versión debe identificar df (por ejemplo, la versión filtrada). Sin
+    versión se calcula sin caché.
+    """
+    if version is None:
+        return extremos(df, medida, k, por)
+    return obtener((version, 'ranking', nombre, medida, k, por), extremos, df, medida, k, por)
+
+
+def _agregados_seccion(version, seccion, cubo_filtrado, df_ventas, df_productos, df_traspasos, df_ventas_version):
+    por_venta = None
+    if seccion == SECCION_RESUMEN:
+        por_venta = rotacion(version, df_ventas_version, df_ventas, df_productos, df_traspasos)
+    return agregados_seccion(seccion, cubo_filtrado, df_ventas, df_productos, df_traspasos, por_venta)
+
+
+def agregados(version, filtros, seccion, cubo_filtrado, df_ventas, df_productos, df_traspasos, df_ventas_version=None):
+    """
+    Agregados de la sección; sin versión (dataset sin identificar) se calculan sin caché.
+    df_ventas_version es el dataset de la versión sin filtrar, del que se toman los
+    cálculos por dataset (rotación) en lugar de repetirlos por filtro.
+    """
+    if version is None or filtros is None:
+        return agregados_seccion(seccion, cubo_filtrado, df_ventas, df_productos, df_traspasos)
+    return obtener(
+        (version, filtros, seccion), _agregados_seccion,
+        version, seccion, cubo_filtrado, df_ventas, df_productos, df_traspasos, df_ventas_version
+    )
+
+
+def precalentar(version, df_ventas, df_productos, df_traspasos):
+    """Calcula en segundo plano las tres secciones con los filtros por defecto del sidebar"""
+    def tarea():
+        fecha_min, fecha_max, tiendas = filtros_por_defecto(df_ventas)
+        filtros = clave_filtros(fecha_min, fecha_max, tiendas)
+        indice_ventas, _ = indices(version, df_ventas, df_traspasos)
+        # Mismo recorte que aplicar_filtros: el sidebar trabaja con fechas sin hora
+        ventas = filtrar_ventas(df_ventas, filtros[0], filtros[1], tiendas, indice_ventas)
+        cubo_filtrado = cubo(version, filtros, df_ventas, ventas)
+        for seccion in SECCIONES:
+            try:
+                agregados(version, filtros, seccion, cubo_filtrado, ventas, df_productos, df_traspasos, df_ventas)
+            except Exception as e:
+                print(f"⚠️ No se pudo precalcular la sección '{seccion}': {e}")
+
+    return _pool.submit(tarea)
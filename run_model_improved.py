@@ -40,7 +40,9 @@ def main():
             print("Please ensure your data file is in the correct location")
             return
         
-        df_ventas = pd.read_excel(data_file)
+        # Shared dataset store: typed Parquet copy, reparsed only when the workbook changes
+        from datos_entrenamiento import cargar_datos_entrenamiento
+        df_ventas = cargar_datos_entrenamiento(data_file)
         print(f"✅ Data loaded: {len(df_ventas)} rows")
         
         # Step 3: Import the improved model functions
@@ -57,7 +59,6 @@ def main():
         # Step 4: Prepare the data with validation
         print("\n🔄 Preparing data with validation...")
         df = df_ventas.copy()
-        df['Fecha Documento'] = pd.to_datetime(df['Fecha Documento'], format='%d/%m/%Y', errors='coerce', dayfirst=True)
         
         # Use improved data preparation
         en_temporada, fuera_temporada, monthly = prepare_data_with_validation(df, meses_futuros=None)
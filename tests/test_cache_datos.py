@@ -0,0 +1,144 @@
+"""Pruebas de la caché en disco de los libros (publicación atómica, desalojo y digests)"""
+
+import hashlib
+import io
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache_datos  # noqa: E402
+from cache_datos import combinar_digests, digest_bytes, digest_fichero, guardar_libro, leer_libro, desalojar  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def directorio_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_datos, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _tablas(filas=3):
+    return {
+        'ventas': pd.DataFrame({'Cantidad': range(filas), 'Talla': pd.Categorical(['M'] * filas)}),
+        'traspasos': pd.DataFrame({'Enviado': [1.5] * filas}),
+    }
+
+
+def _envejecer(ruta, segundos):
+    antes = time.time() - segundos
+    os.utime(ruta, (antes, antes))
+
+
+def test_guardar_y_leer_libro(directorio_cache):
+    tablas = _tablas()
+    guardar_libro("abc", tablas)
+
+    leidas = leer_libro("abc", ['ventas', 'traspasos'])
+    for hoja, df in tablas.items():
+        pd.testing.assert_frame_equal(leidas[hoja], df)
+    assert leer_libro("abc", ['compra']) is None
+    assert leer_libro("otro", ['ventas']) is None
+    # Publicación atómica: no quedan temporales
+    assert sorted(os.listdir(directorio_cache)) == ["abc"]
+
+
+def test_guardado_fallido_no_publica_ni_deja_temporales(directorio_cache):
+    # Parquet no admite una columna object con tipos mezclados (sin preparar_para_parquet)
+    tablas = {'ventas': pd.DataFrame({'Talla': [36, 'M']})}
+    with pytest.raises(Exception):
+        guardar_libro("abc", tablas)
+
+    assert os.listdir(directorio_cache) == []
+    assert leer_libro("abc", ['ventas']) is None
+
+
+def test_guardado_concurrente_conserva_la_entrada_publicada(directorio_cache, monkeypatch):
+    guardar_libro("abc", _tablas(3))
+
+    # Otra sesión publica el mismo libro a la vez: os.replace falla y se descarta el temporal
+    def destino_ocupado(origen, destino):
+        raise OSError("el destino ya existe")
+
+    os.remove(os.path.join(directorio_cache, "abc", "hojas.json"))
+    monkeypatch.setattr(cache_datos.os, "replace", destino_ocupado)
+    guardar_libro("abc", _tablas(5))
+
+    assert sorted(os.listdir(directorio_cache)) == ["abc"]
+    assert sorted(os.listdir(directorio_cache / "abc")) == ["hoja_0.parquet", "hoja_1.parquet"]
+
+
+def test_desalojar_elimina_las_menos_usadas(directorio_cache):
+    for i, digest in enumerate(["vieja", "media", "nueva"]):
+        guardar_libro(digest, _tablas())
+        _envejecer(os.path.join(directorio_cache, digest), 300 - i * 100)
+    tamano = cache_datos._tamano_entrada(os.path.join(directorio_cache, "nueva"))
+
+    desalojar(limite=2 * tamano, proteger="vieja")
+    assert sorted(os.listdir(directorio_cache)) == ["nueva", "vieja"]
+
+    # Leer una entrada la marca como usada: se desaloja la otra
+    leer_libro("vieja", ['ventas'])
+    desalojar(limite=tamano)
+    assert os.listdir(directorio_cache) == ["vieja"]
+
+
+def test_desalojar_barre_temporales_de_guardados_interrumpidos(directorio_cache):
+    abandonado = directorio_cache / ".tmp-abandonado"
+    en_curso = directorio_cache / ".tmp-en-curso"
+    for ruta in (abandonado, en_curso):
+        ruta.mkdir()
+        (ruta / "hoja_0.parquet").write_bytes(b"x")
+    _envejecer(abandonado, cache_datos._EDAD_TEMPORAL + 60)
+
+    desalojar()
+
+    assert sorted(os.listdir(directorio_cache)) == [".tmp-en-curso"]
+
+
+class _Lector:
+    """Objeto con solo read/seek/tell, como un fichero abierto"""
+
+    def __init__(self, data):
+        self._buffer = io.BytesIO(data)
+        self.read, self.seek, self.tell = self._buffer.read, self._buffer.seek, self._buffer.tell
+
+
+def test_digest_igual_para_ruta_buffer_y_lector(tmp_path):
+    data = bytes(range(256)) * 5000
+    ruta = tmp_path / "libro.xlsx"
+    ruta.write_bytes(data)
+    esperado = hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    assert digest_bytes(data) == esperado
+    assert digest_fichero(str(ruta)) == esperado
+    assert digest_fichero(ruta, bloque=7) == esperado
+    assert digest_fichero(io.BytesIO(data), bloque=1000) == esperado
+    lector = _Lector(data)
+    lector.seek(10)
+    assert digest_fichero(lector) == esperado
+    # El lector vuelve a su posición
+    assert lector.tell() == 10
+    assert digest_fichero(io.BytesIO(data + b"x")) != esperado
+
+
+def test_digest_estable_entre_procesos():
+    # A diferencia de hash(), el digest no depende de la semilla del proceso
+    codigo = "from cache_datos import digest_bytes, combinar_digests; print(digest_bytes(b'libro'), combinar_digests('a', 'b'))"
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for semilla in ("1", "2"):
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=raiz, capture_output=True, text=True, check=True,
+            env={**os.environ, "PYTHONHASHSEED": semilla}
+        ).stdout
+        assert salida.split()[-2:] == [digest_bytes(b"libro"), combinar_digests("a", "b")]
+
+
+def test_combinar_digests_depende_del_orden():
+    assert combinar_digests("a", "b") == combinar_digests("a", "b")
+    assert combinar_digests("a", "b") != combinar_digests("b", "a")
+    assert combinar_digests("a", "b", "c") != combinar_digests("a", "b")
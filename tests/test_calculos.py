@@ -0,0 +1,425 @@
+"""Pruebas de equivalencia de los motores de calculos con la lógica fila a fila del dashboard original"""
+
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calculos import (  # noqa: E402
+    comparacion_temas, construir_cubo, construir_indice, extremos, filtrar_traspasos, filtrar_ventas,
+    linea_temporal_almacen, rotacion_por_venta, vendido_fuera_temporada
+)
+from dashboard import preprocess_ventas_data  # noqa: E402
+from ingesta import HOJA_COMPRA, HOJA_TRASPASOS, HOJA_VENTAS, aplicar_esquema, clave_talla, codificar_claves  # noqa: E402
+
+
+def _tablas():
+    """Libro pequeño codificado como en la ingesta: devoluciones, rebajas, tallas y zonas vacías"""
+    ventas = pd.DataFrame([
+        # Fecha, tienda, ACT, talla, temporada, familia, zona, cantidad, subtotal, pvp, coste
+        ['03/01/2025', 'ET1-MADRID', 'ACT000000000001A', 'M', 'I2025', 'CAMISA', 'MADRID', 2, 30.0, 20.0, 6.0],
+        ['03/01/2025', 'ET1-MADRID', 'ACT000000000001A', 'M', 'I2025', 'CAMISA', 'MADRID', 1, 20.0, 20.0, 6.0],
+        ['03/01/2025', 'ET1-MADRID', 'ACT000000000001A', 'M', 'I2025', 'CAMISA', 'MADRID', -1, -15.0, 20.0, 6.0],
+        ['20/02/2025', 'ET2-SEVILLA', 'ACT000000000002B', 'L', 'V2025', 'PANTALON', None, 1, 40.0, 40.0, 12.0],
+        ['20/02/2025', 'ET2-SEVILLA', 'ACT000000000002B', None, 'V2025', 'PANTALON', None, 3, 90.0, 40.0, 12.0],
+        ['15/03/2025', 'TIENDA ONLINE', 'ACT000000000001A', 'S', 'V2025', 'CAMISA', 'ONLINE', 1, 18.0, 20.0, 6.0],
+        ['15/03/2025', 'TIENDA ONLINE', 'ACT000000000001A', 'S', 'V2025', 'CAMISA', 'ONLINE', -2, -36.0, 20.0, 6.0],
+        ['01/07/2025', 'ET1-MADRID', 'ACT000000000003C', '38', None, None, 'MADRID', 4, 100.0, 30.0, 9.0],
+        ['01/07/2025', 'ET2-SEVILLA', 'ACT000000000003C', '38', 'V2025', None, None, 0, 0.0, 30.0, 9.0],
+    ], columns=['Fecha Documento', 'NombreTPV', 'ACT', 'Talla', 'Temporada', 'Descripción Familia',
+                'Zona geográfica', 'Cantidad', 'Subtotal', 'precio_pvp', 'Precio Coste'])
+    compra = pd.DataFrame([
+        ['ACT000000000001A', 'M', 'T_OI25_A', '01/12/2024', 10],
+        ['ACT000000000001A', 'S', 'T_PV25_B', '01/02/2025', 5],
+        ['ACT000000000002B', 'L', 'T_PV25_C', '01/02/2025', 4],
+    ], columns=['ACT', 'Talla', 'Tema', 'Fecha REAL entrada en almacén', 'Cantidad Pedida'])
+    traspasos = pd.DataFrame([
+        ['ACT000000000001A', 'M', 'ET1-MADRID', 'I2025', '02/01/2025', 3],
+        ['ACT000000000001A', 'S', 'TIENDA ONLINE', 'V2025', '10/03/2025', 2],
+        ['ACT000000000002B', 'L', 'ET2-SEVILLA', 'V2025', '10/02/2025', 2],
+    ], columns=['ACT', 'Talla', 'Tienda', 'Temporada', 'Fecha Enviado', 'Enviado'])
+    tablas = {HOJA_VENTAS: ventas, HOJA_COMPRA: compra, HOJA_TRASPASOS: traspasos}
+    return codificar_claves({hoja: aplicar_esquema(df, hoja) for hoja, df in tablas.items()})
+
+
+def _canonica():
+    return preprocess_ventas_data(_tablas()[HOJA_VENTAS])
+
+
+def test_cubo_coincide_con_los_agregados_sobre_filas():
+    ventas = _canonica()
+    cubo = construir_cubo(ventas)
+
+    # El cubo tiene menos filas y conserva las de talla, zona y temporada vacías
+    assert len(cubo) < len(ventas)
+    for medida in ['Cantidad', 'Ventas Dinero']:
+        assert cubo[medida].sum() == ventas[medida].sum()
+
+    # Agregados del dashboard original sobre las filas de venta
+    for claves in (['Mes', 'NombreTPV'], ['Familia', 'Talla'], ['Zona geográfica', 'Es_Online'], ['Temporada']):
+        esperado = ventas.groupby(claves, observed=True)[['Cantidad', 'Ventas Dinero']].sum()
+        obtenido = cubo.groupby(claves, observed=True)[['Cantidad', 'Ventas Dinero']].sum()
+        pd.testing.assert_frame_equal(obtenido, esperado)
+
+    devoluciones = ventas[ventas['Cantidad'] < 0]
+    pd.testing.assert_series_equal(
+        cubo[cubo['Cantidad Devuelta'] < 0].groupby('Familia', observed=True)['Cantidad Devuelta'].sum(),
+        devoluciones.groupby('Familia', observed=True)['Cantidad'].sum(),
+        check_names=False
+    )
+    assert cubo['Dinero Devuelto'].sum() == devoluciones['Ventas Dinero'].sum()
+    assert cubo['Cantidad Vendida'].sum() == ventas.loc[ventas['Cantidad'] > 0, 'Cantidad'].sum()
+
+    # Rebajas como en el original: subtotal positivo con precio de venta por debajo del P.V.P.
+    vendidas = ventas[ventas['Subtotal'] > 0]
+    rebajadas = vendidas[vendidas['Subtotal'] / vendidas['Cantidad'] < vendidas['precio_pvp']]
+    assert cubo['Subtotal Positivo'].sum() == vendidas['Subtotal'].sum()
+    for meses in ([1, 6], [2, 7]):
+        assert (
+            cubo.loc[cubo['mes'].isin(meses), 'Subtotal Rebajado'].sum()
+            == rebajadas.loc[rebajadas['mes'].isin(meses), 'Subtotal'].sum()
+        )
+    assert np.isclose(cubo['Coste'].sum(), (ventas['Precio Coste'] * ventas['Cantidad']).sum())
+
+
+def test_filtros_con_indice_coinciden_con_las_mascaras():
+    ventas = _canonica()
+    # Una venta sin tienda: el corte por fechas ya no basta aunque se elijan todas
+    ventas.loc[ventas.index[3], 'NombreTPV'] = np.nan
+    indice = construir_indice(ventas, 'NombreTPV', 'Fecha Documento')
+    assert indice['sin_tienda'] == 1
+
+    todas = list(ventas['NombreTPV'].cat.categories)
+    rangos = [
+        ('2025-01-01', '2025-12-31'),
+        (datetime.date(2025, 1, 3), datetime.date(2025, 3, 15)),  # extremos con ventas, incluidos
+        ('2025-01-04', '2025-02-19'),  # sin ventas
+    ]
+    selecciones = [todas, ['ET2-SEVILLA'], ['TIENDA ONLINE', 'ET1-MADRID'], ['NO EXISTE'], []]
+    for inicio, fin in rangos:
+        for tiendas in selecciones:
+            pd.testing.assert_frame_equal(
+                filtrar_ventas(ventas, inicio, fin, tiendas, indice),
+                filtrar_ventas(ventas, inicio, fin, tiendas)
+            )
+
+    # Sin filas sin tienda y con todas las tiendas, el filtro es un corte por fechas
+    completas = _canonica()
+    indice = construir_indice(completas, 'NombreTPV', 'Fecha Documento')
+    pd.testing.assert_frame_equal(
+        filtrar_ventas(completas, '2025-02-01', '2025-07-01', todas, indice),
+        filtrar_ventas(completas, '2025-02-01', '2025-07-01', todas)
+    )
+
+    # Sin ordenar por fecha no hay índice y los filtros usan las máscaras
+    assert construir_indice(completas.iloc[::-1], 'NombreTPV', 'Fecha Documento') is None
+
+
+def test_filtro_de_traspasos_con_indice_coincide_con_la_mascara():
+    traspasos = _tablas()[HOJA_TRASPASOS].iloc[[2, 0, 1, 0]]  # desordenados y con una fila repetida
+    indice = construir_indice(traspasos, 'Tienda')
+    for tiendas in (['ET1-MADRID'], ['TIENDA ONLINE', 'ET2-SEVILLA'], ['NO EXISTE'], []):
+        pd.testing.assert_frame_equal(
+            filtrar_traspasos(traspasos, tiendas, indice),
+            filtrar_traspasos(traspasos, tiendas)
+        )
+
+
+def _fuera_temporada_fila(temporada, fecha):
+    """Clasificación fila a fila del dashboard original (apply por fila)"""
+    if not isinstance(temporada, str) or len(temporada) < 5:
+        return 1
+    tipo_temporada = temporada[0]
+    ano_temporada_str = temporada[1:]
+    if tipo_temporada not in ['I', 'V'] or not ano_temporada_str.isdigit():
+        return 1
+    ano_temporada = int(ano_temporada_str)
+    if tipo_temporada == 'I':
+        inicio = pd.Timestamp(year=ano_temporada - 1, month=9, day=1)
+        fin = pd.Timestamp(year=ano_temporada, month=2, day=28)
+    else:
+        inicio = pd.Timestamp(year=ano_temporada, month=3, day=1)
+        fin = pd.Timestamp(year=ano_temporada, month=8, day=31)
+    return 0 if inicio <= fecha <= fin else 1
+
+
+def test_fuera_de_temporada_coincide_con_la_clasificacion_por_fila():
+    # Invierno cruza el cambio de año (septiembre a febrero); fechas en los bordes de cada ventana
+    fechas = pd.to_datetime([
+        '2024-08-31', '2024-09-01', '2024-12-31', '2025-01-01', '2025-02-28', '2025-02-28 10:00:00', '2025-03-01',
+        '2025-08-31', '2025-09-01', '2024-02-29', '2025-01-15', '2025-01-15', '2025-01-15', '2025-01-15', None,
+    ], format='ISO8601')
+    temporadas = [
+        'I2025', 'I2025', 'I2025', 'I2025', 'I2025', 'I2025', 'V2025',
+        'V2025', 'V2025', 'I2024', 'I2026', 'X2025', 'I20A5', 'I25', 'I2025',
+    ]
+    esperado = [_fuera_temporada_fila(t, f) for t, f in zip(temporadas, fechas)]
+    assert esperado[:9] == [1, 0, 0, 0, 0, 1, 0, 0, 1]
+
+    assert vendido_fuera_temporada(temporadas, fechas).tolist() == esperado
+    # Como en el cubo: temporadas categóricas con vacíos, que cuentan como fuera de temporada
+    categoricas = pd.Series(temporadas + [None], dtype='category')
+    con_vacia = pd.Series(fechas.append(pd.DatetimeIndex(['2025-01-15'])))
+    assert vendido_fuera_temporada(categoricas, con_vacia).tolist() == esperado + [1]
+
+
+def _codificar(ventas, compra, traspasos):
+    tablas = {HOJA_VENTAS: ventas, HOJA_COMPRA: compra, HOJA_TRASPASOS: traspasos}
+    return codificar_claves({hoja: aplicar_esquema(df, hoja) for hoja, df in tablas.items()})
+
+
+def _ventas_rotacion(filas):
+    return pd.DataFrame(
+        [fila + ['CAMISA', 1, 10.0] for fila in filas],
+        columns=['Fecha Documento', 'NombreTPV', 'ACT', 'Talla', 'Temporada', 'Descripción Familia', 'Cantidad', 'Subtotal']
+    )
+
+
+def test_rotacion_coincide_con_el_cruce_completo_filtrado():
+    # AAAAAAAAAAAAAA01 y AAAAAAAAAAAAAA02 comparten ACT_14
+    compra = pd.DataFrame([
+        ['AAAAAAAAAAAAAA01', 'M', '01/01/2025'],
+        ['AAAAAAAAAAAAAA02', 'M', '01/03/2025'],
+        ['AAAAAAAAAAAAAA01', 'M', '01/03/2025'],  # empate con la anterior
+        ['AAAAAAAAAAAAAA01', 'L', None],
+        ['BBBBBBBBBBBBBB01', 'M', '15/02/2025'],
+    ], columns=['ACT', 'Talla', 'Fecha REAL entrada en almacén'])
+    traspasos = pd.DataFrame([
+        ['AAAAAAAAAAAAAA01', 'M', 'T1', '05/01/2025', 1],
+        ['AAAAAAAAAAAAAA01', 'M', 'T1', '05/01/2025', 1],  # envío repetido
+        ['AAAAAAAAAAAAAA01', 'M', 'T2', None, 1],
+        ['AAAAAAAAAAAAAA01', 'L', 'T1', '01/01/2025', 1],
+        ['BBBBBBBBBBBBBB01', 'M', 'T2', '20/03/2025', 1],
+    ], columns=['ACT', 'Talla', 'Tienda', 'Fecha Enviado', 'Enviado'])
+    ventas = _ventas_rotacion([
+        ['10/01/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],
+        ['01/03/2025', 'T1', 'AAAAAAAAAAAAAA02', 'M', 'V2025'],  # el mismo día de la entrada
+        ['04/01/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],  # antes del envío
+        ['10/03/2025', 'T2', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],  # envío sin fecha
+        ['10/03/2025', 'T1', 'AAAAAAAAAAAAAA01', 'L', 'V2025'],  # entrada sin fecha
+        ['25/03/2025', 'T2', 'BBBBBBBBBBBBBB01', 'M', 'V2025'],
+        ['10/02/2025', 'T2', 'BBBBBBBBBBBBBB01', 'M', 'V2025'],  # antes de la entrada
+        ['15/03/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'I2024'],  # campaña sin rotación
+        ['20/12/2024', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],
+        ['10/04/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'I2025'],
+    ])
+    tablas = _codificar(ventas, compra, traspasos)
+    ventas = preprocess_ventas_data(tablas[HOJA_VENTAS])
+    productos, traspasos = tablas[HOJA_COMPRA], tablas[HOJA_TRASPASOS]
+
+    # Cruce muchos a muchos del dashboard original, reducido a una fila por venta: la
+    # última entrada no posterior a la venta, si la tienda ya tenía un envío
+    rotables = ventas[ventas['Temporada'].isin(['V2025', 'I2025'])].rename_axis('fila').reset_index()
+    entradas = rotables.merge(productos[['ACT_14', 'Talla', 'Fecha REAL entrada en almacén']], on=['ACT_14', 'Talla'])
+    entradas = entradas[entradas['Fecha REAL entrada en almacén'] <= entradas['Fecha Documento']]
+    ultima_entrada = entradas.groupby('fila')['Fecha REAL entrada en almacén'].max()
+    envios = rotables.merge(
+        traspasos[['ACT_14', 'Talla', 'Tienda', 'Fecha Enviado']].rename(columns={'Tienda': 'NombreTPV'}),
+        on=['ACT_14', 'Talla', 'NombreTPV']
+    )
+    con_envio = envios.loc[envios['Fecha Enviado'] <= envios['Fecha Documento'], 'fila'].unique()
+    filas = ultima_entrada.index.intersection(con_envio).sort_values()
+    esperado = ventas.loc[filas, ['NombreTPV', 'ACT_14', 'Descripción Familia']]
+    esperado['Dias_Rotacion'] = (ventas.loc[filas, 'Fecha Documento'] - ultima_entrada[filas]).dt.days
+    esperado = esperado.sort_index()
+
+    obtenido = rotacion_por_venta(ventas, productos, traspasos).sort_index()
+    pd.testing.assert_frame_equal(obtenido, esperado, check_names=False)
+    assert sorted(obtenido['Dias_Rotacion']) == [0, 9, 38, 40]
+
+    # Sin fechas de entrada en almacén no hay rotación
+    assert rotacion_por_venta(ventas, productos.drop(columns='Fecha REAL entrada en almacén'), traspasos) is None
+
+
+def _linea_temporal_fila(df_almacen, df_traspasos, df_ventas):
+    """Tabla del dashboard original: un recorrido de las ventas por cada par entrada/envío"""
+    merged = pd.merge(df_almacen, df_traspasos, on=['ACT_14', 'Talla'], suffixes=('_almacen', '_traspaso'))
+    merged = merged[merged['Fecha Enviado'] >= merged['Fecha REAL entrada en almacén']]
+    filas = []
+    for _, row in merged.iterrows():
+        fecha_entrada = row['Fecha REAL entrada en almacén']
+        fecha_envio = row['Fecha Enviado']
+        act = row['ACT_almacen'].strip()
+        talla = row['Talla'].strip()
+        ventas_producto = df_ventas[
+            (df_ventas['ACT'].str.strip() == act) &
+            (df_ventas['Talla'].str.strip() == talla) &
+            (df_ventas['NombreTPV'].str.strip() == row['Tienda'].strip()) &
+            (df_ventas['Fecha Documento'] >= fecha_entrada) &
+            (df_ventas['Cantidad'] > 0)
+        ]
+        fecha_primera_venta = None
+        if not ventas_producto.empty:
+            fecha_primera_venta = ventas_producto.loc[ventas_producto['Fecha Documento'].idxmin(), 'Fecha Documento']
+        filas.append({
+            'ACT': act,
+            'Tema': row['Tema'],
+            'Talla': talla,
+            'Tienda Envío': row['Tienda'],
+            'Fecha Entrada Almacén': fecha_entrada,
+            'Fecha Enviado': fecha_envio.strftime('%d/%m/%Y'),
+            'Fecha Primera Venta': fecha_primera_venta.strftime('%d/%m/%Y') if fecha_primera_venta else "Sin ventas",
+            'Días Entrada-Envío': (fecha_envio - fecha_entrada).days,
+            'Días Entrada-Primera Venta': (fecha_primera_venta - fecha_entrada).days if fecha_primera_venta else -1,
+        })
+    linea = pd.DataFrame(filas).sort_values('Fecha Entrada Almacén', ascending=False, kind='stable')
+    linea['Fecha Entrada Almacén'] = linea['Fecha Entrada Almacén'].dt.strftime('%d/%m/%Y')
+    return linea
+
+
+def test_linea_temporal_coincide_con_el_recorrido_por_pares():
+    compra = pd.DataFrame([
+        ['AAAAAAAAAAAAAA01 ', 'M', 'T_PV25_X', '01/02/2025'],  # espacio final en el ACT
+        ['AAAAAAAAAAAAAA01', 'M', 'T_PV25_Y', '01/02/2025'],   # misma fecha de entrada
+        ['AAAAAAAAAAAAAA02', 'M', 'T_PV25_Z', '10/03/2025'],
+        ['BBBBBBBBBBBBBB01', 'L', 'T_OI25_X', '15/01/2025'],
+    ], columns=['ACT', 'Talla', 'Tema', 'Fecha REAL entrada en almacén'])
+    traspasos = pd.DataFrame([
+        ['AAAAAAAAAAAAAA01', 'M', 'T1', '05/02/2025', 1],
+        ['AAAAAAAAAAAAAA01', 'M', 'T2 ', '06/02/2025', 1],  # espacio final en la tienda
+        ['AAAAAAAAAAAAAA02', 'M', 'T1', '01/03/2025', 1],   # anterior a la entrada de su ACT
+        ['BBBBBBBBBBBBBB01', 'L', 'T1', '20/01/2025', 1],
+    ], columns=['ACT', 'Talla', 'Tienda', 'Fecha Enviado', 'Enviado'])
+    ventas = _ventas_rotacion([
+        ['10/02/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],
+        ['08/02/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],
+        ['07/02/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],  # devolución
+        ['20/01/2025', 'T1', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],  # anterior a la entrada
+        ['12/02/2025', 'T2', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],
+        ['12/02/2025', 'T2', 'AAAAAAAAAAAAAA01', 'M', 'V2025'],  # empate en la primera venta
+        ['01/03/2025', 'T1', 'AAAAAAAAAAAAAA02', 'M', 'V2025'],
+    ]).assign(Cantidad=[1, 1, -1, 1, 2, 1, 1])
+    tablas = _codificar(ventas, compra, traspasos)
+    almacen, traspasos = tablas[HOJA_COMPRA], tablas[HOJA_TRASPASOS]
+    ventas = preprocess_ventas_data(tablas[HOJA_VENTAS])
+
+    obtenido = linea_temporal_almacen(almacen, traspasos, ventas)
+    esperado = _linea_temporal_fila(almacen, traspasos, ventas)
+    pd.testing.assert_frame_equal(obtenido.reset_index(drop=True), esperado.reset_index(drop=True))
+    # Las entradas del mismo día conservan el orden del cruce
+    assert obtenido['Tema'].tolist() == ['T_PV25_X'] * 3 + ['T_PV25_Y'] * 3 + ['T_OI25_X']
+    assert obtenido['Fecha Primera Venta'].iloc[[0, 1, 2, 6]].tolist() == [
+        '08/02/2025', '12/02/2025', '08/02/2025', "Sin ventas"
+    ]
+
+    # Sin envíos posteriores a alguna entrada, tabla vacía
+    assert linea_temporal_almacen(almacen.iloc[[2]], traspasos.iloc[[2]], ventas).empty
+
+
+def _comparacion_tema_fila(df_almacen, df_ventas, cantidad_col, tema):
+    """Gráfico enviado vs ventas y pivot de un tema como en el dashboard original (texto, un filtrado por tema)"""
+    temporada = {'T_OI25': 'I2025', 'T_PV25': 'V2025'}.get(tema)
+    datos_tema = df_almacen[df_almacen['Tema_6'] == tema]
+    comparacion = None
+    if temporada:
+        ventas_temporada = df_ventas[df_ventas['Temporada'] == temporada]
+        ventas_tema = ventas_temporada[ventas_temporada['ACT'].isin(datos_tema['ACT_14'].unique())]
+        if not ventas_tema.empty:
+            comparacion = pd.merge(
+                datos_tema.groupby('Talla')[cantidad_col].sum().reset_index(),
+                ventas_tema.groupby('Talla')['Cantidad'].sum().reset_index(),
+                on='Talla',
+                how='outer'
+            ).fillna(0).sort_values('Talla', key=lambda x: x.map(clave_talla))
+    pivot = (
+        datos_tema.groupby(['Mes Entrada', 'Talla'])[cantidad_col].sum().reset_index()
+        .rename(columns={cantidad_col: 'Cantidad Entrada Almacén'})
+        .pivot_table(index='Mes Entrada', columns='Talla', values='Cantidad Entrada Almacén', fill_value=0)
+        .round(0)
+    )
+    return temporada, comparacion, pivot[sorted(pivot.columns, key=clave_talla)]
+
+
+def test_comparacion_temas_coincide_con_el_calculo_por_tema():
+    # CCCCCCCCCCCCCC tiene 14 caracteres: las ventas se cruzan por ACT con el ACT_14 del almacén
+    compra = pd.DataFrame([
+        ['CCCCCCCCCCCCCC', 'M', 'T_PV25_A', '01/02/2025', 10],
+        ['CCCCCCCCCCCCCC', 'S', 'T_PV25_A', '15/02/2025', 5],
+        ['CCCCCCCCCCCCCC', 'M', 'T_PV25_B', '01/03/2025', 2],
+        ['DDDDDDDDDDDDDD', '38', 'T_OI25_A', '01/09/2024', 7],
+        ['EEEEEEEEEEEEEE', 'L', None, '01/10/2024', 3],   # sin tema: cuenta como 'nan'
+        ['EEEEEEEEEEEEEE', 'XS', 'OTRO_TEMA', '01/10/2024', 4],
+    ], columns=['ACT', 'Talla', 'Tema', 'Fecha REAL entrada en almacén', 'Cantidad Pedida'])
+    ventas = _ventas_rotacion([
+        ['10/03/2025', 'T1', 'CCCCCCCCCCCCCC', 'M', 'V2025'],
+        ['11/03/2025', 'T1', 'CCCCCCCCCCCCCC', 'L', 'V2025'],   # talla sin entradas del tema
+        ['12/03/2025', 'T2', 'CCCCCCCCCCCCCC', 'M', 'I2025'],   # otra temporada
+        ['10/10/2024', 'T1', 'DDDDDDDDDDDDDD01', '38', 'I2025'],  # ACT de 16: no cruza con el ACT_14
+        ['11/10/2024', 'T1', 'EEEEEEEEEEEEEE', 'L', 'I2025'],
+    ]).assign(Cantidad=[2, 1, 5, 3, 1])
+    traspasos = pd.DataFrame(columns=['ACT', 'Talla', 'Tienda', 'Fecha Enviado', 'Enviado'])
+    tablas = _codificar(ventas, compra, traspasos)
+    almacen = tablas[HOJA_COMPRA]
+    almacen['Mes Entrada'] = almacen['Fecha REAL entrada en almacén'].dt.to_period('M').astype(str)
+    ventas = preprocess_ventas_data(tablas[HOJA_VENTAS])
+    assert almacen['Tema_6'].isna().sum() == 1
+
+    resultado = comparacion_temas(almacen, ventas, 'Cantidad Pedida')
+
+    # El original trabajaba sobre texto: Tema_6 sacado con astype(str) del Tema de read_excel
+    # (vacíos como NaN), así que el vacío es 'nan'
+    texto = almacen.astype({col: object for col in ['ACT_14', 'Talla']}).assign(
+        Tema_6=almacen['Tema'].fillna(np.nan).astype(str).str[:6]
+    )
+    ventas_texto = ventas.astype({col: object for col in ['ACT', 'Talla', 'Temporada']})
+    assert sorted(resultado) == sorted(texto['Tema_6'].unique()) == ['OTRO_T', 'T_OI25', 'T_PV25', 'nan']
+    for tema, calculado in resultado.items():
+        temporada, comparacion, pivot = _comparacion_tema_fila(texto, ventas_texto, 'Cantidad Pedida', tema)
+        assert calculado['temporada'] == temporada
+        if comparacion is None:
+            assert calculado['comparacion'] is None
+        else:
+            pd.testing.assert_frame_equal(
+                calculado['comparacion'].astype({'Talla': object}).reset_index(drop=True),
+                comparacion.reset_index(drop=True),
+                check_dtype=False
+            )
+        pd.testing.assert_frame_equal(
+            calculado['pivot'].set_axis(calculado['pivot'].columns.astype(object).rename('Talla'), axis=1),
+            pivot,
+            check_dtype=False
+        )
+    assert resultado['T_PV25']['comparacion']['Talla'].astype(str).tolist() == ['S', 'M', 'L']
+    assert resultado['T_OI25']['comparacion'] is None
+
+
+def _ranking_empates():
+    """Medida con empates dentro y entre grupos, un vacío y una familia sin datos en el diccionario"""
+    return pd.DataFrame({
+        'Familia': pd.Categorical(
+            ['CAMISA', 'PANTALON', 'CAMISA', 'CAMISA', 'PANTALON', 'CAMISA', 'VESTIDO', 'PANTALON'],
+            categories=['ABRIGO', 'CAMISA', 'PANTALON', 'VESTIDO']
+        ),
+        'Talla': ['S', 'M', 'M', 'L', 'S', 'XL', 'M', 'L'],
+        'Cantidad': [5.0, 3.0, 5.0, 1.0, np.nan, 1.0, 2.0, 3.0],
+    }, index=[10, 3, 7, 1, 12, 5, 0, 8])
+
+
+def test_extremos_desempata_como_nlargest_y_nsmallest():
+    df = _ranking_empates()
+    for k in (1, 2, 3, 7):
+        top, bottom = extremos(df, 'Cantidad', k)
+        pd.testing.assert_frame_equal(top, df.nlargest(k, 'Cantidad'))
+        pd.testing.assert_frame_equal(bottom, df.nsmallest(k, 'Cantidad'))
+    # Con k mayor que la tabla nlargest ordena todo sin estabilidad y deja el vacío al final;
+    # aquí el vacío no entra y los empates siguen en orden de aparición
+    top, bottom = extremos(df, 'Cantidad', 10)
+    pd.testing.assert_frame_equal(top, df.dropna().sort_values('Cantidad', ascending=False, kind='stable'))
+    pd.testing.assert_frame_equal(bottom, df.dropna().sort_values('Cantidad', kind='stable'))
+
+    # Por grupo, en el orden de groupby
+    grupos = df.groupby('Familia', observed=True)
+    for k in (1, 2):
+        top, bottom = extremos(df, 'Cantidad', k, por='Familia')
+        pd.testing.assert_frame_equal(top, pd.concat([g.nlargest(k, 'Cantidad') for _, g in grupos]))
+        pd.testing.assert_frame_equal(bottom, pd.concat([g.nsmallest(k, 'Cantidad') for _, g in grupos]))
+
+    # Con k=1 coincide con idxmax/idxmin, como la talla más y menos devuelta por familia
+    top, bottom = extremos(df, 'Cantidad', por='Familia')
+    pd.testing.assert_frame_equal(top, df.loc[grupos['Cantidad'].idxmax()])
+    pd.testing.assert_frame_equal(bottom, df.loc[grupos['Cantidad'].idxmin()])
+    assert top['Talla'].tolist() == ['S', 'M', 'M']
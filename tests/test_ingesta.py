@@ -0,0 +1,148 @@
+"""Pruebas de la ingesta: lectura en streaming y anexado de un periodo nuevo a un histórico codificado"""
+
+import datetime
+import io
+import os
+import sys
+
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingesta  # noqa: E402
+from ingesta import (  # noqa: E402
+    DIMENSION_PRODUCTO, DIMENSION_TIENDA, HOJA_COMPRA, HOJA_TRASPASOS, HOJA_VENTAS, aplicar_esquema, anexar_libro,
+    codificar_claves, completar_dimensiones, dimension_producto, dimension_tienda, leer_hoja_streaming
+)
+
+
+def _ventas(fechas, tiendas, acts, tallas):
+    return pd.DataFrame({
+        'Fecha Documento': fechas,
+        'NombreTPV': tiendas,
+        'ACT': acts,
+        'Talla': tallas,
+        'Temporada': ['I2025'] * len(fechas),
+        'Descripción Familia': ['CAMISA'] * len(fechas),
+        'Zona geográfica': ['MADRID'] * len(fechas),
+        'Cantidad': [1] * len(fechas),
+        'Subtotal': [10.0] * len(fechas),
+    })
+
+
+def _traspasos(fechas, tiendas, acts, tallas):
+    return pd.DataFrame({
+        'ACT': acts,
+        'Talla': tallas,
+        'Tienda': tiendas,
+        'Temporada': ['I2025'] * len(fechas),
+        'Fecha Enviado': fechas,
+        'Enviado': [2] * len(fechas),
+    })
+
+
+def _historico():
+    tablas = {
+        HOJA_VENTAS: _ventas(['01/09/2025', '02/09/2025'], ['T1', 'T2'], ['ACT000000000001', 'ACT000000000002'], ['M', 'L']),
+        HOJA_COMPRA: pd.DataFrame({
+            'ACT': ['ACT000000000001', 'ACT000000000002'],
+            'Talla': ['M', 'L'],
+            'Tema': ['T_OI25_X', 'T_OI25_Y'],
+            'Fecha REAL entrada en almacén': ['01/08/2025', '01/08/2025'],
+            'Cantidad Pedida': [5, 5],
+        }),
+        HOJA_TRASPASOS: _traspasos(['20/08/2025'], ['T1'], ['ACT000000000001'], ['M']),
+    }
+    return completar_dimensiones(codificar_claves({hoja: aplicar_esquema(df, hoja) for hoja, df in tablas.items()}))
+
+
+def _libro_ventas():
+    """Libro con la hoja de ventas: fechas como texto y como fecha, tallas numéricas y de letra,
+    un alias, vacíos, una fila en blanco y una columna no declarada con tipos mezclados"""
+    libro = Workbook()
+    hoja = libro.active
+    hoja.title = HOJA_VENTAS
+    hoja.append(['Fecha Documento', 'NombreTPV', 'ACT', 'Talla', 'Temporada', 'Descripción Familia',
+                 'Cantidad', 'Subtotal', 'coste', 'Extra'])
+    for fila in [
+        ['01/09/2025', 'T1', 'ACT000000000001', 36, 'I2025', 'CAMISA', 1, 10.5, 4, 'a'],
+        [datetime.datetime(2025, 9, 2), 'T2', 'ACT000000000002', 'M', 'I2025', None, -1, -10.5, 4, 'b'],
+        [None] * 10,
+        ['03/09/2025', 'T1', 'ACT000000000003', 'L', None, 'PANTALON', 2, 30.0, None, 1],
+        ['04/09/2025', 'T3', 'ACT000000000001', 38, 'V2025', 'CAMISA', None, 12.0, 5, 2],
+        ['05/09/2025', 'T2', 'ACT000000000004', 'XS', 'V2025', 'VESTIDO', 3, 45.0, 6, None],
+    ]:
+        hoja.append(fila)
+    buffer = io.BytesIO()
+    libro.save(buffer)
+    return buffer.getvalue()
+
+
+def test_lectura_en_streaming_coincide_con_read_excel(monkeypatch):
+    data = _libro_ventas()
+    # read_excel conserva la fila en blanco como una fila vacía; el streaming la salta
+    completa = pd.read_excel(io.BytesIO(data), sheet_name=HOJA_VENTAS, engine='openpyxl')
+    completa = aplicar_esquema(completa.dropna(how='all').reset_index(drop=True), HOJA_VENTAS)
+
+    # Lotes de dos filas: cada lote ve otros valores (y otro diccionario) de cada columna
+    por_lotes = leer_hoja_streaming(data, HOJA_VENTAS, tamano_lote=2)
+    pd.testing.assert_frame_equal(por_lotes, completa)
+    assert por_lotes.attrs == completa.attrs
+    # La columna no declarada se infiere sobre la hoja completa: mezcla texto y números, queda como texto
+    assert por_lotes['Extra'].iloc[:4].tolist() == ['a', 'b', '1', '2']
+
+    # Por encima del umbral la hoja de ventas se parsea en streaming
+    monkeypatch.setattr(ingesta, 'UMBRAL_STREAMING_BYTES', 0)
+    pd.testing.assert_frame_equal(ingesta._parsear_hoja(data, HOJA_VENTAS), completa)
+
+
+def test_anexar_delta_a_historico_codificado():
+    historico = _historico()
+    delta = {
+        HOJA_VENTAS: aplicar_esquema(
+            _ventas(['01/10/2025', '02/10/2025'], ['T1', 'T3'], ['ACT000000000001', 'ACT000000000003'], ['M', 'XL']),
+            HOJA_VENTAS
+        ),
+        HOJA_TRASPASOS: aplicar_esquema(
+            _traspasos(['25/09/2025'], ['T3'], ['ACT000000000003'], ['XL']), HOJA_TRASPASOS
+        ),
+    }
+
+    tablas, anadidas = anexar_libro(historico, delta)
+
+    assert anadidas == {HOJA_VENTAS: 2, HOJA_TRASPASOS: 1}
+    ventas = tablas[HOJA_VENTAS]
+    assert len(ventas) == 4
+    assert ventas['ACT_14'].notna().all()
+    assert list(ventas['ACT_14'].astype(str)) == ['ACT00000000000'] * 4
+    assert ventas['ACT'].dtype == tablas[HOJA_TRASPASOS]['ACT'].dtype == tablas[HOJA_COMPRA]['ACT'].dtype
+    assert tablas[HOJA_TRASPASOS]['ACT_14'].dtype == ventas['ACT_14'].dtype
+
+
+def test_anexar_amplia_diccionarios_y_dimensiones_con_el_delta():
+    historico = _historico()
+    codigos_act = historico[HOJA_VENTAS]['ACT'].cat.codes.copy()
+    delta = {
+        HOJA_VENTAS: aplicar_esquema(
+            _ventas(['01/10/2025', '02/10/2025'], ['T0', 'T2'], ['ACT000000000000', 'ACT000000000002'], ['M', 'XS']),
+            HOJA_VENTAS
+        ),
+    }
+
+    tablas, _ = anexar_libro(historico, delta)
+
+    ventas = tablas[HOJA_VENTAS]
+    # Valores nuevos al final del diccionario: el histórico conserva sus códigos
+    assert list(ventas['ACT'].cat.categories[-1:]) == ['ACT000000000000']
+    assert ventas['ACT'].cat.codes[:2].tolist() == codigos_act.tolist()
+    assert ventas['NombreTPV'].dtype == tablas[HOJA_TRASPASOS]['Tienda'].dtype
+    # La talla es ordenada: la nueva se coloca por orden de talla
+    assert list(ventas['Talla'].cat.categories) == ['XS', 'M', 'L']
+
+    # Las dimensiones actualizadas con el delta coinciden con las recalculadas sobre todo
+    producto = dimension_producto(tablas)
+    tienda = dimension_tienda(tablas)
+    pd.testing.assert_frame_equal(tablas[DIMENSION_PRODUCTO], producto, check_categorical=False)
+    pd.testing.assert_frame_equal(tablas[DIMENSION_TIENDA], tienda, check_categorical=False)
+    assert tienda.set_index(tienda['NombreTPV'].astype(str)).loc['T2', 'Importe'] == 20.0
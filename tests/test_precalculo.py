@@ -0,0 +1,111 @@
+"""Pruebas de la caché en memoria de precalculo (LRU por entradas y por bytes)"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import precalculo  # noqa: E402
+from precalculo import obtener  # noqa: E402
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def cache_vacia(monkeypatch):
+    monkeypatch.setattr(precalculo, '_entradas', type(precalculo._entradas)())
+    monkeypatch.setattr(precalculo, '_tamanos', {})
+
+
+def _tabla(mb):
+    return pd.DataFrame({'x': np.zeros(mb * MB // 8)})
+
+
+def test_tamano_de_resultados_anidados():
+    tabla = _tabla(1)
+    resultado = {'tabla': tabla, 'serie': (tabla['x'], np.zeros(10)), 'texto': 'x'}
+    esperado = tabla.memory_usage(index=True).sum() + tabla['x'].memory_usage(index=True) + 80
+    assert precalculo._tamano(resultado) == esperado
+
+
+def test_desaloja_por_bytes_las_menos_usadas(monkeypatch):
+    monkeypatch.setattr(precalculo, 'PRESUPUESTO_BYTES', 3 * MB + 1024)
+    for clave in 'abc':
+        obtener(clave, _tabla, 1)
+    # Usar 'a' la hace la más reciente: al pasarse del presupuesto sale 'b'
+    obtener('a', _tabla, 1)
+    obtener('d', _tabla, 1)
+
+    assert list(precalculo._entradas) == ['c', 'a', 'd']
+    assert sum(precalculo._tamanos.values()) <= precalculo.PRESUPUESTO_BYTES
+
+
+def test_desaloja_por_numero_de_entradas(monkeypatch):
+    monkeypatch.setattr(precalculo, 'MAX_ENTRADAS', 2)
+    for clave in 'abc':
+        obtener(clave, lambda: clave)
+
+    assert list(precalculo._entradas) == ['b', 'c']
+
+
+def test_conserva_la_entrada_nueva_aunque_supere_el_presupuesto(monkeypatch):
+    monkeypatch.setattr(precalculo, 'PRESUPUESTO_BYTES', MB)
+    obtener('a', _tabla, 1)
+    grande = obtener('b', _tabla, 2)
+
+    assert list(precalculo._entradas) == ['b']
+    assert obtener('b', _tabla, 2) is grande
+
+
+def test_no_cachea_los_errores():
+    llamadas = []
+
+    def falla():
+        llamadas.append(1)
+        raise ValueError("fallo")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            obtener('a', falla)
+    assert len(llamadas) == 2
+    assert 'a' not in precalculo._entradas and 'a' not in precalculo._tamanos
+
+
+def test_llamadas_concurrentes_calculan_una_vez():
+    llamadas = []
+    empezar = threading.Event()
+
+    def lenta():
+        llamadas.append(1)
+        empezar.wait(5)
+        return 'hecho'
+
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(obtener('a', lenta))) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    empezar.set()
+    for hilo in hilos:
+        hilo.join()
+
+    assert resultados == ['hecho'] * 4
+    assert len(llamadas) == 1
+
+
+def test_descartar_quita_todas_las_versiones_de_una_funcion():
+    @precalculo.por_version
+    def suma(a, b):
+        return a + b
+
+    assert suma(1, 2, version='v1') == 3
+    assert suma(1, 2, version='v2') == 3
+    obtener(('v1', 'cubo'), lambda: 'cubo')
+
+    precalculo.descartar(suma)
+
+    assert list(precalculo._entradas) == [('v1', 'cubo')]